@@ -6,7 +6,7 @@ import tempfile
 import time
 from collections import OrderedDict
 from pathlib import Path
-from typing import NamedTuple, Type
+from typing import NamedTuple, Optional, Type
 
 import espresso_config as es
 import numpy as np
@@ -26,6 +26,7 @@ class Results(NamedTuple):
     sequence_length: int
     embedding_dim: int
     backend_name: str
+    profile: str
     embedding_type: str
     seed: int
     write_time: float
@@ -42,6 +43,7 @@ def bench(
     Backend: Type[BaseKVStorage],
     embedding_lib: str,
     embedding_type: str,
+    profile: Optional[str] = None,
     seed: int = 42,
 ) -> Results:
     random.seed(seed)
@@ -56,8 +58,13 @@ def bench(
 
     backend_name = Backend.__name__
 
+    # only the rocksdb backends take a profile
+    backend_kwargs = {}
+    if profile:
+        backend_kwargs = dict(profile=profile, value_size=array.nbytes)
+
     try:
-        db = Backend(path)
+        db = Backend(path, **backend_kwargs)
         order = [str(i) for i in range(num_sequences)]
         start = time.time()
 
@@ -70,8 +77,9 @@ def bench(
         db_size = sum(get_file_size(f) for f in db.files())
 
         # fresh new database
+        db.close()
         del db
-        db = Backend(path, read_only=True)
+        db = Backend(path, read_only=True, **backend_kwargs)
 
         # read in different order from read
         random.shuffle(order)
@@ -82,6 +90,7 @@ def bench(
             db.batch_read(order[i:e])
 
         read_time = time.time() - start
+        db.close()
         del db
 
     finally:
@@ -97,6 +106,7 @@ def bench(
         sequence_length=sequence_length,
         embedding_dim=embedding_dim,
         backend_name=backend_name,
+        profile=profile or "",
         embedding_type=embedding_type,
         seed=seed,
         write_time=write_time,
@@ -114,6 +124,8 @@ class Config(es.ConfigNode):
     embedding_dim: es.ConfigParam(list) = [1024]
     chunk_size: es.ConfigParam(list) = [128]
     backend: es.ConfigParam(str) = "rocksdict"
+    # RocksDB tuning profiles to sweep; "" opens the backend without one
+    profile: es.ConfigParam(list) = [""]
     embedding_type: es.ConfigParam(str) = "float32"
     embedding_lib: es.ConfigParam(str) = "torch"
     path: es.ConfigParam(Path) = Path(tempfile.gettempdir()) / "bench.db"
@@ -127,13 +139,14 @@ def main(config: Config):
         sequence_length=config.sequence_length,
         embedding_dim=config.embedding_dim,
         chunk_size=config.chunk_size,
+        profile=config.profile,
     )
     experiments_combinations = itertools.product(*experiments.values())
     if config.mode == "plot":
         experiments_combinations = tqdm(experiments_combinations, unit=" ex")
 
     results = []
-    for n, s, d, c in experiments_combinations:
+    for n, s, d, c, p in experiments_combinations:
         result = bench(
             num_sequences=n,
             chunk_size=c,
@@ -141,6 +154,7 @@ def main(config: Config):
             embedding_dim=d,
             embedding_lib=config.embedding_lib,
             embedding_type=config.embedding_type,
+            profile=p,
             path=config.path,
             Backend=BackendRegistry.get(config.backend),
         )
@@ -162,6 +176,7 @@ def main(config: Config):
             x="num_sequences",
             y="write_time",
             color="chunk_size",
+            line_dash="profile",
         )
         fig.write_image(config.save_dir / "write_time.jpg")
 
@@ -171,6 +186,7 @@ def main(config: Config):
             x="num_sequences",
             y="read_time",
             color="chunk_size",
+            line_dash="profile",
         )
         fig.write_image(config.save_dir / "read_time.jpg")
 
@@ -34,7 +34,22 @@ class CacheConfig(sp.DataClass):
     _target_: str = sp.Target.to_string(CachingHook)
     path: str = "/tmp/r3"
     backend: str = "leveldb"
+    # e.g. {"ingest": true} to record a rocksdict cache through SST files
+    backend_kwargs: Dict[str, Any] = sp.field(default_factory=dict)
     half_precision: bool = False
+    ragged: bool = False
+    pad_token_id: int = 0
+    per_example_keys: bool = False
+    hash_keys: bool = False
+    hash_check: bool = False
+    namespace: Optional[str] = None
+    write_behind: int = -1
+    write_batch_size: int = 0
+    write_batch_bytes: int = 0
+    pin_memory: bool = False
+    memory_cache: Optional[int] = None
+    # "int8" or "bf16" to store activations in a smaller encoding
+    codec: Optional[str] = None
 
 
 @sp.dataclass
@@ -77,6 +92,8 @@ class FetchConfig(sp.DataClass):
     fetch_spawn: str = "thread"
     fetch_timeout: float = 0.1
     fetch_retry_count: int = 100
+    fetch_workers: int = 1
+    fetch_slot_size: int = 32 << 20
 
 
 @sp.dataclass
@@ -12,11 +12,17 @@ import pyarrow
 import torch
 
 try:
-    from s2re.backend.serialization import PickleSerialization
+    from s2re.backend.serialization import (
+        BinarySerialization,
+        PickleSerialization,
+    )
 except ImportError:
     src = Path(__file__).parent / ".." / "src"
     sys.path.append(str(src))
-    from s2re.backend.serialization import PickleSerialization
+    from s2re.backend.serialization import (
+        BinarySerialization,
+        PickleSerialization,
+    )
 
 
 class Benchmark(ABC):
@@ -54,6 +60,17 @@ class LibImplementation(Benchmark):
         return PickleSerialization.deserialize(b)
 
 
+@Benchmark.register
+class LibBinaryImplementation(Benchmark):
+    @staticmethod
+    def save(t: torch.Tensor) -> bytes:
+        return BinarySerialization.serialize(t)
+
+    @staticmethod
+    def load(b: bytes) -> torch.Tensor:
+        return BinarySerialization.deserialize(b)
+
+
 @Benchmark.register
 class ViaPickleWithBuffers(Benchmark):
     @staticmethod
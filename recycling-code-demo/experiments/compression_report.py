@@ -0,0 +1,164 @@
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple
+
+import datasets
+import espresso_config as es
+import pandas as pd
+import plotly.express as px
+import torch
+import transformers
+from tqdm import tqdm
+
+from s2re.codecs import (
+    BaseCodec,
+    BFloat16Codec,
+    Int8Codec,
+    LearnedCodec,
+    PCACodec,
+    PQCodec,
+    decode,
+)
+
+
+class Results(NamedTuple):
+    layer: int
+    codec: str
+    setting: str
+    compression_ratio: float
+    relative_error: float
+
+
+def collect_hidden_states(config: "Config") -> Dict[int, torch.Tensor]:
+    """Returns up to twice `sample_size` hidden states (one per token,
+    without padding) of every layer of the backbone."""
+    tokenizer = transformers.AutoTokenizer.from_pretrained(config.backbone)
+    model = transformers.AutoModel.from_pretrained(config.backbone)
+    model = model.eval().to(config.device)
+
+    dataset = datasets.load_dataset(config.dataset, split=config.split)
+    texts = dataset[config.text_field][: config.num_samples]
+
+    max_rows = 2 * config.sample_size
+    rows: Dict[int, List[torch.Tensor]] = {}
+    num_rows = 0
+    with torch.no_grad():
+        for i in tqdm(range(0, len(texts), config.batch_size), unit=" batch"):
+            batch = tokenizer(
+                texts[i : i + config.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=config.max_length,
+                return_tensors="pt",
+            ).to(config.device)
+            outputs = model(**batch, output_hidden_states=True)
+            mask = batch["attention_mask"].bool()
+            for layer, hidden in enumerate(outputs.hidden_states):
+                rows.setdefault(layer, []).append(hidden[mask].cpu())
+            num_rows += int(mask.sum())
+            if num_rows >= max_rows:
+                break
+
+    return {
+        layer: torch.cat(tensors)[:max_rows] for layer, tensors in rows.items()
+    }
+
+
+def nbytes(value) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    return sum(nbytes(v) for v in value.values())
+
+
+def evaluate(
+    codec: BaseCodec, fit_rows: torch.Tensor, eval_rows: torch.Tensor
+) -> Results:
+    if isinstance(codec, LearnedCodec):
+        codec.observe(fit_rows)
+        codec.fit_sample()
+    encoded = codec.encode(eval_rows)
+    decoded = decode(encoded, codec)
+    error = (decoded.float() - eval_rows).norm() / eval_rows.norm()
+    return Results(
+        layer=-1,
+        codec=codec.name,
+        setting="",
+        compression_ratio=nbytes(encoded) / nbytes(eval_rows),
+        relative_error=error.item(),
+    )
+
+
+class Config(es.ConfigNode):
+    backbone: es.ConfigParam(str) = "bert-base-uncased"
+    dataset: es.ConfigParam(str) = "imdb"
+    split: es.ConfigParam(str) = "train"
+    text_field: es.ConfigParam(str) = "text"
+    num_samples: es.ConfigParam(int) = 1000
+    max_length: es.ConfigParam(int) = 512
+    batch_size: es.ConfigParam(int) = 16
+    device: es.ConfigParam(str) = "cpu"
+    # layers to report on (0 is the embeddings); all of them if empty
+    layers: es.ConfigParam(list) = []
+    # learned codecs are fitted on `sample_size` hidden states, and
+    # evaluated on as many other ones
+    sample_size: es.ConfigParam(int) = 8192
+    pca_rank: es.ConfigParam(list) = [32, 64, 128, 256]
+    pq_subvectors: es.ConfigParam(list) = [16, 32, 64, 128]
+    save_dir: es.ConfigParam(Path) = Path(__file__).parent / ".." / "results"
+
+
+@es.cli(Config)
+def main(config: Config):
+    hidden_states = collect_hidden_states(config)
+    layers = config.layers or sorted(hidden_states)
+
+    # learned codecs are fitted again for every layer
+    codecs: Dict[str, Callable[[], BaseCodec]] = {
+        "": BFloat16Codec,
+        "token": partial(Int8Codec, axis="token"),
+        "channel": partial(Int8Codec, axis="channel"),
+        **{
+            f"rank={r}": partial(
+                PCACodec, rank=r, sample_size=config.sample_size
+            )
+            for r in config.pca_rank
+        },
+        **{
+            f"subvectors={m}": partial(
+                PQCodec, num_subvectors=m, sample_size=config.sample_size
+            )
+            for m in config.pq_subvectors
+        },
+    }
+
+    results = []
+    for layer in tqdm(layers, unit=" layer"):
+        rows = hidden_states[layer]
+        fit_rows, eval_rows = rows.split(len(rows) // 2)[:2]
+        for setting, new_codec in codecs.items():
+            result = evaluate(new_codec(), fit_rows, eval_rows)
+            results.append(result._replace(layer=layer, setting=setting))
+
+    results_df = pd.DataFrame(results, columns=Results._fields)
+    print(results_df.to_string(index=False))
+
+    if not config.save_dir.exists():
+        config.save_dir.mkdir(parents=True)
+    results_df.to_csv(config.save_dir / "compression.csv")
+
+    fig = px.scatter(
+        results_df,
+        title="Reconstruction Error",
+        x="compression_ratio",
+        y="relative_error",
+        color="codec",
+        facet_col="layer",
+        facet_col_wrap=4,
+        hover_data=["setting"],
+        log_y=True,
+    )
+    fig.write_image(config.save_dir / "compression.jpg")
+
+
+if __name__ == "__main__":
+    main()
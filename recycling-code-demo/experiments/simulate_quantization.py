@@ -0,0 +1,99 @@
+from collections import abc
+from typing import Callable, Dict
+
+import torch
+import transformers
+
+from s2re.backend.serialization import BinarySerialization
+from s2re.codecs import BFloat16Codec, Int8Codec, decode
+
+
+def add_simulation(
+    model: torch.nn.Module, path: str, roundtrip: Callable, sizes: list
+):
+    """Simulates storing the output of a submodule with `roundtrip`;
+    the size of each stored output is appended to `sizes`"""
+    submodule = model.get_submodule(path)
+
+    prev_forward = submodule.forward
+
+    def forward(*args, **kwargs):
+        out = prev_forward(*args, **kwargs)
+        if isinstance(out, tuple):
+            out = list(out)
+        stored, out = roundtrip(out)
+        sizes.append(BinarySerialization.serialized_size(to_numpy(stored)))
+        return out
+
+    submodule.forward = forward
+    return prev_forward
+
+
+def to_numpy(value):
+    if isinstance(value, torch.Tensor):
+        return value.detach().numpy()
+    elif isinstance(value, abc.Mapping):
+        return {k: to_numpy(v) for k, v in value.items()}
+    return [to_numpy(v) for v in value]
+
+
+def fp16(value):
+    if isinstance(value, torch.Tensor):
+        stored = value.to(torch.float16)
+        return stored, stored.to(value.dtype)
+    pairs = [fp16(v) for v in value]
+    return [s for s, _ in pairs], [o for _, o in pairs]
+
+
+def codec_roundtrip(codec):
+    def roundtrip(value):
+        stored = codec.encode(value)
+        return stored, decode(stored, codec)
+
+    return roundtrip
+
+
+ROUNDTRIPS: Dict[str, Callable] = {
+    "fp32": lambda value: (value, value),
+    "fp16": fp16,
+    "bf16": codec_roundtrip(BFloat16Codec()),
+    "int8 (per token)": codec_roundtrip(Int8Codec(axis="token")),
+    "int8 (per channel)": codec_roundtrip(Int8Codec(axis="channel")),
+    "int8 (zero point)": codec_roundtrip(Int8Codec(zero_point=True)),
+}
+
+
+model = transformers.BertForSequenceClassification.from_pretrained(
+    "bert-base-uncased"
+).eval()
+
+tokenizer = transformers.BertTokenizer.from_pretrained("bert-base-uncased")
+tokenized_input = tokenizer(
+    [
+        "This is a test",
+        "Embedding recycling caches the output of intermediate layers.",
+        "Quantized activations take a quarter of the space.",
+    ],
+    padding=True,
+    return_tensors="pt",
+)
+
+with torch.no_grad():
+    out_fp32 = model(**tokenized_input)
+
+    path = "bert.encoder.layer.6"
+    results = []
+    for name, roundtrip in ROUNDTRIPS.items():
+        sizes: list = []
+        prev_forward = add_simulation(model, path, roundtrip, sizes)
+        out = model(**tokenized_input)
+        model.get_submodule(path).forward = prev_forward
+
+        diff = (out.logits - out_fp32.logits).abs()
+        results.append((name, diff.mean().item(), diff.max().item(), sizes))
+
+fp32_size = sum(results[0][3])
+print(f"{'storage':<20}{'mean diff':>12}{'max diff':>12}{'size':>8}")
+for name, mean_diff, max_diff, sizes in results:
+    ratio = sum(sizes) / fp32_size
+    print(f"{name:<20}{mean_diff:>12.2e}{max_diff:>12.2e}{ratio:>8.1%}")
@@ -1,9 +1,14 @@
 # flake8: noqa
 
+from .arrow import ArrowStorage
 from .base import BackendRegistry, BaseKVStorage
 from .dbm import DbmStorage
+from .flat import FlatStorage
 from .leveldb import LevelDBStorage
+from .lmdb import LMDBStorage
 from .mem import MemoryStorage
+from .profiles import ROCKSDB_PROFILES, RocksDBProfile
 from .rocksdb import RocksDBStorage
 from .rocksdict import RocksDictStorage
+from .sharded import ShardedStorage
 from .unqlite import UnQLiteStorage
@@ -0,0 +1,360 @@
+import os
+import warnings
+from collections import abc
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
+
+import numpy as np
+import torch
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from ..types import HookComboKeyType, HookComboValueType
+from .base import BackendRegistry, BaseKVStorage
+
+
+class ArrowRow(NamedTuple):
+    """Location of a value: the part file and record batch it is in, its
+    row in the batch, and its position among the rows of all parts."""
+
+    part: int
+    batch: int
+    row: int
+    position: int
+
+
+class ArrowColumn(NamedTuple):
+    """The `value` column of a record batch, as numpy views."""
+
+    offsets: np.ndarray
+    data: np.ndarray
+    width: int
+
+
+@BackendRegistry.reg("arrow")
+class ArrowStorage(BaseKVStorage):
+    """A storage that appends values as rows of Arrow IPC stream files,
+    which are memory-mapped on read.
+
+    Every session that writes to the storage starts a new part file
+    (`part-00000.arrow`, `part-00001.arrow`, ...), and every
+    `batch_write` appends a record batch with one row per value, in the
+    order they were written. The first array written to a part sets the
+    type of its `value` column, a list of fixed size lists: arrays (or
+    lists holding one array, like the outputs of most layers) of that
+    dtype and last dimension are stored there as rows of their last
+    dimension, next to their `shape`. Any other value (e.g. one encoded
+    with a codec) is serialized into the `blob` column instead. Reads
+    return numpy views of the memory-mapped files.
+
+    Rows written in the current session become readable when a read
+    needs one of them, which ends the part being written (the next write
+    starts a new one). If the writer of the last part was interrupted,
+    the record batches it completed are kept, and the incomplete one is
+    ignored (and cut off the file, if the storage is writable).
+
+    Rows are never rewritten: the last row written for a key wins, and
+    deleting a key appends a row without a value. Since rows keep the
+    order values were written in, parts can be loaded as a HuggingFace
+    dataset next to the examples they were recorded from (see
+    `s2re.data.add_cached_column`), using `rows` to find the position of
+    each key once.
+    """
+
+    db: Dict[bytes, ArrowRow]
+
+    PART_TEMPLATE = "part-{:05d}.arrow"
+    PART_GLOB = "part-*.arrow"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if pa is None:
+            raise ImportError("pyarrow is not installed.")
+
+        if self.path is None:
+            raise ValueError("ArrowStorage requires a path.")
+        if not self.read_only:
+            self.path.mkdir(parents=True, exist_ok=True)
+        elif not self.path.exists():
+            raise FileNotFoundError(f"No Arrow storage at {self.path}")
+
+        self.db = {}
+        self.part_paths: List[Path] = []
+        self._batches: List[List[Any]] = []
+        self._columns: Dict[Tuple[int, int], ArrowColumn] = {}
+        self._num_rows = 0
+
+        self._writer: Optional[Any] = None
+        self._writer_path: Optional[Path] = None
+        self._writer_keys: Set[bytes] = set()
+        self._schema: Optional[Any] = None
+
+        part_paths = sorted(self.path.glob(self.PART_GLOB))
+        for i, part_path in enumerate(part_paths):
+            self._load_part(part_path, last=i == len(part_paths) - 1)
+
+    @classmethod
+    def files(cls: Type["ArrowStorage"], path: Path) -> Iterable[Path]:
+        return sorted(Path(path).glob(cls.PART_GLOB))
+
+    def _load_part(self, part_path: Path, last: bool = True) -> None:
+        part = len(self._batches)
+        batches: List[Any] = []
+        source = pa.memory_map(str(part_path))
+        # the end of the last complete message
+        end = 0
+        try:
+            reader = pa.ipc.open_stream(source)
+            end = source.tell()
+            while True:
+                batches.append(reader.read_next_batch())
+                end = source.tell()
+        except StopIteration:
+            pass
+        except (pa.ArrowInvalid, OSError) as e:
+            if not last:
+                raise ValueError(f"{part_path} is corrupt") from e
+            warnings.warn(
+                f"Ignoring {source.size() - end} bytes at the end of "
+                f"{part_path}, whose writer was interrupted"
+            )
+            if not self.read_only:
+                if end == 0:
+                    part_path.unlink()
+                    return
+                os.truncate(part_path, end)
+
+        for index, batch in enumerate(batches):
+            keys = batch.column("key").to_pylist()
+            deleted = np.logical_not(
+                np.logical_or(
+                    batch.column("value").is_valid().to_numpy(False),
+                    batch.column("blob").is_valid().to_numpy(False),
+                )
+            )
+            for row, (key, is_deleted) in enumerate(zip(keys, deleted)):
+                if is_deleted:
+                    self.db.pop(key, None)
+                else:
+                    position = self._num_rows + row
+                    self.db[key] = ArrowRow(part, index, row, position)
+            self._num_rows += batch.num_rows
+
+        self.part_paths.append(part_path)
+        self._batches.append(batches)
+
+    def _column(self, part: int, batch: int) -> ArrowColumn:
+        if (part, batch) not in self._columns:
+            values = self._batches[part][batch].column("value")
+            self._columns[part, batch] = ArrowColumn(
+                offsets=values.offsets.to_numpy(),
+                data=values.values.flatten().to_numpy(zero_copy_only=True),
+                width=values.type.value_type.list_size,
+            )
+        return self._columns[part, batch]
+
+    def _get(self, key: bytes) -> HookComboValueType:
+        location = self.db[key]
+        batch = self._batches[location.part][location.batch]
+
+        blob = batch.column("blob")[location.row]
+        if blob.is_valid:
+            return self.sr.deserialize(blob.as_buffer())
+
+        column = self._column(location.part, location.batch)
+        start, end = column.offsets[location.row : location.row + 2]
+        array = column.data[start * column.width : end * column.width]
+        array = array.reshape(batch.column("shape")[location.row].as_py())
+        if batch.column("in_list")[location.row].as_py():
+            return [array]
+        return array
+
+    def rows(self, keys: Iterable[HookComboKeyType]) -> List[int]:
+        """Returns the position of the value of each key among the rows
+        of all parts (in `part_paths` order); raises a ValueError for
+        values that are not in the `value` column."""
+        keys = list(keys)
+        self._make_readable([self.sr.key(k) for k in keys])
+        positions = []
+        for key in keys:
+            location = self.db[self.sr.key(key)]
+            blob = self._batches[location.part][location.batch].column("blob")
+            if blob[location.row].is_valid:
+                raise ValueError(
+                    f"The value of {key!r} is not stored as an array "
+                    "of the type of the value column"
+                )
+            positions.append(location.position)
+        return positions
+
+    @staticmethod
+    def _as_array(value: Any) -> Optional[np.ndarray]:
+        """The array a value holds, if it is one (or a list of one) that
+        can be stored in a value column."""
+        if isinstance(value, abc.Sequence) and len(value) == 1:
+            value = value[0]
+        if isinstance(value, torch.Tensor):
+            if value.dtype == torch.bfloat16:
+                return None
+            value = value.detach().cpu().numpy()
+        if (
+            isinstance(value, np.ndarray)
+            and value.dtype.kind in "iuf"
+            and value.ndim > 0
+            and value.shape[-1] > 0
+        ):
+            return value
+        return None
+
+    def _value_type(self, array: np.ndarray) -> Any:
+        return pa.list_(
+            pa.list_(pa.from_numpy_dtype(array.dtype), array.shape[-1])
+        )
+
+    def _open_writer(self, values: Sequence[Any]) -> None:
+        arrays = (self._as_array(v) for v in values)
+        first = next((a for a in arrays if a is not None), None)
+        self._schema = pa.schema(
+            [
+                ("key", pa.binary()),
+                (
+                    "value",
+                    self._value_type(
+                        first if first is not None else np.empty((1, 1))
+                    ),
+                ),
+                ("shape", pa.list_(pa.int64())),
+                ("in_list", pa.bool_()),
+                ("blob", pa.large_binary()),
+            ]
+        )
+        self._writer_path = self.path / self.PART_TEMPLATE.format(
+            len(self.part_paths)
+        )
+        self._writer = pa.ipc.new_stream(str(self._writer_path), self._schema)
+
+    def _close_writer(self) -> None:
+        """Ends the part being written, and makes its rows readable."""
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        self._writer_keys = set()
+        self._load_part(self._writer_path)
+        self._writer_path = None
+
+    def _make_readable(self, keys: Iterable[bytes]) -> None:
+        """Ends the part being written if it has rows of any of `keys`."""
+        if self._writer_keys and not self._writer_keys.isdisjoint(keys):
+            self._close_writer()
+
+    def _record_batch(
+        self, keys: Sequence[bytes], values: Sequence[Any]
+    ) -> Any:
+        value_type = self._schema.field("value").type
+        arrays: List[np.ndarray] = []
+        offsets = [0]
+        shapes: List[Optional[List[int]]] = []
+        in_list: List[Optional[bool]] = []
+        blobs: List[Optional[bytes]] = []
+        is_null: List[bool] = []
+
+        for value in values:
+            array = None if value is None else self._as_array(value)
+            if array is not None and self._value_type(array) != value_type:
+                array = None
+
+            if array is not None:
+                arrays.append(array.reshape(-1))
+                shapes.append(list(array.shape))
+                in_list.append(isinstance(value, abc.Sequence))
+                blobs.append(None)
+            else:
+                # deleted keys have neither a value nor a blob
+                shapes.append(None)
+                in_list.append(None)
+                blobs.append(
+                    None if value is None else self.sr.serialize(value)
+                )
+            is_null.append(array is None)
+            offsets.append(
+                offsets[-1]
+                + (0 if array is None else array.size // array.shape[-1])
+            )
+
+        item_type = value_type.value_type
+        data = (
+            np.concatenate(arrays)
+            if arrays
+            else np.empty(0, dtype=item_type.value_type.to_pandas_dtype())
+        )
+        value_column = pa.ListArray.from_arrays(
+            pa.array(offsets, type=pa.int32()),
+            pa.FixedSizeListArray.from_arrays(
+                pa.array(data), item_type.list_size
+            ),
+            mask=pa.array(is_null, type=pa.bool_()),
+        )
+        return pa.record_batch(
+            [
+                pa.array(keys, type=pa.binary()),
+                value_column,
+                pa.array(shapes, type=pa.list_(pa.int64())),
+                pa.array(in_list, type=pa.bool_()),
+                pa.array(blobs, type=pa.large_binary()),
+            ],
+            schema=self._schema,
+        )
+
+    def _append(
+        self, keys: Iterable[HookComboKeyType], values: Sequence[Any]
+    ) -> None:
+        if self.read_only:
+            raise RuntimeError("Cannot write to a read-only ArrowStorage.")
+        if self._writer is None:
+            self._open_writer(values)
+        keys = [self.sr.key(k) for k in keys]
+        self._writer.write_batch(self._record_batch(keys, values))
+        self._writer_keys.update(keys)
+
+    def close(self) -> None:
+        self._close_writer()
+        # arrays handed out by `batch_read` keep their own reference to
+        # the memory map, so we can only drop ours here.
+        self._batches = []
+        self._columns = {}
+        self.db = {}
+
+    def batch_read(
+        self, keys: Iterable[HookComboKeyType]
+    ) -> Sequence[HookComboValueType]:
+        keys = [self.sr.key(k) for k in keys]
+        # rows are read from complete parts only
+        self._make_readable(keys)
+        return [self._get(k) for k in keys]
+
+    def batch_write(
+        self,
+        keys: Iterable[HookComboKeyType],
+        values: Iterable[HookComboValueType],
+    ) -> None:
+        self._append(keys, list(values))
+
+    def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
+        keys = list(keys)
+        self._append(keys, [None] * len(keys))
@@ -13,7 +13,7 @@ from typing import (
 )
 
 from ..types import BackendValueType, HookComboKeyType, HookComboValueType
-from .serialization import PickleSerialization
+from .serialization import BaseSerialization, get_serialization
 
 
 class DBProtocol(Protocol):
@@ -31,15 +31,21 @@ class BaseKVStorage(ABC):
         - batch_read
     """
 
-    sr: PickleSerialization
+    sr: BaseSerialization
     db: DBProtocol
 
     def __init__(
-        self, path: Optional[Union[str, Path]] = None, read_only: bool = False
+        self,
+        path: Optional[Union[str, Path]] = None,
+        read_only: bool = False,
+        serialization: str = "pickle",
     ):
         """Initializes the storage. If path is None, data is stored in memory.
-        If read only is True, the database is opened in read-only mode."""
-        self.sr = PickleSerialization()
+        If read only is True, the database is opened in read-only mode,
+        which lets several processes read the same storage at once.
+        `serialization` selects how values are turned into bytes; use
+        "binary" for zero-copy reads."""
+        self.sr = get_serialization(serialization)()
         self.path = Path(path) if path is not None else None
         self.read_only = read_only
         self.files = partial(self.files, path=self.path)  # type: ignore
@@ -63,9 +69,15 @@ class BaseKVStorage(ABC):
         """Delete a single element from the storage"""
         return self.batch_delete((key,))
 
+    def close(self) -> None:
+        """Closes the database, releasing its files and locks."""
+        close = getattr(self.db, "close", None)
+        if close is not None:
+            close()
+
     def __exit__(self):
         """Close the database"""
-        self.db.close()
+        self.close()
 
     @abstractclassmethod
     def files(cls: "BaseKVStorage", path: Path) -> Iterable[Path]:
@@ -91,6 +103,15 @@ class BaseKVStorage(ABC):
         (strings will be encoded to bytes)."""
         raise NotImplementedError()
 
+    def batch_read_views(
+        self, keys: Iterable[HookComboKeyType]
+    ) -> Sequence[HookComboValueType]:
+        """Like `batch_read`, but arrays in the values may be read-only
+        views of memory the storage only keeps for as long as they are
+        alive; only for values that are copied elsewhere right away.
+        By default, the same as `batch_read`."""
+        return self.batch_read(keys)
+
     @abstractmethod
     def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
         raise NotImplementedError()
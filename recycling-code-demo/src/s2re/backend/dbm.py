@@ -8,6 +8,11 @@ from .base import BackendRegistry, BaseKVStorage
 
 @BackendRegistry.reg("dbm")
 class DbmStorage(BaseKVStorage):
+    """A key-value storage using whichever dbm implementation is
+    available. The database is opened once and kept open until the
+    storage is closed. In read-only mode, gdbm databases are opened
+    without locking, so any number of processes can read them at once."""
+
     db: dbm
 
     def __init__(self, *args, **kwargs):
@@ -16,27 +21,39 @@ class DbmStorage(BaseKVStorage):
         self.access_type: Literal["r", "c"] = "r" if self.read_only else "c"
         self.str_path = str(self.path)
 
+        flag = self.access_type
+        if self.read_only and dbm.whichdb(self.str_path) == "dbm.gnu":
+            # readers don't need gdbm's lock to exclude each other
+            flag += "u"
+        self.db = dbm.open(self.str_path, flag)
+
     @classmethod
     def files(cls: Type["DbmStorage"], path: Path) -> Iterable[Path]:
         path = Path(path)  # making sure it's a pathlib.Path
         return (f for f in path.parent.glob(f"{path.name}.*") if f.is_file())
 
+    def _sync(self) -> None:
+        # make writes visible to readers opening the database; not all
+        # dbm implementations can do this without closing it.
+        sync = getattr(self.db, "sync", None)
+        if sync is not None:
+            sync()
+
     def batch_read(
         self, keys: Iterable[HookComboKeyType]
     ) -> Sequence[HookComboValueType]:
-        with dbm.open(self.str_path, self.access_type) as db:
-            return [self.sr.deserialize(db[self.sr.key(k)]) for k in keys]
+        return [self.sr.deserialize(self.db[self.sr.key(k)]) for k in keys]
 
     def batch_write(
         self,
         keys: Iterable[HookComboKeyType],
         values: Iterable[HookComboValueType],
     ) -> None:
-        with dbm.open(self.str_path, self.access_type) as db:
-            for key, array in zip(keys, values):
-                db[self.sr.key(key)] = self.sr.serialize(array)
+        for key, array in zip(keys, values):
+            self.db[self.sr.key(key)] = self.sr.serialize(array)
+        self._sync()
 
     def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
-        with dbm.open(self.str_path, self.access_type) as db:
-            for key in keys:
-                del db[self.sr.key(key)]
+        for key in keys:
+            del self.db[self.sr.key(key)]
+        self._sync()
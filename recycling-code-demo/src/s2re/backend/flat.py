@@ -0,0 +1,335 @@
+import mmap
+import pickle
+import warnings
+from collections import abc
+from pathlib import Path
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+import numpy as np
+import torch
+
+from ..types import BackendValueType, HookComboKeyType, HookComboValueType
+from .base import BackendRegistry, BaseKVStorage
+from .serialization import CONTAINER_TYPE
+
+
+class FlatArrayEntry(NamedTuple):
+    """Location of a single array inside the shards."""
+
+    shard: int
+    offset: int
+    dtype: str
+    shape: Tuple[int, ...]
+
+
+class FlatEntry(NamedTuple):
+    """Index entry for a key; `names` is only set for dictionaries."""
+
+    type: CONTAINER_TYPE
+    names: Optional[Tuple[str, ...]]
+    arrays: Tuple[FlatArrayEntry, ...]
+
+
+class FlatShards:
+    """A set of append-only shard files plus a key index.
+
+    Shards are preallocated to `shard_size` bytes and memory-mapped on
+    read; arrays are written C-contiguous at offsets aligned to
+    `alignment` bytes. The index is an append-only log of pickled
+    batches of (key, entry) pairs; a `None` entry marks a deletion.
+    """
+
+    INDEX_NAME = "index.log"
+    SHARD_TEMPLATE = "shard-{:05d}.bin"
+
+    def __init__(
+        self,
+        path: Path,
+        read_only: bool = False,
+        shard_size: int = 1 << 30,
+        alignment: int = 64,
+    ):
+        self.path = path
+        self.read_only = read_only
+        self.shard_size = shard_size
+        self.alignment = alignment
+
+        self.index: Dict[bytes, FlatEntry] = {}
+        self.tails: Dict[int, int] = {}
+        self.capacities: Dict[int, int] = {}
+
+        self._writers: Dict[int, BinaryIO] = {}
+        self._readers: Dict[int, mmap.mmap] = {}
+        self._index_file: Optional[BinaryIO] = None
+
+        if not self.read_only:
+            self.path.mkdir(parents=True, exist_ok=True)
+        elif not self.path.exists():
+            raise FileNotFoundError(f"No flat storage at {self.path}")
+
+        self._load_index()
+
+    def shard_path(self, shard: int) -> Path:
+        return self.path / self.SHARD_TEMPLATE.format(shard)
+
+    def _load_index(self):
+        index_path = self.path / self.INDEX_NAME
+        if not index_path.exists():
+            return
+
+        torn_at = None
+        with open(index_path, "rb") as f:
+            size = f.seek(0, 2)
+            f.seek(0)
+            while True:
+                start = f.tell()
+                if start == size:
+                    break
+                try:
+                    batch = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError, ValueError):
+                    # the last batch was only partly appended, e.g. the
+                    # process died while logging it; its data is lost,
+                    # but everything before it is intact.
+                    torn_at = start
+                    break
+                for key, entry in batch:
+                    if entry is None:
+                        self.index.pop(key, None)
+                    else:
+                        self.index[key] = entry
+
+        if torn_at is not None:
+            warnings.warn(
+                f"Dropping {size - torn_at} bytes of a partly written "
+                f"batch at the end of {index_path}"
+            )
+            if not self.read_only:
+                # later batches are appended after the intact ones
+                with open(index_path, "r+b") as f:
+                    f.truncate(torn_at)
+
+        for entry in self.index.values():
+            for arr in entry.arrays:
+                end = arr.offset + self._nbytes(arr)
+                tail = self.tails.get(arr.shard, 0)
+                self.tails[arr.shard] = max(tail, end)
+
+        # capacity of existing shards is whatever is on disk; we only
+        # preallocate again once we start writing to them.
+        for shard in self.tails:
+            self.capacities[shard] = self.shard_path(shard).stat().st_size
+
+    @staticmethod
+    def _nbytes(arr: FlatArrayEntry) -> int:
+        return (
+            int(np.prod(arr.shape, dtype=np.int64))
+            * np.dtype(arr.dtype).itemsize
+        )
+
+    def _align(self, offset: int) -> int:
+        return -(-offset // self.alignment) * self.alignment
+
+    def _writer(self, shard: int) -> BinaryIO:
+        if shard not in self._writers:
+            path = self.shard_path(shard)
+            mode = "r+b" if path.exists() else "w+b"
+            self._writers[shard] = open(path, mode)
+        return self._writers[shard]
+
+    def _reserve(self, nbytes: int) -> Tuple[int, int]:
+        """Finds a shard with room for `nbytes`, starting a new one
+        if the current last shard is full."""
+        shard = max(self.tails) if self.tails else 0
+        offset = self._align(self.tails.get(shard, 0))
+
+        if self.tails and offset + nbytes > max(
+            self.capacities.get(shard, 0), self.shard_size
+        ):
+            shard, offset = shard + 1, 0
+
+        capacity = max(self.shard_size, offset + nbytes)
+        if self.capacities.get(shard, 0) < capacity:
+            # preallocate; on most filesystems this creates a sparse file
+            self._writer(shard).truncate(capacity)
+            self.capacities[shard] = capacity
+
+        self.tails[shard] = offset + nbytes
+        return shard, offset
+
+    def _put_array(self, array: BackendValueType) -> FlatArrayEntry:
+        if isinstance(array, torch.Tensor):
+            array = array.detach().cpu().numpy()
+        # unlike np.ascontiguousarray, this keeps 0-d arrays 0-d
+        array = np.require(array, requirements="C")
+
+        shard, offset = self._reserve(array.nbytes)
+        if array.nbytes > 0:
+            f = self._writer(shard)
+            f.seek(offset)
+            f.write(array.reshape(-1).view(np.uint8).data)
+
+        # any mapping of this shard predates the write, so it might
+        # be shorter than the file now is.
+        self._readers.pop(shard, None)
+
+        return FlatArrayEntry(
+            shard=shard,
+            offset=offset,
+            dtype=array.dtype.str,
+            shape=tuple(array.shape),
+        )
+
+    def put(self, key: bytes, value: HookComboValueType) -> FlatEntry:
+        if isinstance(value, abc.Mapping):
+            names = tuple(value.keys())
+            entry = FlatEntry(
+                type=CONTAINER_TYPE.DICT,
+                names=names,
+                arrays=tuple(self._put_array(value[n]) for n in names),
+            )
+        elif isinstance(value, abc.Sequence):
+            entry = FlatEntry(
+                type=CONTAINER_TYPE.LIST,
+                names=None,
+                arrays=tuple(self._put_array(v) for v in value),
+            )
+        else:
+            entry = FlatEntry(
+                type=CONTAINER_TYPE.NUMPY,
+                names=None,
+                arrays=(self._put_array(value),),
+            )
+        self.index[key] = entry
+        return entry
+
+    def _reader(self, shard: int) -> mmap.mmap:
+        if shard not in self._readers:
+            with open(self.shard_path(shard), "rb") as f:
+                # copy-on-write mapping: arrays are writable (which keeps
+                # torch.from_numpy happy) but changes never reach the file.
+                self._readers[shard] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_COPY
+                )
+        return self._readers[shard]
+
+    def _get_array(self, arr: FlatArrayEntry) -> np.ndarray:
+        dtype = np.dtype(arr.dtype)
+        count = int(np.prod(arr.shape, dtype=np.int64))
+        if count == 0:
+            return np.empty(arr.shape, dtype=dtype)
+        buffer = self._reader(arr.shard)
+        return np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=arr.offset
+        ).reshape(arr.shape)
+
+    def get(self, key: bytes) -> HookComboValueType:
+        entry = self.index[key]
+        arrays = [self._get_array(a) for a in entry.arrays]
+        if entry.type == CONTAINER_TYPE.DICT:
+            return dict(zip(entry.names or (), arrays))
+        elif entry.type == CONTAINER_TYPE.LIST:
+            return arrays
+        return arrays[0]
+
+    def log(self, batch: List[Tuple[bytes, Optional[FlatEntry]]]):
+        """Flushes written data and appends a batch of index updates."""
+        for f in self._writers.values():
+            f.flush()
+        if self._index_file is None:
+            self._index_file = open(self.path / self.INDEX_NAME, "ab")
+        pickle.dump(batch, self._index_file)
+        self._index_file.flush()
+
+    def close(self):
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+        # give back the preallocated but unused tail of each shard
+        for shard, f in self._writers.items():
+            f.truncate(self.tails.get(shard, 0))
+            self.capacities[shard] = self.tails.get(shard, 0)
+            f.close()
+        self._writers = {}
+
+        # arrays handed out by `get` keep their own reference to the
+        # mapping, so we can only drop ours here.
+        self._readers = {}
+
+    def __del__(self):
+        self.close()
+
+
+@BackendRegistry.reg("flat")
+class FlatStorage(BaseKVStorage):
+    """A storage that writes arrays into memory-mapped, preallocated shard
+    files; reads return zero-copy numpy views of the shards instead of
+    deserializing a blob per key. Values are returned as numpy arrays
+    even if tensors were written. Deleted keys are removed from the
+    index, but their space in the shards is not reclaimed."""
+
+    db: FlatShards
+
+    def __init__(
+        self,
+        *args,
+        shard_size: int = 1 << 30,
+        alignment: int = 64,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+
+        if self.path is None:
+            raise ValueError("FlatStorage requires a path.")
+
+        self.db = FlatShards(
+            path=self.path,
+            read_only=self.read_only,
+            shard_size=shard_size,
+            alignment=alignment,
+        )
+
+    @classmethod
+    def files(cls: Type["FlatStorage"], path: Path) -> Iterable[Path]:
+        return (f for f in Path(path).glob("*") if f.is_file())
+
+    def batch_read(
+        self, keys: Iterable[HookComboKeyType]
+    ) -> Sequence[HookComboValueType]:
+        return [self.db.get(self.sr.key(k)) for k in keys]
+
+    def batch_write(
+        self,
+        keys: Iterable[HookComboKeyType],
+        values: Iterable[HookComboValueType],
+    ) -> None:
+        if self.read_only:
+            raise RuntimeError("Cannot write to a read-only FlatStorage.")
+
+        batch = [
+            (key, self.db.put(key, value))
+            for key, value in zip((self.sr.key(k) for k in keys), values)
+        ]
+        self.db.log(batch)
+
+    def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
+        if self.read_only:
+            raise RuntimeError("Cannot delete from a read-only FlatStorage.")
+
+        batch: List[Tuple[bytes, Optional[FlatEntry]]] = []
+        for key in keys:
+            key = self.sr.key(key)
+            del self.db.index[key]
+            batch.append((key, None))
+        self.db.log(batch)
@@ -0,0 +1,143 @@
+import heapq
+import shutil
+import struct
+from pathlib import Path
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+
+class SortedRuns:
+    """An external sort of key-value pairs.
+
+    Pairs are collected in memory until `run_size` bytes are pending;
+    they are then sorted by key and written to a run file in
+    `directory`. `merged` merges all runs into a single sorted stream,
+    reading at most `max_open_runs` of them at once. If a key is added
+    more than once, the last value wins. A value of None is a tombstone:
+    `delete` adds one, and it wins over earlier values like any other.
+    """
+
+    RECORD = struct.Struct("<II")
+    RUN_TEMPLATE = "run-{:05d}.bin"
+    # value size of tombstones in run files
+    TOMBSTONE = 0xFFFFFFFF
+
+    def __init__(
+        self,
+        directory: Path,
+        run_size: int = 256 << 20,
+        max_open_runs: int = 128,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.run_size = run_size
+        self.max_open_runs = max_open_runs
+        self._run_count = 0
+        self.runs: List[Path] = []
+        self._pending: Dict[bytes, Optional[bytes]] = {}
+        self._pending_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.runs) + (1 if self._pending else 0)
+
+    def add(self, key: bytes, value: Optional[bytes]) -> None:
+        if key in self._pending:
+            # the value it replaces is not written to the run
+            old = self._pending[key]
+            self._pending_bytes -= len(key) + len(old or b"")
+        self._pending[key] = value
+        self._pending_bytes += len(key) + len(value or b"")
+        if self._pending_bytes >= self.run_size:
+            self._spill()
+
+    def delete(self, key: bytes) -> None:
+        self.add(key, None)
+
+    def _new_run_path(self) -> Path:
+        self._run_count += 1
+        return self.directory / self.RUN_TEMPLATE.format(self._run_count)
+
+    @classmethod
+    def _write_run(
+        cls, path: Path, pairs: Iterable[Tuple[bytes, Optional[bytes]]]
+    ) -> None:
+        with open(path, "wb") as f:
+            for key, value in pairs:
+                value_size = cls.TOMBSTONE if value is None else len(value)
+                f.write(cls.RECORD.pack(len(key), value_size))
+                f.write(key)
+                f.write(value or b"")
+
+    def _spill(self) -> None:
+        path = self._new_run_path()
+        self._write_run(
+            path, ((k, self._pending[k]) for k in sorted(self._pending))
+        )
+        self.runs.append(path)
+        self._pending = {}
+        self._pending_bytes = 0
+
+    @classmethod
+    def _read_run(
+        cls, f: BinaryIO, order: int
+    ) -> Iterator[Tuple[bytes, int, Optional[bytes]]]:
+        while True:
+            header = f.read(cls.RECORD.size)
+            if not header:
+                return
+            key_size, value_size = cls.RECORD.unpack(header)
+            key = f.read(key_size)
+            if value_size == cls.TOMBSTONE:
+                yield key, order, None
+            else:
+                yield key, order, f.read(value_size)
+
+    @classmethod
+    def _merge(
+        cls, runs: Sequence[Path]
+    ) -> Iterator[Tuple[bytes, Optional[bytes]]]:
+        files = [open(path, "rb") for path in runs]
+        try:
+            # later runs sort first among equal keys, so that the first
+            # value seen for a key is the last one added.
+            streams = [
+                cls._read_run(f, -order) for order, f in enumerate(files)
+            ]
+            previous = None
+            for key, _, value in heapq.merge(*streams):
+                if key != previous:
+                    yield key, value
+                previous = key
+        finally:
+            [f.close() for f in files]
+
+    def merged(self) -> Iterator[Tuple[bytes, Optional[bytes]]]:
+        """Yields all pairs, sorted by key, each key once; deleted keys
+        come with a tombstone (None), as they may be in the database the
+        pairs go to."""
+        if self._pending:
+            self._spill()
+
+        # merge the oldest runs into one until few enough are left; the
+        # merged run stays first, so newer values still win.
+        while len(self.runs) > self.max_open_runs:
+            oldest = self.runs[: self.max_open_runs]
+            path = self._new_run_path()
+            self._write_run(path, self._merge(oldest))
+            [run.unlink() for run in oldest]
+            self.runs = [path] + self.runs[self.max_open_runs :]
+
+        return self._merge(self.runs)
+
+    def cleanup(self) -> None:
+        self._pending = {}
+        self.runs = []
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,17 +1,183 @@
+import atexit
+import os
+import shutil
+import socket
+import tempfile
+import threading
 from pathlib import Path
-from typing import Iterable, Sequence, Type
+from typing import IO, Any, Dict, Iterable, Sequence, Tuple, Type
 
 try:
     import plyvel
 except ImportError:
     plyvel = None
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from ..types import HookComboKeyType, HookComboValueType
 from .base import BackendRegistry, BaseKVStorage
 
 
+class LevelDBReader:
+    """A private copy of a LevelDB database, opened once per process and
+    shared by all the read-only storages of that process.
+
+    Every copy has an `OWNER` file naming the host it was made on, which
+    the process that made it keeps locked for as long as it uses it."""
+
+    # files that belong to a process holding the database open
+    PRIVATE_FILES = ("LOCK", "LOG", "LOG.old")
+    OWNER_FILE = "OWNER"
+
+    # (process id, database path) -> reader
+    _readers: Dict[Tuple[int, Path], "LevelDBReader"] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path, **db_kwargs: Any):
+        self.path = path
+        self.copy_path, self._owner = self._make_copy(path)
+        try:
+            self.db = plyvel.DB(
+                name=str(self.copy_path), create_if_missing=False, **db_kwargs
+            )
+        except Exception:
+            self._remove_copy()
+            raise
+        self.users = 0
+
+    @classmethod
+    def acquire(cls, path: Path, **db_kwargs: Any) -> "LevelDBReader":
+        """Returns the reader of `path` for this process, opening it if
+        needed. Every call must be matched by a call to `release`."""
+        key = (os.getpid(), path.resolve())
+        with cls._lock:
+            if key not in cls._readers:
+                cls._readers[key] = cls(path, **db_kwargs)
+            reader = cls._readers[key]
+            reader.users += 1
+        return reader
+
+    def release(self) -> None:
+        """Closes the database and removes the copy once no storage uses
+        it anymore."""
+        with self._lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            self._readers.pop((os.getpid(), self.path.resolve()), None)
+        self._remove()
+
+    def _remove(self) -> None:
+        if not self.db.closed:
+            self.db.close()
+        self._remove_copy()
+
+    def _remove_copy(self) -> None:
+        shutil.rmtree(self.copy_path, ignore_errors=True)
+        # closing the owner file releases its lock
+        self._owner.close()
+
+    @classmethod
+    def release_all(cls) -> None:
+        """Removes the copies made by this process; registered to run at
+        exit."""
+        with cls._lock:
+            pid = os.getpid()
+            readers = [r for (p, _), r in cls._readers.items() if p == pid]
+            for reader in readers:
+                cls._readers.pop((pid, reader.path.resolve()), None)
+        for reader in readers:
+            reader._remove()
+
+    @staticmethod
+    def _copy_prefix(path: Path) -> str:
+        return f".{path.name}-reader-"
+
+    @classmethod
+    def _remove_stale_copies(cls, path: Path) -> None:
+        """Removes copies left behind by processes that are gone (e.g.
+        killed, or data loader workers, which exit without running atexit
+        handlers). Process ids mean nothing across hosts or containers,
+        so only copies made on this host whose owner file can be locked
+        (its lock was released when the process that made it exited)
+        are removed."""
+        if fcntl is None:
+            return
+        hostname = socket.gethostname()
+        for copy_path in path.parent.glob(f"{cls._copy_prefix(path)}*"):
+            try:
+                owner = open(copy_path / cls.OWNER_FILE, "r+")
+            except OSError:
+                # not a copy, or one that is still being made
+                continue
+            with owner:
+                if owner.read().strip() != hostname:
+                    continue
+                try:
+                    fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # still in use
+                    continue
+                shutil.rmtree(copy_path, ignore_errors=True)
+
+    @classmethod
+    def _make_copy(cls, path: Path) -> Tuple[Path, IO[str]]:
+        """Makes a copy of the database next to it, so that table files
+        can be hard-linked; returns its path and its owner file, which is
+        locked until it is closed."""
+        if not (path / "CURRENT").exists():
+            raise FileNotFoundError(f"No LevelDB database at {path}")
+
+        cls._remove_stale_copies(path)
+        copy_path = Path(
+            tempfile.mkdtemp(prefix=cls._copy_prefix(path), dir=path.parent)
+        )
+        owner = open(copy_path / cls.OWNER_FILE, "w")
+        try:
+            if fcntl is not None:
+                fcntl.flock(owner, fcntl.LOCK_EX)
+            owner.write(socket.gethostname())
+            owner.flush()
+
+            for src in path.iterdir():
+                if src.name in cls.PRIVATE_FILES or not src.is_file():
+                    continue
+                dst = copy_path / src.name
+                if src.suffix in (".ldb", ".sst"):
+                    # table files can be large; they are never copied
+                    os.link(src, dst)
+                else:
+                    shutil.copy2(src, dst)
+        except BaseException:
+            shutil.rmtree(copy_path, ignore_errors=True)
+            owner.close()
+            raise
+        return copy_path, owner
+
+
+atexit.register(LevelDBReader.release_all)
+
+
 @BackendRegistry.reg("leveldb")
 class LevelDBStorage(BaseKVStorage):
+    """A LevelDB-backed key-value storage.
+
+    LevelDB locks its directory, so only one process (the writer) can
+    open it. In read-only mode, each process instead opens a private copy
+    of the database (see `LevelDBReader`), made next to it and shared by
+    all read-only storages of that process: table files never change once
+    written, so they are hard-linked rather than copied, and only the
+    (small) manifest and log are duplicated; opening raises an OSError if
+    the directory of the database is not writable, or does not support
+    hard links. The copy is removed when the last of these storages is
+    closed, or at exit; copies left by processes of this host that died
+    are removed the next time a copy is made. Values written to the
+    database after a process opened its copy are not visible to it.
+    """
+
     db: plyvel.DB if plyvel else None
 
     def __init__(
@@ -27,20 +193,44 @@ class LevelDBStorage(BaseKVStorage):
 
         self.access_type = "r" if self.read_only else "c"
 
-        self.db = plyvel.DB(
-            name=str(self.path),
+        db_kwargs = dict(
             max_open_files=max_open_files,
-            create_if_missing=True,
             max_file_size=max_file_size,
             write_buffer_size=write_buffer_size,
             compression="snappy" if compression else None,
         )
+        self._reader = None
+        if self.read_only:
+            self._reader = LevelDBReader.acquire(Path(self.path), **db_kwargs)
+            self.db = self._reader.db
+        else:
+            self.db = plyvel.DB(
+                name=str(self.path), create_if_missing=True, **db_kwargs
+            )
+
+    def close(self) -> None:
+        if self.read_only:
+            # the database is shared with the other readers of the process
+            if self._reader is not None:
+                self._reader.release()
+                self._reader = None
+        elif not self.db.closed:
+            self.db.close()
+
+    def __del__(self):
+        # the database might not exist if __init__ failed
+        if getattr(self, "db", None) is not None:
+            self.close()
 
     @classmethod
     def files(cls: Type["LevelDBStorage"], path: Path) -> Iterable[Path]:
         path = Path(path)  # making sure it's a pathlib.Path
         return (f for f in Path(path).glob("**/*") if f.is_file())
 
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError("Cannot write to a read-only LevelDBStorage.")
+
     def batch_read(
         self: "LevelDBStorage", keys: Iterable[HookComboKeyType]
     ) -> Sequence[HookComboValueType]:
@@ -53,6 +243,7 @@ class LevelDBStorage(BaseKVStorage):
         keys: Iterable[HookComboKeyType],
         values: Iterable[HookComboValueType],
     ) -> None:
+        self._check_writable()
         with self.db.write_batch() as wb:
             for key, array in zip(keys, values):
                 wb.put(self.sr.key(key), self.sr.serialize(array))
@@ -60,6 +251,7 @@ class LevelDBStorage(BaseKVStorage):
     def batch_delete(
         self: "LevelDBStorage", keys: Iterable[HookComboKeyType]
     ) -> None:
+        self._check_writable()
         with self.db.write_batch() as wb:
             for key in keys:
                 wb.delete(self.sr.key(key))
@@ -0,0 +1,232 @@
+import threading
+from pathlib import Path
+from typing import Any, Iterable, List, Sequence, Tuple, Type
+
+import numpy as np
+
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+from ..types import HookComboKeyType, HookComboValueType
+from .base import BackendRegistry, BaseKVStorage
+
+
+class PinnedEnvironment:
+    """A read-only LMDB environment that is only closed once `close` was
+    called and none of the read transactions begun in it is still in
+    use, so that arrays pointing into its memory map stay valid."""
+
+    def __init__(self, env: Any):
+        self.env = env
+        self.open_txns = 0
+        self.closing = False
+        self._lock = threading.Lock()
+
+    def begin(self) -> Any:
+        with self._lock:
+            if self.closing:
+                raise RuntimeError("The LMDB environment is closed.")
+            self.open_txns += 1
+        try:
+            return self.env.begin(buffers=True)
+        except BaseException:
+            self.end(None)
+            raise
+
+    def end(self, txn: Any) -> None:
+        if txn is not None:
+            txn.abort()
+        with self._lock:
+            self.open_txns -= 1
+            close = self.closing and self.open_txns == 0
+        if close:
+            self.env.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self.closing = True
+            close = self.open_txns == 0
+        if close:
+            self.env.close()
+
+
+class ReadTransaction:
+    """A read transaction, ended (releasing its reader slot and the pages
+    it pins) when it is garbage collected."""
+
+    def __init__(self, env: PinnedEnvironment):
+        self.env = env
+        self.txn = env.begin()
+
+    def get(self, key: bytes) -> Any:
+        return self.txn.get(key)
+
+    def __del__(self):
+        # the transaction might not exist if begin failed
+        if getattr(self, "txn", None) is not None:
+            self.env.end(self.txn)
+            self.txn = None
+
+
+class PinnedBuffer:
+    """Memory inside an LMDB map, exposed through numpy's array interface.
+
+    Arrays made from it (and tensors made from those) keep a reference
+    to it, and so to the read transaction the memory belongs to: the
+    transaction only ends, and the environment is only closed, once all
+    of them have been garbage collected.
+    """
+
+    def __init__(self, buffer: memoryview, txn: ReadTransaction):
+        self.__array_interface__ = np.frombuffer(
+            buffer, dtype=np.uint8
+        ).__array_interface__
+        self.txn = txn
+
+
+@BackendRegistry.reg("lmdb")
+class LMDBStorage(BaseKVStorage):
+    """An LMDB-backed key-value storage.
+
+    Values are decoded straight out of LMDB's memory map, without
+    copying them to bytes first; `batch_read` then copies arrays out of
+    it (once per value), so that they are writable and outlive the read
+    transaction. In read-only mode, with binary serialization,
+    `batch_read_views` skips that copy: arrays are read-only views of
+    the map, and keep their read transaction open for as long as any of
+    them is alive. Each open transaction holds one of `max_readers`
+    reader slots and keeps the pages it reads from being reused, so
+    views are only for values that are copied elsewhere right away (as
+    StorageWrapper does when it copies values to a device through pinned
+    buffers). Any number of processes can read the storage at once, also
+    while it is being written; each batch sees the values committed
+    before it was read.
+
+    Every `batch_write` or `batch_delete` is a single write transaction.
+    The map starts at `map_size` bytes (address space, not disk space)
+    and doubles whenever it fills up.
+    """
+
+    db: lmdb.Environment if lmdb else None
+
+    def __init__(
+        self,
+        *args,
+        map_size: int = 1 << 40,
+        max_readers: int = 1024,
+        readahead: bool = False,
+        sync: bool = True,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+
+        if lmdb is None:
+            raise ImportError("lmdb is not installed.")
+
+        if self.path is None:
+            raise ValueError("LMDBStorage requires a path.")
+        if self.read_only and not self.path.exists():
+            raise FileNotFoundError(f"No LMDB environment at {self.path}")
+
+        self.db = lmdb.open(
+            str(self.path),
+            map_size=map_size,
+            max_readers=max_readers,
+            readonly=self.read_only,
+            # random reads of large values don't benefit from readahead
+            readahead=readahead,
+            sync=sync,
+        )
+        self._env = PinnedEnvironment(self.db) if self.read_only else None
+
+    @classmethod
+    def files(cls: Type["LMDBStorage"], path: Path) -> Iterable[Path]:
+        return (f for f in Path(path).glob("*") if f.is_file())
+
+    def close(self) -> None:
+        if self._env is not None:
+            # arrays read from the environment might still point into its
+            # memory map; it is closed once their transactions end.
+            self._env.close()
+            self._env = None
+        elif self.db is not None:
+            self.db.close()
+        self.db = None
+
+    def batch_read(
+        self, keys: Iterable[HookComboKeyType]
+    ) -> Sequence[HookComboValueType]:
+        keys = [self.sr.key(k) for k in keys]
+        if not self.read_only:
+            with self.db.begin(buffers=True) as txn:
+                return [
+                    self.sr.deserialize(self._check(k, txn.get(k)))
+                    for k in keys
+                ]
+
+        txn = self._env.begin()
+        try:
+            return [
+                self.sr.deserialize(self._check(k, txn.get(k)))
+                for k in keys
+            ]
+        finally:
+            self._env.end(txn)
+
+    def batch_read_views(
+        self, keys: Iterable[HookComboKeyType]
+    ) -> Sequence[HookComboValueType]:
+        if not self.read_only:
+            # pages can be reused as soon as the read transaction ends
+            return self.batch_read(keys)
+
+        keys = [self.sr.key(k) for k in keys]
+        txn = ReadTransaction(self._env)
+        return [
+            self.sr.deserialize(
+                np.asarray(PinnedBuffer(self._check(k, txn.get(k)), txn)),
+                writable=False,
+            )
+            for k in keys
+        ]
+
+    @staticmethod
+    def _check(key: bytes, buffer: Any) -> Any:
+        if buffer is None:
+            raise KeyError(key)
+        return buffer
+
+    def _write(self, items: List[Tuple[bytes, Any]], delete: bool) -> None:
+        if self.read_only:
+            raise RuntimeError("Cannot write to a read-only LMDBStorage.")
+
+        while True:
+            try:
+                with self.db.begin(write=True) as txn:
+                    for key, value in items:
+                        if delete:
+                            txn.delete(key)
+                        else:
+                            txn.put(key, value)
+                return
+            except lmdb.MapFullError:
+                # the transaction was aborted; retry with a larger map
+                self.db.set_mapsize(self.db.info()["map_size"] * 2)
+
+    def batch_write(
+        self,
+        keys: Iterable[HookComboKeyType],
+        values: Iterable[HookComboValueType],
+    ) -> None:
+        self._write(
+            [
+                (self.sr.key(k), self.sr.serialize(v))
+                for k, v in zip(keys, values)
+            ],
+            delete=False,
+        )
+
+    def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
+        self._write([(self.sr.key(k), None) for k in keys], delete=True)
@@ -1,61 +1,259 @@
+import mmap
+import os
 import pickle
+import struct
+import warnings
 from pathlib import Path
-from typing import Iterable, Sequence, Type
+from typing import Dict, Iterable, List, Sequence, Tuple, Type
+
+import numpy as np
 
 from ..types import HookComboKeyType, HookComboValueType
 from .base import BackendRegistry, BaseKVStorage
+from .serialization import BinarySerialization
+
+
+class MemoryArena:
+    """Serialized values packed into large preallocated chunks of memory.
+
+    Values are appended to the last chunk at `alignment`-byte offsets; a
+    new chunk of `chunk_size` bytes (or larger, for large values) is
+    allocated when it is full, so existing values are never moved. Space
+    of overwritten or deleted values is reclaimed by `snapshot`.
+
+    A snapshot is a single file:
+
+        magic (4 bytes) | index offset (u64) | index size (u64) | data |
+        index
+
+    where the index is a pickled dict from key to (offset, size) in the
+    file. On load, the file is memory-mapped and used as the first chunk,
+    so values are read straight from the page cache.
+    """
+
+    MAGIC = b"S2RM"
+    HEADER = struct.Struct("<4sQQ")
+
+    def __init__(self, chunk_size: int = 64 << 20, alignment: int = 64):
+        self.chunk_size = chunk_size
+        self.alignment = alignment
+        self.index: Dict[bytes, Tuple[int, int, int]] = {}
+        self.chunks: List[memoryview] = []
+        self.tail = 0
+
+    def _align(self, offset: int) -> int:
+        return -(-offset // self.alignment) * self.alignment
+
+    def _reserve(self, size: int) -> Tuple[int, int]:
+        """Returns a chunk and offset with room for `size` bytes."""
+        offset = self._align(self.tail)
+        if not self.chunks or offset + size > len(self.chunks[-1]):
+            chunk = np.empty(max(self.chunk_size, size), dtype=np.uint8)
+            self.chunks.append(memoryview(chunk))
+            offset = 0
+        self.tail = offset + size
+        return len(self.chunks) - 1, offset
+
+    def put(self, key: bytes, data: bytes) -> None:
+        chunk, offset = self._reserve(len(data))
+        self.chunks[chunk][offset : offset + len(data)] = data
+        self.index[key] = (chunk, offset, len(data))
+
+    def put_value(self, key: bytes, value: HookComboValueType) -> None:
+        """Like `put`, but serializes a value with BinarySerialization
+        directly into the arena, without an intermediate copy."""
+        size = BinarySerialization.serialized_size(value)
+        chunk, offset = self._reserve(size)
+        BinarySerialization.serialize_into(
+            value, self.chunks[chunk][offset : offset + size]
+        )
+        self.index[key] = (chunk, offset, size)
+
+    def get(self, key: bytes) -> memoryview:
+        chunk, offset, size = self.index[key]
+        return self.chunks[chunk][offset : offset + size]
+
+    def delete(self, key: bytes) -> None:
+        del self.index[key]
+
+    def snapshot(self, path: Path) -> None:
+        """Writes all values to a single file at `path`, replacing it
+        atomically."""
+        tmp_path = path.with_name(path.name + ".tmp")
+        index: Dict[bytes, Tuple[int, int]] = {}
+        with open(tmp_path, "wb") as f:
+            f.write(bytes(self.HEADER.size))
+            position = self.HEADER.size
+            for key in self.index:
+                offset = self._align(position)
+                data = self.get(key)
+                f.write(bytes(offset - position))
+                f.write(data)
+                index[key] = (offset, len(data))
+                position = offset + len(data)
+
+            index_bytes = pickle.dumps(index, protocol=5)
+            f.write(index_bytes)
+            f.seek(0)
+            f.write(self.HEADER.pack(self.MAGIC, position, len(index_bytes)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def is_snapshot(cls, path: Path) -> bool:
+        """Whether the file at `path` was written by `snapshot`."""
+        with open(path, "rb") as f:
+            return f.read(len(cls.MAGIC)) == cls.MAGIC
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "MemoryArena":
+        """Memory-maps a snapshot written by `snapshot`."""
+        arena = cls(**kwargs)
+        with open(path, "rb") as f:
+            # copy-on-write, so that arrays are writable (which keeps
+            # torch.from_numpy happy) but changes never reach the file.
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        magic, index_offset, index_size = cls.HEADER.unpack_from(buffer)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a MemoryStorage snapshot")
+
+        index = pickle.loads(buffer[index_offset : index_offset + index_size])
+        arena.chunks.append(memoryview(buffer))
+        arena.index = {
+            key: (0, offset, size) for key, (offset, size) in index.items()
+        }
+        # new values go to a new chunk; the snapshot is never written to.
+        arena.tail = len(buffer)
+        return arena
 
 
 @BackendRegistry.reg("mem")
 class MemoryStorage(BaseKVStorage):
-    db: dict
+    """A storage that keeps serialized values in RAM, in a MemoryArena.
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    If a path is given, the whole storage is snapshotted to a single file
+    there every `snapshot_every` writes (if greater than zero) and when the
+    storage is closed or deleted; an existing snapshot is memory-mapped
+    on startup. A file written by earlier versions of this storage (a
+    sequence of pickled key-value pairs) is loaded into the arena, and
+    rewritten as a snapshot on close unless the storage is read-only.
+    Uses binary serialization by default, so reads return views of the
+    arena rather than copies.
+    """
 
-        self.db = {}
+    db: MemoryArena
 
-        if self.path.exists():
-            with open(self.path, "rb") as f:
-                while True:
-                    try:
-                        key, value = pickle.load(f)
-                        self.db[key] = value
-                    except EOFError:
-                        break
+    def __init__(
+        self,
+        *args,
+        serialization: str = "binary",
+        chunk_size: int = 64 << 20,
+        snapshot_every: int = 0,
+        **kwargs,
+    ):
+        super().__init__(*args, serialization=serialization, **kwargs)
+        self.snapshot_every = snapshot_every
+        self._unsaved_writes = 0
+
+        if self.path is not None and self.path.exists():
+            if MemoryArena.is_snapshot(self.path):
+                self.db = MemoryArena.load(self.path, chunk_size=chunk_size)
+            else:
+                self.db = self._load_pickled(chunk_size)
+        elif self.read_only:
+            raise FileNotFoundError(f"No snapshot at {self.path}")
+        else:
+            self.db = MemoryArena(chunk_size=chunk_size)
+
+    def _load_pickled(self, chunk_size: int) -> MemoryArena:
+        """Loads a file of pickled (key, value) pairs, as written by
+        earlier versions of MemoryStorage."""
+        arena = MemoryArena(chunk_size=chunk_size)
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    key, value = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError) as e:
+                    raise ValueError(
+                        f"{self.path} is neither a MemoryStorage snapshot "
+                        "nor a store written by an older version of "
+                        "MemoryStorage; re-record the cache."
+                    ) from e
+                arena.put(self.sr.key(key), self.sr.serialize(value))
+
+        warnings.warn(
+            f"{self.path} was written by an older version of MemoryStorage"
+            + (
+                "; re-record the cache or open it for writing to convert it"
+                if self.read_only
+                else "; it will be rewritten as a snapshot on close"
+            )
+        )
+        if not self.read_only:
+            self._unsaved_writes = len(arena.index)
+        return arena
 
     @classmethod
     def files(cls: Type["MemoryStorage"], path: Path) -> Iterable[Path]:
         return [path]
 
+    def snapshot(self) -> None:
+        """Writes all values to the snapshot file."""
+        if self.path is None:
+            raise ValueError("Cannot snapshot a MemoryStorage without path.")
+        self.db.snapshot(self.path)
+        self._unsaved_writes = 0
+
+    def close(self) -> None:
+        if self._unsaved_writes > 0 and self.path is not None:
+            self.snapshot()
+
+    def __del__(self):
+        # the arena might not exist if __init__ failed
+        if getattr(self, "db", None) is not None:
+            self.close()
+
     def batch_read(
         self, keys: Iterable[HookComboKeyType]
     ) -> Sequence[HookComboValueType]:
-        # return [self.sr.deserialize(self.db[self.sr.key(k)]) for k in keys]
-        return [self.db[key] for key in keys]
+        return [
+            self.sr.deserialize(self.db.get(self.sr.key(k))) for k in keys
+        ]
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError("Cannot write to a read-only MemoryStorage.")
 
     def batch_write(
         self,
         keys: Iterable[HookComboKeyType],
         values: Iterable[HookComboValueType],
     ) -> None:
-        for key, array in zip(keys, values):
-            # key = self.sr.key(key)
-            # array = self.sr.serialize(array)
-
-            if key in self.db:
-                raise KeyError(
-                    f"Key {key} already exists; cannot overwrite "
-                    "with MemoryStorage backend"
-                )
-
-            with open(self.path, "ab") as f:
-                pickle.dump((key, array), f)
-
-            self.db[key] = array
+        self._check_writable()
+        count = 0
+        for key, value in zip(keys, values):
+            if isinstance(self.sr, BinarySerialization):
+                self.db.put_value(self.sr.key(key), value)
+            else:
+                self.db.put(self.sr.key(key), self.sr.serialize(value))
+            count += 1
+        self._on_change(count)
 
     def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
-        raise NotImplementedError(
-            "MemoryStorage backend does not support"
-            "deletion of specific keys"
-        )
+        self._check_writable()
+        count = 0
+        for key in keys:
+            self.db.delete(self.sr.key(key))
+            count += 1
+        self._on_change(count)
+
+    def _on_change(self, count: int) -> None:
+        self._unsaved_writes += count
+        if (
+            self.path is not None
+            and self.snapshot_every > 0
+            and self._unsaved_writes >= self.snapshot_every
+        ):
+            self.snapshot()
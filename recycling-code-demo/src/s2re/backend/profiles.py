@@ -0,0 +1,92 @@
+from typing import Dict, NamedTuple, Optional, Union
+
+
+class RocksDBProfile(NamedTuple):
+    """Tuning settings for the RocksDB-based backends (`rocksdb` and
+    `rocksdict`).
+
+    - `block_cache_size`: bytes of uncompressed blocks kept in memory.
+    - `bloom_bits_per_key`: size of bloom filters; zero disables them.
+    - `block_size`: bytes per data block; zero picks one from the
+      expected size of a value (see `block_size_for`).
+    - `compression`: one of "zstd", "lz4", "snappy" or "none".
+    - `blob_min_size`: values at least this big are kept in separate
+      blob files (BlobDB), so compactions don't rewrite them; zero
+      disables blob files.
+    - `write_buffer_size`: bytes of writes buffered in memory before
+      they are flushed to disk.
+    - `readahead_size`: bytes read ahead by iterators; zero disables it.
+    - `sync`: whether every write is synced to disk.
+    - `bulk_load`: writes skip the write-ahead log and automatic
+      compactions; the database is compacted once when it is closed.
+    """
+
+    block_cache_size: int = 8 << 20
+    bloom_bits_per_key: int = 0
+    block_size: int = 4 << 10
+    compression: str = "snappy"
+    blob_min_size: int = 0
+    write_buffer_size: int = 64 << 20
+    readahead_size: int = 0
+    sync: bool = False
+    bulk_load: bool = False
+
+
+ROCKSDB_PROFILES: Dict[str, RocksDBProfile] = {
+    # recording a cache: large, unsynced, WAL-less writes; activations
+    # go to blob files, so compactions only move keys around.
+    "bulk_load": RocksDBProfile(
+        compression="lz4",
+        blob_min_size=64 << 10,
+        write_buffer_size=256 << 20,
+        bulk_load=True,
+    ),
+    # fetching values in shuffled order: a large cache, bloom filters
+    # to skip tables without the key, and one value per block.
+    "random_read": RocksDBProfile(
+        block_cache_size=1 << 30,
+        bloom_bits_per_key=10,
+        block_size=0,
+        compression="lz4",
+    ),
+    # fetching values in key order: large blocks read well ahead, and
+    # a small cache, as blocks are rarely read twice.
+    "sequential_scan": RocksDBProfile(
+        block_cache_size=32 << 20,
+        block_size=256 << 10,
+        compression="zstd",
+        readahead_size=2 << 20,
+    ),
+}
+
+
+def get_rocksdb_profile(
+    profile: Union[str, RocksDBProfile, None]
+) -> Optional[RocksDBProfile]:
+    """Returns the profile with the given name; profiles and None are
+    returned as they are."""
+    if profile is None or isinstance(profile, RocksDBProfile):
+        return profile
+    try:
+        return ROCKSDB_PROFILES[profile]
+    except KeyError:
+        profiles = ", ".join(f"`{p}`" for p in ROCKSDB_PROFILES)
+        raise ValueError(
+            f"No RocksDB profile named `{profile}`; "
+            f"available profiles: {profiles}"
+        )
+
+
+def block_size_for(
+    profile: RocksDBProfile, value_size: int = 0, max_size: int = 4 << 20
+) -> int:
+    """Block size for a profile; if the profile doesn't set one, the
+    smallest power of two that fits a value of `value_size` bytes (at
+    least 4KB, at most `max_size`), so that reading a value takes a
+    single block."""
+    if profile.block_size > 0:
+        return profile.block_size
+    block_size = 4 << 10
+    while block_size < min(value_size, max_size):
+        block_size <<= 1
+    return block_size
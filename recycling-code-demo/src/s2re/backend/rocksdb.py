@@ -1,6 +1,7 @@
 import multiprocessing
+import warnings
 from pathlib import Path
-from typing import Iterable, Optional, Sequence, Type
+from typing import Iterable, Optional, Sequence, Type, Union
 
 try:
     import rocksdb
@@ -9,10 +10,20 @@ except ImportError:
 
 from ..types import HookComboKeyType, HookComboValueType
 from .base import BackendRegistry, BaseKVStorage
+from .profiles import RocksDBProfile, block_size_for, get_rocksdb_profile
 
 
 @BackendRegistry.reg("rocksdb")
 class RocksDBStorage(BaseKVStorage):
+    """A RocksDB-backed key-value storage. In read-only mode, the
+    database is opened as a read-only instance, which takes no lock, so
+    any number of processes can read it at once.
+
+    `profile` tunes RocksDB for a workload, as in RocksDictStorage; its
+    settings take precedence over the other options. python-rocksdb
+    exposes neither blob files nor read-ahead for point reads, so
+    `blob_min_size` and `readahead_size` are ignored."""
+
     db: rocksdb.DB if rocksdb else None
 
     def __init__(
@@ -24,13 +35,15 @@ class RocksDBStorage(BaseKVStorage):
         optimize_filters_for_hits: bool = True,
         allow_mmap_reads: bool = True,
         use_adaptive_mutex: bool = True,
+        profile: Union[str, RocksDBProfile, None] = None,
+        value_size: int = 0,
         **kwargs
     ):
         super().__init__(*args, **kwargs)
 
         n_proc = n_proc or multiprocessing.cpu_count()
         options = rocksdb.Options(
-            create_if_missing=True,
+            create_if_missing=not self.read_only,
             compression_opts=dict(
                 enabled=compression,
                 compression_type=rocksdb.CompressionType(compression_type),
@@ -42,7 +55,63 @@ class RocksDBStorage(BaseKVStorage):
             use_adaptive_mutex=use_adaptive_mutex,
         )
         options.IncreaseParallelism(n_proc)
-        self.db = rocksdb.DB(str(self.path), options)
+
+        self.profile = get_rocksdb_profile(profile)
+        if self.profile is not None:
+            self._apply_profile(options, self.profile, value_size)
+
+        self.db = rocksdb.DB(
+            str(self.path), options, read_only=self.read_only
+        )
+
+    @staticmethod
+    def _apply_profile(
+        options: "rocksdb.Options", profile: RocksDBProfile, value_size: int
+    ) -> None:
+        options.table_factory = rocksdb.BlockBasedTableFactory(
+            filter_policy=(
+                rocksdb.BloomFilterPolicy(profile.bloom_bits_per_key)
+                if profile.bloom_bits_per_key > 0
+                else None
+            ),
+            block_cache=rocksdb.LRUCache(profile.block_cache_size),
+            block_size=block_size_for(profile, value_size),
+        )
+        options.compression = getattr(
+            rocksdb.CompressionType,
+            "no_compression"
+            if profile.compression == "none"
+            else f"{profile.compression}_compression",
+        )
+        options.write_buffer_size = profile.write_buffer_size
+        options.disable_auto_compactions = profile.bulk_load
+        if profile.blob_min_size > 0 or profile.readahead_size > 0:
+            warnings.warn(
+                "python-rocksdb supports neither blob files nor "
+                "read-ahead; use the rocksdict backend for them."
+            )
+
+    def _write(self, wb: "rocksdb.WriteBatch") -> None:
+        if self.profile is None:
+            self.db.write(wb)
+        else:
+            self.db.write(
+                wb,
+                sync=self.profile.sync,
+                disable_wal=self.profile.bulk_load,
+            )
+
+    def compact(self) -> None:
+        """Compacts the whole database."""
+        self.db.compact_range()
+
+    def close(self) -> None:
+        bulk_loaded = self.profile is not None and self.profile.bulk_load
+        if bulk_loaded and not self.read_only:
+            # bulk loading leaves everything in level 0, which is slow
+            # to read from.
+            self.compact()
+        super().close()
 
     @classmethod
     def files(cls: Type["RocksDBStorage"], path: Path) -> Iterable[Path]:
@@ -64,7 +133,7 @@ class RocksDBStorage(BaseKVStorage):
         wb = rocksdb.WriteBatch()
         for key, array in zip(keys, values):
             wb.put(self.sr.key(key), self.sr.serialize(array))
-        self.db.write(wb)
+        self._write(wb)
 
     def batch_delete(
         self: "RocksDBStorage", keys: Iterable[HookComboKeyType]
@@ -72,4 +141,4 @@ class RocksDBStorage(BaseKVStorage):
         wb = rocksdb.WriteBatch()
         for key in keys:
             wb.delete(self.sr.key(key))
-        self.db.write(wb)
+        self._write(wb)
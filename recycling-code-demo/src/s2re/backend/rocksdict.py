@@ -1,36 +1,198 @@
+import tempfile
 from pathlib import Path
-from typing import Iterable, Sequence, Type
+from typing import Iterable, Optional, Sequence, Type, Union
 
 from ..types import HookComboKeyType, HookComboValueType
 from .base import BackendRegistry, BaseKVStorage
+from .ingest import SortedRuns
+from .profiles import RocksDBProfile, block_size_for, get_rocksdb_profile
 
 try:
-    from rocksdict import AccessType, Options, Rdict, WriteBatch, WriteOptions
+    from rocksdict import (
+        AccessType,
+        BlockBasedOptions,
+        Cache,
+        DBCompressionType,
+        IngestExternalFileOptions,
+        Options,
+        Rdict,
+        ReadOptions,
+        SstFileWriter,
+        WriteBatch,
+        WriteOptions,
+    )
 except ImportError:
     Rdict = None
 
 
 @BackendRegistry.reg("rocksdict")
 class RocksDictStorage(BaseKVStorage):
+    """A RocksDB-backed key-value storage, through rocksdict.
+
+    In read-only mode, the database is opened as a read-only instance,
+    which takes no lock, so any number of processes can read it at once.
+    If `secondary_path` is also given, it is opened as a secondary
+    instance instead (keeping its own state in `secondary_path`), which
+    can follow a database that is still being written: call `refresh`
+    to see new values.
+
+    `profile` tunes RocksDB for a workload: the name of one of
+    ROCKSDB_PROFILES ("bulk_load", "random_read", "sequential_scan") or
+    a RocksDBProfile. `value_size`, the expected size of a serialized
+    value in bytes, is used by profiles that match their block size to
+    it. Without a profile, RocksDB defaults are used and every write is
+    synced to disk.
+
+    If `ingest` is True, writes bypass the database: values are sorted
+    on disk in runs of `ingest_run_size` bytes, and when the storage is
+    closed, the runs are merged into SST files of `ingest_file_size`
+    bytes that are ingested into the database at once. This is much
+    faster than regular writes for very large caches, but values can
+    only be read once the storage has been closed. Deletes are sorted
+    along with values, so the last write or delete of a key wins.
+    `ingest` is ignored in read-only mode, so the same options can be
+    used to record a cache and to read it.
+    """
+
     db: Rdict
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        secondary_path: Optional[str] = None,
+        profile: Union[str, RocksDBProfile, None] = None,
+        value_size: int = 0,
+        ingest: bool = False,
+        ingest_run_size: int = 256 << 20,
+        ingest_file_size: int = 256 << 20,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
 
         if Rdict is None:
             raise ImportError("rocksdict is not installed.")
 
-        access_type = (
-            AccessType.read_only()
-            if self.read_only
-            else AccessType.read_write()
-        )
+        if secondary_path is not None and not self.read_only:
+            raise ValueError("secondary_path requires read_only=True")
+
+        self.secondary_path = secondary_path
+        if secondary_path is not None:
+            access_type = AccessType.secondary(str(secondary_path))
+        elif self.read_only:
+            access_type = AccessType.read_only()
+        else:
+            access_type = AccessType.read_write()
+
+        self.profile = get_rocksdb_profile(profile)
+        self.write_options = WriteOptions()
+        if self.profile is None:
+            options = Options(raw_mode=True)
+            self.write_options.sync = True
+        else:
+            options = self._profile_options(self.profile, value_size)
+            self.write_options.sync = self.profile.sync
+            self.write_options.disable_wal = self.profile.bulk_load
+        self.options = options
+
+        self.ingest_file_size = ingest_file_size
+        self._runs: Optional[SortedRuns] = None
+        if ingest and not self.read_only:
+            self._runs = SortedRuns(
+                directory=tempfile.mkdtemp(
+                    prefix=f".{self.path.name}-ingest-", dir=self.path.parent
+                ),
+                run_size=ingest_run_size,
+            )
+
         self.db = Rdict(
             path=str(self.path),
-            options=Options(raw_mode=True),
+            options=options,
             access_type=access_type,
         )
 
+        if self.profile is not None and self.profile.readahead_size > 0:
+            read_options = ReadOptions()
+            read_options.set_readahead_size(self.profile.readahead_size)
+            self.db.set_read_options(read_options)
+
+    @staticmethod
+    def _profile_options(profile: RocksDBProfile, value_size: int) -> Options:
+        options = Options(raw_mode=True)
+
+        table_options = BlockBasedOptions()
+        table_options.set_block_cache(Cache(profile.block_cache_size))
+        table_options.set_block_size(block_size_for(profile, value_size))
+        if profile.bloom_bits_per_key > 0:
+            table_options.set_bloom_filter(profile.bloom_bits_per_key, False)
+            options.set_optimize_filters_for_hits(True)
+        options.set_block_based_table_factory(table_options)
+
+        compression = getattr(DBCompressionType, profile.compression)()
+        options.set_compression_type(compression)
+        if profile.blob_min_size > 0:
+            options.set_enable_blob_files(True)
+            options.set_min_blob_size(profile.blob_min_size)
+            options.set_blob_compression_type(compression)
+
+        options.set_write_buffer_size(profile.write_buffer_size)
+        if profile.bulk_load:
+            options.prepare_for_bulk_load()
+        return options
+
+    def refresh(self) -> None:
+        """Makes values written since the database was opened visible;
+        only secondary instances can do this."""
+        if self.secondary_path is None:
+            raise RuntimeError("Only secondary instances can be refreshed.")
+        self.db.try_catch_up_with_primary()
+
+    def compact(self) -> None:
+        """Compacts the whole database."""
+        self.db.compact_range(None, None)
+
+    def _write_sst_files(self, runs: SortedRuns) -> Sequence[str]:
+        paths = []
+        writer = None
+        for key, value in runs.merged():
+            if writer is None:
+                paths.append(str(runs.directory / f"{len(paths):05d}.sst"))
+                writer = SstFileWriter(options=self.options)
+                writer.open(paths[-1])
+            if value is None:
+                del writer[key]
+            else:
+                writer[key] = value
+            if writer.file_size() >= self.ingest_file_size:
+                writer.finish()
+                writer = None
+        if writer is not None:
+            writer.finish()
+        return paths
+
+    def ingest(self) -> None:
+        """Ingests values written so far into the database; called when
+        the storage is closed."""
+        if self._runs is None or len(self._runs) == 0:
+            return
+        paths = self._write_sst_files(self._runs)
+        options = IngestExternalFileOptions()
+        options.set_move_files(True)
+        self.db.ingest_external_file(paths, options)
+        self._runs.cleanup()
+        self._runs = SortedRuns(self._runs.directory, self._runs.run_size)
+
+    def close(self) -> None:
+        if self._runs is not None:
+            self.ingest()
+            self._runs.cleanup()
+            self._runs = None
+        bulk_loaded = self.profile is not None and self.profile.bulk_load
+        if bulk_loaded and not self.read_only:
+            # bulk loading leaves everything in level 0, which is slow
+            # to read from.
+            self.compact()
+        self.db.close()
+
     @classmethod
     def files(cls: Type["RocksDictStorage"], path: Path) -> Iterable[Path]:
         return (f for f in Path(path).glob("**/*") if f.is_file())
@@ -48,12 +210,22 @@ class RocksDictStorage(BaseKVStorage):
         keys: Iterable[HookComboKeyType],
         values: Iterable[HookComboValueType],
     ) -> None:
+        if self._runs is not None:
+            for key, array in zip(keys, values):
+                self._runs.add(self.sr.key(key), self.sr.serialize(array))
+            return
+
         wb = WriteBatch(raw_mode=True)
         for key, array in zip(keys, values):
             wb.put(self.sr.key(key), self.sr.serialize(array))
-        self.db.write(wb, write_opt=WriteOptions(sync=True))
+        self.db.write(wb, write_opt=self.write_options)
 
     def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
+        if self._runs is not None:
+            for key in keys:
+                self._runs.delete(self.sr.key(key))
+            return
+
         wb = WriteBatch(raw_mode=True)
         [wb.delete(self.sr.key(key)) for key in keys]
-        self.db.write(wb, write_opt=WriteOptions(sync=True))
+        self.db.write(wb, write_opt=self.write_options)
@@ -1,10 +1,22 @@
 import pickle
+import struct
+import warnings
+from abc import ABC, abstractclassmethod
 from collections import abc
 from enum import IntFlag
-from typing import Mapping, NamedTuple, Sequence, Type, Union
+from typing import (
+    Dict,
+    List,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
+import numpy as np
 import torch
-from regex import F
 
 from ..types import BackendValueType, HookSingleValueType
 
@@ -25,7 +37,32 @@ class SerializationContainer(NamedTuple):
     data: Union[BackendValueType, "SerializationContainer"]
 
 
-class PickleSerialization:
+class BaseSerialization(ABC):
+    """Turns values into bytes and back; subclasses must implement
+    `serialize` and `deserialize`."""
+
+    @abstractclassmethod
+    def serialize(
+        cls: Type["BaseSerialization"], value: HookSingleValueType
+    ) -> bytes:
+        raise NotImplementedError()
+
+    @abstractclassmethod
+    def deserialize(
+        cls: Type["BaseSerialization"], buffer: bytes, writable: bool = True
+    ) -> HookSingleValueType:
+        """Turns bytes back into a value; unless `writable` is False,
+        arrays in it are writable."""
+        raise NotImplementedError()
+
+    @classmethod
+    def key(cls, key: bytes) -> bytes:
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return key
+
+
+class PickleSerialization(BaseSerialization):
     @classmethod
     def _raw_load(
         cls: Type["PickleSerialization"], buffer: bytes
@@ -101,8 +138,9 @@ class PickleSerialization:
 
     @classmethod
     def deserialize(
-        cls: Type["PickleSerialization"], buffer: bytes
+        cls: Type["PickleSerialization"], buffer: bytes, writable: bool = True
     ) -> HookSingleValueType:
+        # unpickled arrays are always copies of the buffer
         container = cls._raw_load(buffer)
         if container.type == CONTAINER_TYPE.DICT:
             value = cls._deserialize_dict(container)
@@ -112,8 +150,293 @@ class PickleSerialization:
             value = cls._deserialize_array(container)
         return value
 
+
+class BinarySerialization(BaseSerialization):
+    """Serializes values as a small header followed by the raw bytes of
+    each array, so that arrays can be decoded with `np.frombuffer` as
+    views of the buffer returned by the backend instead of copies.
+    Dictionaries and lists can be nested.
+
+    Layout (little endian):
+
+        magic (4 bytes) | header size (u32) | header | pad | arrays
+
+    The header is a pre-order walk of the value. Every node starts with
+    its CONTAINER_TYPE (u8). Dicts and lists are followed by their length
+    (u32), and each dict element by its name (u16 size + utf-8 bytes).
+    Arrays are followed by dtype code (u8), ndim (u8), shape (u64 each),
+    and the offset of their data in the arrays section (u64).
+
+    Buffers that do not start with the magic bytes are handed to
+    PickleSerialization, so stores written with it remain readable.
+    Arrays returned by `deserialize` share memory with the buffer if it
+    is writable; read-only buffers (e.g. bytes) are copied once, unless
+    `writable` is False, in which case arrays are read-only views of
+    them and must not outlive them.
+    """
+
+    MAGIC = b"S2RB"
+    ALIGNMENT = 8
+
+    DTYPES: Tuple[np.dtype, ...] = tuple(
+        np.dtype(t)
+        for t in (
+            "bool",
+            "int8",
+            "uint8",
+            "int16",
+            "uint16",
+            "int32",
+            "uint32",
+            "int64",
+            "uint64",
+            "float16",
+            "float32",
+            "float64",
+            "complex64",
+            "complex128",
+        )
+    )
+    DTYPE_CODES: Dict[np.dtype, int] = {t: i for i, t in enumerate(DTYPES)}
+
+    # numpy has no bfloat16; we store the raw bits as int16.
+    BFLOAT16_CODE = 255
+
     @classmethod
-    def key(cls, key: bytes) -> bytes:
-        if isinstance(key, str):
-            key = key.encode("utf-8")
-        return key
+    def _align(cls: Type["BinarySerialization"], offset: int) -> int:
+        return -(-offset // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    @classmethod
+    def _encode_array(
+        cls: Type["BinarySerialization"],
+        array: BackendValueType,
+        header: List[bytes],
+        arrays: List[Tuple[int, np.ndarray]],
+        offset: int,
+    ) -> int:
+        if isinstance(array, torch.Tensor):
+            type_ = CONTAINER_TYPE.TORCH
+            tensor = array.detach().cpu()
+            if tensor.dtype == torch.bfloat16:
+                code = cls.BFLOAT16_CODE
+                array = tensor.view(torch.int16).numpy()
+            else:
+                code = None
+                array = tensor.numpy()
+        else:
+            type_ = CONTAINER_TYPE.NUMPY
+            code = None
+
+        # unlike np.ascontiguousarray, this keeps 0-d arrays 0-d
+        array = np.require(array, requirements="C")
+        if code is None:
+            try:
+                code = cls.DTYPE_CODES[array.dtype]
+            except KeyError:
+                raise TypeError(f"Cannot serialize arrays of {array.dtype}")
+
+        offset = cls._align(offset)
+        header.append(
+            struct.pack(
+                f"<BBB{array.ndim}QQ",
+                type_,
+                code,
+                array.ndim,
+                *array.shape,
+                offset,
+            )
+        )
+        arrays.append((offset, array))
+        return offset + array.nbytes
+
+    @classmethod
+    def _encode(
+        cls: Type["BinarySerialization"],
+        value: HookSingleValueType,
+        header: List[bytes],
+        arrays: List[Tuple[int, np.ndarray]],
+        offset: int,
+    ) -> int:
+        if isinstance(value, abc.Mapping):
+            header.append(struct.pack("<BI", CONTAINER_TYPE.DICT, len(value)))
+            for name, element in value.items():
+                name_bytes = name.encode("utf-8")
+                header.append(struct.pack("<H", len(name_bytes)))
+                header.append(name_bytes)
+                offset = cls._encode(element, header, arrays, offset)
+        elif isinstance(value, abc.Sequence):
+            header.append(struct.pack("<BI", CONTAINER_TYPE.LIST, len(value)))
+            for element in value:
+                offset = cls._encode(element, header, arrays, offset)
+        else:
+            offset = cls._encode_array(value, header, arrays, offset)
+        return offset
+
+    @classmethod
+    def _layout(
+        cls: Type["BinarySerialization"], value: HookSingleValueType
+    ) -> Tuple[bytes, List[Tuple[int, np.ndarray]], int, int]:
+        """Encodes the header of a value; returns the prefix (magic, size
+        and header), the arrays with their offsets, the start of the
+        arrays section, and the total size of the serialized value."""
+        header: List[bytes] = []
+        arrays: List[Tuple[int, np.ndarray]] = []
+        end = cls._encode(value, header, arrays, 0)
+
+        header_bytes = b"".join(header)
+        prefix = b"".join(
+            (cls.MAGIC, struct.pack("<I", len(header_bytes)), header_bytes)
+        )
+        start = cls._align(len(prefix))
+        return prefix, arrays, start, start + end
+
+    @classmethod
+    def serialize(
+        cls: Type["BinarySerialization"], value: HookSingleValueType
+    ) -> bytes:
+        prefix, arrays, start, _ = cls._layout(value)
+        parts = [prefix, bytes(start - len(prefix))]
+
+        position = 0
+        for offset, array in arrays:
+            parts.append(bytes(offset - position))
+            parts.append(array.reshape(-1).view(np.uint8).data)
+            position = offset + array.nbytes
+
+        # b"".join accepts memoryviews, so array data is copied only once
+        return b"".join(parts)
+
+    @classmethod
+    def serialized_size(
+        cls: Type["BinarySerialization"], value: HookSingleValueType
+    ) -> int:
+        """Number of bytes `serialize` would return for a value."""
+        return cls._layout(value)[-1]
+
+    @classmethod
+    def serialize_into(
+        cls: Type["BinarySerialization"],
+        value: HookSingleValueType,
+        buffer: memoryview,
+    ) -> int:
+        """Like `serialize`, but writes into an existing writable buffer
+        (e.g. shared memory); returns the number of bytes written. Raises
+        ValueError if the value does not fit."""
+        prefix, arrays, start, size = cls._layout(value)
+        if size > len(buffer):
+            raise ValueError(
+                f"Value needs {size:,} bytes, buffer has {len(buffer):,}"
+            )
+
+        out = np.frombuffer(buffer, dtype=np.uint8, count=size)
+        out[: len(prefix)] = np.frombuffer(prefix, dtype=np.uint8)
+        for offset, array in arrays:
+            position = start + offset
+            out[position : position + array.nbytes] = array.reshape(
+                -1
+            ).view(np.uint8)
+        return size
+
+    @classmethod
+    def _decode_array(
+        cls: Type["BinarySerialization"],
+        buffer: bytes,
+        type_: CONTAINER_TYPE,
+        position: int,
+        start: int,
+    ) -> Tuple[BackendValueType, int]:
+        code, ndim = struct.unpack_from("<BB", buffer, position)
+        position += 2
+        *shape, offset = struct.unpack_from(f"<{ndim}QQ", buffer, position)
+        position += 8 * (ndim + 1)
+
+        is_bfloat16 = code == cls.BFLOAT16_CODE
+        dtype = np.dtype("int16") if is_bfloat16 else cls.DTYPES[code]
+        count = int(np.prod(shape, dtype=np.int64))
+
+        if count > 0:
+            array = np.frombuffer(
+                buffer, dtype=dtype, count=count, offset=start + offset
+            ).reshape(shape)
+        else:
+            array = np.empty(shape, dtype=dtype)
+
+        if type_ != CONTAINER_TYPE.TORCH:
+            return array, position
+
+        with warnings.catch_warnings():
+            # buffers are only read-only if the caller asked for views of
+            # them; torch warns about that, but they are not written to.
+            warnings.simplefilter("ignore")
+            tensor = torch.from_numpy(array)
+        if is_bfloat16:
+            tensor = tensor.view(torch.bfloat16)
+        return tensor, position
+
+    @classmethod
+    def _decode(
+        cls: Type["BinarySerialization"],
+        buffer: bytes,
+        position: int,
+        start: int,
+    ) -> Tuple[HookSingleValueType, int]:
+        (type_,) = struct.unpack_from("<B", buffer, position)
+        position += 1
+
+        if type_ == CONTAINER_TYPE.DICT:
+            (count,) = struct.unpack_from("<I", buffer, position)
+            position += 4
+            di = {}
+            for _ in range(count):
+                (size,) = struct.unpack_from("<H", buffer, position)
+                position += 2
+                name = bytes(buffer[position : position + size]).decode()
+                position += size
+                di[name], position = cls._decode(buffer, position, start)
+            return di, position
+
+        if type_ == CONTAINER_TYPE.LIST:
+            (count,) = struct.unpack_from("<I", buffer, position)
+            position += 4
+            seq = []
+            for _ in range(count):
+                element, position = cls._decode(buffer, position, start)
+                seq.append(element)
+            return seq, position
+
+        return cls._decode_array(buffer, type_, position, start)
+
+    @classmethod
+    def deserialize(
+        cls: Type["BinarySerialization"], buffer: bytes, writable: bool = True
+    ) -> HookSingleValueType:
+        if bytes(buffer[: len(cls.MAGIC)]) != cls.MAGIC:
+            return PickleSerialization.deserialize(buffer)
+
+        if writable and memoryview(buffer).readonly:
+            # one copy for the whole value, rather than one per array
+            buffer = bytearray(buffer)
+
+        (header_size,) = struct.unpack_from("<I", buffer, len(cls.MAGIC))
+        position = len(cls.MAGIC) + 4
+        start = cls._align(position + header_size)
+        value, _ = cls._decode(buffer, position, start)
+        return value
+
+
+SERIALIZATIONS: Dict[str, Type[BaseSerialization]] = {
+    "pickle": PickleSerialization,
+    "binary": BinarySerialization,
+}
+
+
+def get_serialization(name: str) -> Type[BaseSerialization]:
+    """Returns the serialization class corresponding to the given name"""
+    try:
+        return SERIALIZATIONS[name]
+    except KeyError:
+        available = ", ".join(f"`{s}`" for s in SERIALIZATIONS)
+        raise TypeError(
+            f"No serialization with name `{name}`; "
+            f"available serializations: {available}"
+        )
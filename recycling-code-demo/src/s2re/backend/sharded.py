@@ -0,0 +1,218 @@
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+)
+
+from ..types import HookComboKeyType, HookComboValueType
+from .base import BackendRegistry, BaseKVStorage
+
+
+@BackendRegistry.reg("sharded")
+class ShardedStorage(BaseKVStorage):
+    """A storage that spreads keys across `num_shards` child storages.
+
+    Keys are assigned to shards by the CRC32 of their bytes, and batches
+    are split by shard and read, written or deleted in parallel, one
+    thread per shard; results are returned in the order of the keys.
+    Children are `backend` storages opened with `backend_kwargs`, and
+    live in `shard-000`, `shard-001`, ... under `path`, or at
+    `shard_paths` if given (e.g. on different disks). New storages
+    default to 4 `leveldb` shards.
+
+    The layout is recorded in `path/sharding.json` when the storage is
+    created, and the backend, number of shards and shard paths are read
+    from it when it is reopened without them. Shards under `path` are
+    recorded by position only, so the storage can be moved or copied as
+    a whole; `shard_paths` are recorded as absolute paths. Reopening it
+    with a different backend or number of shards raises a ValueError,
+    since keys would be looked up in the wrong shard.
+    """
+
+    db: List[BaseKVStorage]
+
+    LAYOUT_NAME = "sharding.json"
+    SHARD_TEMPLATE = "shard-{:03d}"
+    DEFAULT_BACKEND = "leveldb"
+    DEFAULT_NUM_SHARDS = 4
+
+    def __init__(
+        self,
+        *args,
+        backend: Optional[str] = None,
+        num_shards: Optional[int] = None,
+        shard_paths: Optional[Sequence[Union[str, Path]]] = None,
+        backend_kwargs: Optional[Dict[str, Any]] = None,
+        serialization: str = "pickle",
+        **kwargs,
+    ):
+        super().__init__(*args, serialization=serialization, **kwargs)
+
+        if self.path is None:
+            raise ValueError("ShardedStorage requires a path.")
+
+        if shard_paths is not None:
+            shard_paths = [Path(p).absolute() for p in shard_paths]
+            if num_shards is None:
+                num_shards = len(shard_paths)
+            elif num_shards != len(shard_paths):
+                raise ValueError(
+                    f"Got {len(shard_paths)} shard paths for "
+                    f"num_shards={num_shards}"
+                )
+
+        layout = self._load_layout(self.path)
+        if layout is not None:
+            for name, value in (
+                ("backend", backend),
+                ("num_shards", num_shards),
+            ):
+                if value is not None and layout[name] != value:
+                    raise ValueError(
+                        f"{self.path} was created with {name}="
+                        f"{layout[name]!r}, not {value!r}"
+                    )
+            self.backend = layout["backend"]
+            self.num_shards = layout["num_shards"]
+            if shard_paths is None:
+                shard_paths = self._shard_paths(self.path, layout)
+        elif self.read_only:
+            raise FileNotFoundError(f"No sharded storage at {self.path}")
+        else:
+            self.backend = backend or self.DEFAULT_BACKEND
+            self.num_shards = num_shards or self.DEFAULT_NUM_SHARDS
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / self.LAYOUT_NAME, "w") as f:
+                json.dump(
+                    {
+                        "backend": self.backend,
+                        "num_shards": self.num_shards,
+                        "shard_paths": (
+                            None
+                            if shard_paths is None
+                            else [str(p) for p in shard_paths]
+                        ),
+                    },
+                    f,
+                )
+            if shard_paths is None:
+                shard_paths = self._default_shard_paths(
+                    self.path, self.num_shards
+                )
+
+        self.db = [
+            BackendRegistry.get(self.backend)(
+                path=shard_path,
+                read_only=self.read_only,
+                serialization=serialization,
+                **(backend_kwargs or {}),
+            )
+            for shard_path in shard_paths
+        ]
+        self._pool = ThreadPoolExecutor(max_workers=self.num_shards)
+
+    @classmethod
+    def _load_layout(cls, path: Path) -> Optional[Dict[str, Any]]:
+        layout_path = Path(path) / cls.LAYOUT_NAME
+        if not layout_path.exists():
+            return None
+        with open(layout_path) as f:
+            return json.load(f)
+
+    @classmethod
+    def _default_shard_paths(cls, path: Path, num_shards: int) -> List[Path]:
+        return [
+            Path(path) / cls.SHARD_TEMPLATE.format(i)
+            for i in range(num_shards)
+        ]
+
+    @classmethod
+    def _shard_paths(cls, path: Path, layout: Dict[str, Any]) -> List[Path]:
+        """The shard paths recorded in `layout`, or the default ones if it
+        records none."""
+        if layout["shard_paths"] is None:
+            return cls._default_shard_paths(path, layout["num_shards"])
+        return [Path(p) for p in layout["shard_paths"]]
+
+    @classmethod
+    def files(cls: Type["ShardedStorage"], path: Path) -> Iterable[Path]:
+        layout = cls._load_layout(path)
+        if layout is None:
+            return []
+        backend_cls = BackendRegistry.get(layout["backend"])
+        return [Path(path) / cls.LAYOUT_NAME] + [
+            f
+            for shard_path in cls._shard_paths(path, layout)
+            for f in backend_cls.files(shard_path)
+        ]
+
+    def shard(self, key: bytes) -> int:
+        """Returns the index of the shard a (serialized) key lives in."""
+        return zlib.crc32(key) % self.num_shards
+
+    def _split(self, keys: Sequence[HookComboKeyType]) -> Dict[int, List[int]]:
+        positions: Dict[int, List[int]] = {}
+        for i, key in enumerate(keys):
+            positions.setdefault(self.shard(self.sr.key(key)), []).append(i)
+        return positions
+
+    def _map(self, fn: Callable, args: Dict[int, Any]) -> Dict[int, Any]:
+        """Calls `fn(storage, arg)` with the storage of each shard in
+        `args`, in parallel if there is more than one."""
+        if len(args) == 1:
+            ((shard, arg),) = args.items()
+            return {shard: fn(self.db[shard], arg)}
+        futures = {
+            shard: self._pool.submit(fn, self.db[shard], arg)
+            for shard, arg in args.items()
+        }
+        return {shard: future.result() for shard, future in futures.items()}
+
+    def close(self) -> None:
+        self._pool.shutdown()
+        [storage.close() for storage in self.db]
+
+    def batch_read(
+        self, keys: Iterable[HookComboKeyType]
+    ) -> Sequence[HookComboValueType]:
+        keys = list(keys)
+        positions = self._split(keys)
+        results = self._map(
+            lambda storage, ps: storage.batch_read([keys[i] for i in ps]),
+            positions,
+        )
+        values: List[Any] = [None] * len(keys)
+        for shard, ps in positions.items():
+            for i, value in zip(ps, results[shard]):
+                values[i] = value
+        return values
+
+    def batch_write(
+        self,
+        keys: Iterable[HookComboKeyType],
+        values: Iterable[HookComboValueType],
+    ) -> None:
+        keys, values = list(keys), list(values)
+        self._map(
+            lambda storage, ps: storage.batch_write(
+                [keys[i] for i in ps], [values[i] for i in ps]
+            ),
+            self._split(keys),
+        )
+
+    def batch_delete(self, keys: Iterable[HookComboKeyType]) -> None:
+        keys = list(keys)
+        self._map(
+            lambda storage, ps: storage.batch_delete([keys[i] for i in ps]),
+            self._split(keys),
+        )
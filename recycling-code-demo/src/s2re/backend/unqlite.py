@@ -12,7 +12,8 @@ except ImportError:
 
 @BackendRegistry.reg("unqlite")
 class UnQLiteStorage(BaseKVStorage):
-    """An uqlite-backed key-value storage for numpy arrays."""
+    """An uqlite-backed key-value storage for numpy arrays. Several
+    processes can read it at once in read-only mode."""
 
     db: UnQLite
 
@@ -25,7 +26,9 @@ class UnQLiteStorage(BaseKVStorage):
         # Flags values are defined at https://github.com/coleifer/
         # unqlite-python/blob/06bbd668382080bf929cdef5247423ff4c0e5b32
         # /unqlite.pyx#L237-L246
-        flags = 0x00000002 if self.read_only else 0x00000004
+        # readers map the file into memory (0x00000100) rather than
+        # reading it into their own page cache.
+        flags = 0x00000102 if self.read_only else 0x00000004
         self.db = UnQLite(filename=str(self.path), flags=flags)
 
     @classmethod
@@ -35,6 +38,12 @@ class UnQLiteStorage(BaseKVStorage):
     def batch_read(
         self, keys: Iterable[HookComboKeyType]
     ) -> Sequence[HookComboValueType]:
+        if self.read_only:
+            # read-only databases can't start transactions
+            return [
+                self.sr.deserialize(self.db.fetch(self.sr.key(k)))
+                for k in keys
+            ]
         with self.db.transaction():
             arrays = [
                 self.sr.deserialize(self.db.fetch(self.sr.key(k)))
@@ -0,0 +1,788 @@
+import hashlib
+import os
+import threading
+from collections import abc
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+
+import numpy as np
+import torch
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .types import HookComboValueType
+
+# encoded values are stored as flat dictionaries, since that's what
+# every backend can serialize; each entry is named after the prefix, the
+# codec that encoded it ("" if it was stored as it is; learned codecs
+# add "@" and the id of their fitted state), the container the value was
+# (a tensor, list or dict), the codec-specific field, and the position
+# (or name) of the tensor in the container.
+CODEC_PREFIX = "__codec__:"
+
+
+class BaseCodec:
+    """Encodes floating point tensors into a smaller representation
+    before they are stored, and decodes them after they are fetched.
+
+    Encoded values name the codec of each of their tensors, so they can
+    be decoded without knowing which codec they were recorded with
+    (learned codecs read their fitted state back from the backend).
+    Tensors that are not floating point are stored as they are. Tensors
+    are encoded on the device they are recorded on, and decoded after
+    they have been moved to the device, unless the codec works `on_host`.
+    """
+
+    name: str = ""
+
+    # whether tensors are encoded and decoded on the cpu
+    on_host: bool = False
+
+    def applies(self, tensor: torch.Tensor) -> bool:
+        return tensor.is_floating_point() and tensor.dim() > 0
+
+    @property
+    def encoded_name(self) -> str:
+        """The name encoded tensors are stored under."""
+        return self.name
+
+    def encode_tensor(self, tensor: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """Returns the named arrays to store for a tensor."""
+        raise NotImplementedError()
+
+    def encode_tensors(
+        self, tensors: Sequence[torch.Tensor]
+    ) -> List[Dict[str, torch.Tensor]]:
+        """Encodes several tensors; codecs can override this to encode
+        them in parallel."""
+        return [self.encode_tensor(tensor) for tensor in tensors]
+
+    def decode_tensor(
+        self, fields: Mapping[str, torch.Tensor], state_id: str = ""
+    ) -> torch.Tensor:
+        """Decodes a tensor from its arrays; `state_id` is only used by
+        learned codecs."""
+        raise NotImplementedError()
+
+    def encode(self, value: HookComboValueType) -> HookComboValueType:
+        """Encodes the tensors in a value (a tensor, or a list or dict of
+        tensors); values without any floating point tensor are returned
+        as they are."""
+        return self.encode_batch([value])[0]
+
+    def encode_batch(
+        self, values: Sequence[HookComboValueType]
+    ) -> List[HookComboValueType]:
+        """Encodes several values, passing all their tensors to
+        `encode_tensors` at once."""
+        plans: List[Optional[Tuple[str, Dict[str, Any]]]] = []
+        to_encode = []
+        for value in values:
+            if isinstance(value, torch.Tensor):
+                container, elements = "tensor", {"": value}
+            elif isinstance(value, abc.Mapping):
+                container, elements = "dict", dict(value)
+            else:
+                container = "list"
+                elements = {str(i): v for i, v in enumerate(value)}
+
+            applicable = [v for v in elements.values() if self.applies(v)]
+            plans.append((container, elements) if applicable else None)
+            to_encode.extend(applicable)
+
+        encoded_tensors = iter(self.encode_tensors(to_encode))
+        encoded_values = []
+        for value, plan in zip(values, plans):
+            if plan is None:
+                encoded_values.append(value)
+                continue
+
+            container, elements = plan
+            encoded = {}
+            for slot, element in elements.items():
+                if self.applies(element):
+                    fields = next(encoded_tensors)
+                    name = self.encoded_name
+                else:
+                    fields, name = {"": element}, ""
+                for field, array in fields.items():
+                    key = f"{CODEC_PREFIX}{name}:{container}:{field}:{slot}"
+                    encoded[key] = array
+            encoded_values.append(encoded)
+        return encoded_values
+
+
+class Int8Codec(BaseCodec):
+    """Stores tensors as int8, with one float scale per token (`axis` is
+    "token": the last dimension shares a scale) or per channel ("channel":
+    every position in the last dimension has its own scale).
+
+    Scales map the largest absolute value to 127; with `zero_point`, the
+    range between the smallest and largest value is mapped to [-128, 127]
+    instead, which suits activations that aren't centered on zero (e.g.
+    after a GELU). Scales keep the dtype of the tensor.
+    """
+
+    name = "int8"
+
+    def __init__(self, axis: str = "token", zero_point: bool = False):
+        if axis not in ("token", "channel"):
+            raise ValueError(
+                f'Unknown axis {axis!r} (expected "token" or "channel")'
+            )
+        self.axis = axis
+        self.zero_point = zero_point
+
+    def _reduce(self, tensor: torch.Tensor, fn: str) -> torch.Tensor:
+        if self.axis == "token":
+            return getattr(tensor, fn)(dim=-1, keepdim=True)
+        # every dimension but the last, keeping them for broadcasting
+        flat = getattr(tensor.reshape(-1, tensor.shape[-1]), fn)(dim=0)
+        return flat.reshape(*(1 for _ in tensor.shape[:-1]), -1)
+
+    def encode_tensor(self, tensor: torch.Tensor) -> Dict[str, torch.Tensor]:
+        x = tensor.float()
+        if not self.zero_point:
+            scale = self._reduce(x.abs(), "amax").clamp_min(1e-12) / 127
+            data = torch.round(x / scale).clamp_(-127, 127)
+            return {
+                "data": data.to(torch.int8),
+                "scale": scale.to(tensor.dtype),
+            }
+
+        low, high = self._reduce(x, "amin"), self._reduce(x, "amax")
+        scale = (high - low).clamp_min(1e-12) / 255
+        zero_point = torch.round(-low / scale) - 128
+        data = torch.round(x / scale).add_(zero_point).clamp_(-128, 127)
+        return {
+            "data": data.to(torch.int8),
+            "scale": scale.to(tensor.dtype),
+            "zero_point": zero_point.to(torch.int16),
+        }
+
+    def decode_tensor(
+        self, fields: Mapping[str, torch.Tensor], state_id: str = ""
+    ) -> torch.Tensor:
+        scale = fields["scale"]
+        x = fields["data"].float()
+        if "zero_point" in fields:
+            x = x - fields["zero_point"].float()
+        return (x * scale.float()).to(scale.dtype)
+
+
+class BFloat16Codec(BaseCodec):
+    """Stores tensors as bfloat16, which keeps the range of float32 with
+    half of its bytes. Bits are stored as int16, since not every backend
+    can serialize bfloat16."""
+
+    name = "bf16"
+
+    def encode_tensor(self, tensor: torch.Tensor) -> Dict[str, torch.Tensor]:
+        return {
+            "data": tensor.to(torch.bfloat16).view(torch.int16),
+            # an empty tensor, to restore the original dtype
+            "like": tensor.new_empty(0),
+        }
+
+    def decode_tensor(
+        self, fields: Mapping[str, torch.Tensor], state_id: str = ""
+    ) -> torch.Tensor:
+        return fields["data"].view(torch.bfloat16).to(fields["like"].dtype)
+
+
+class LearnedCodec(BaseCodec):
+    """A codec that is fitted to a sample of the values it encodes.
+
+    While recording, the storage wrapper holds values back and passes
+    them to `observe` until `sample_size` vectors (positions along the
+    last dimension) have been collected; `fit_sample` then fits a state
+    to them, and all values are encoded with it. States are written to
+    the backend next to the values, and values name the state they were
+    encoded with, so a cache recorded in several sessions can be read
+    back with any number of states; when fetching, they are read from
+    the backend the first time they are needed.
+
+    Only tensors whose last dimension matches the one of the sample are
+    encoded; others are stored as they are.
+    """
+
+    def __init__(self, sample_size: int = 16384):
+        self.sample_size = sample_size
+        self.states: Dict[str, Dict[str, torch.Tensor]] = {}
+        self.state_id: Optional[str] = None
+        self._sample: List[torch.Tensor] = []
+        self._sampled = 0
+        self._on_device: Dict[Tuple[str, str], Dict[str, torch.Tensor]] = {}
+
+    @property
+    def fitted(self) -> bool:
+        return self.state_id is not None
+
+    @property
+    def dim(self) -> Optional[int]:
+        if self._sample:
+            return self._sample[0].shape[-1]
+        elif self.state_id is not None:
+            return self.state_dim(self.states[self.state_id])
+        return None
+
+    @property
+    def encoded_name(self) -> str:
+        return f"{self.name}@{self.state_id}"
+
+    def applies(self, tensor: torch.Tensor) -> bool:
+        dim = self.dim
+        return super().applies(tensor) and (
+            dim is None or tensor.shape[-1] == dim
+        )
+
+    def observe(self, value: HookComboValueType) -> bool:
+        """Adds the vectors in a value to the sample; returns whether
+        the sample is complete."""
+        if isinstance(value, torch.Tensor):
+            tensors = [value]
+        elif isinstance(value, abc.Mapping):
+            tensors = list(value.values())
+        else:
+            tensors = list(value)
+
+        for tensor in tensors:
+            if self._sampled >= self.sample_size:
+                break
+            if isinstance(tensor, torch.Tensor) and self.applies(tensor):
+                rows = tensor.detach().reshape(-1, tensor.shape[-1])
+                rows = rows[: self.sample_size - self._sampled]
+                self._sample.append(rows.to("cpu", torch.float32))
+                self._sampled += len(rows)
+        return self._sampled >= self.sample_size
+
+    def fit_sample(self) -> Tuple[str, Dict[str, torch.Tensor]]:
+        """Fits a state to the sample collected so far, and encodes
+        values with it from now on; returns its id and the state."""
+        if not self._sample:
+            raise ValueError(f"No values to fit {type(self).__name__} to")
+        state = self.fit(torch.cat(self._sample))
+        self._sample, self._sampled = [], 0
+
+        digest = hashlib.blake2b(digest_size=8)
+        for name in sorted(state):
+            digest.update(name.encode("utf-8"))
+            digest.update(state[name].contiguous().numpy().tobytes())
+        state_id = digest.hexdigest()
+
+        self.load_state(state_id, state)
+        self.state_id = state_id
+        return state_id, state
+
+    def load_state(self, state_id: str, state: Mapping[str, Any]) -> None:
+        """Adds a state, e.g. one read back from a backend."""
+        self.states[state_id] = {
+            # copied, since backends may return views of their buffers
+            name: (
+                array.clone()
+                if isinstance(array, torch.Tensor)
+                else torch.tensor(np.array(array))
+            )
+            for name, array in state.items()
+        }
+
+    def state_on(
+        self, state_id: str, device: Union[str, torch.device]
+    ) -> Dict[str, torch.Tensor]:
+        """Returns a state, moved to a device (once per device)."""
+        if state_id not in self.states:
+            raise KeyError(
+                f"{type(self).__name__} has no state {state_id!r}; it is "
+                "read from the backend values were recorded in"
+            )
+        key = (state_id, str(device))
+        if key not in self._on_device:
+            self._on_device[key] = {
+                name: array.to(device)
+                for name, array in self.states[state_id].items()
+            }
+        return self._on_device[key]
+
+    def state_dim(self, state: Mapping[str, torch.Tensor]) -> int:
+        """Size of the last dimension of the tensors a state encodes."""
+        raise NotImplementedError()
+
+    def fit(self, sample: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """Fits a state to a (number of vectors, dim) float32 sample."""
+        raise NotImplementedError()
+
+
+class PCACodec(LearnedCodec):
+    """Stores tensors as their projection on the top `rank` principal
+    components of the sample (after subtracting its mean), in the dtype
+    of the tensor; fetched values are reconstructed with a single matrix
+    multiplication on the device.
+    """
+
+    name = "pca"
+
+    def __init__(self, rank: int = 128, sample_size: int = 16384):
+        super().__init__(sample_size=sample_size)
+        self.rank = rank
+
+    def state_dim(self, state: Mapping[str, torch.Tensor]) -> int:
+        return state["basis"].shape[0]
+
+    def fit(self, sample: torch.Tensor) -> Dict[str, torch.Tensor]:
+        sample = sample.double()
+        mean = sample.mean(0)
+        centered = sample - mean
+        covariance = centered.T @ centered / max(len(sample) - 1, 1)
+        # eigenvalues are in ascending order
+        _, vectors = torch.linalg.eigh(covariance)
+        basis = vectors[:, -self.rank :].flip(-1)
+        return {"mean": mean.float(), "basis": basis.float().contiguous()}
+
+    def encode_tensor(self, tensor: torch.Tensor) -> Dict[str, torch.Tensor]:
+        state = self.state_on(self.state_id, tensor.device)
+        codes = (tensor.float() - state["mean"]) @ state["basis"]
+        return {"codes": codes.to(tensor.dtype)}
+
+    def decode_tensor(
+        self, fields: Mapping[str, torch.Tensor], state_id: str = ""
+    ) -> torch.Tensor:
+        codes = fields["codes"]
+        state = self.state_on(state_id, codes.device)
+        decoded = torch.addmm(
+            state["mean"],
+            codes.reshape(-1, codes.shape[-1]).float(),
+            state["basis"].T,
+        )
+        return decoded.reshape(*codes.shape[:-1], -1).to(codes.dtype)
+
+
+class PQCodec(LearnedCodec):
+    """Product quantization: vectors are split into `num_subvectors`
+    parts, and each part is stored as the index (one byte) of the
+    nearest of `num_centroids` centroids, learned with k-means on the
+    sample; fetched values are reconstructed by looking centroids up on
+    the device. A vector of 1024 float32 takes 32 bytes with 32
+    subvectors, for example.
+    """
+
+    name = "pq"
+
+    # distances computed at once, in floats: vectors are assigned to
+    # centroids a chunk of rows at a time, which bounds memory to 64 MB
+    MAX_DISTANCES = 1 << 24
+
+    def __init__(
+        self,
+        num_subvectors: int = 32,
+        num_centroids: int = 256,
+        iterations: int = 20,
+        sample_size: int = 16384,
+    ):
+        super().__init__(sample_size=sample_size)
+        if num_centroids > 256:
+            raise ValueError("PQCodec stores codes as bytes (at most 256)")
+        self.num_subvectors = num_subvectors
+        self.num_centroids = num_centroids
+        self.iterations = iterations
+
+    def state_dim(self, state: Mapping[str, torch.Tensor]) -> int:
+        num_subvectors, _, subdim = state["centroids"].shape
+        return num_subvectors * subdim
+
+    def _split(self, vectors: torch.Tensor) -> torch.Tensor:
+        # (n, dim) -> (num_subvectors, n, subdim)
+        return vectors.reshape(
+            len(vectors), self.num_subvectors, -1
+        ).transpose(0, 1)
+
+    def _nearest(
+        self, parts: torch.Tensor, centroids: torch.Tensor
+    ) -> torch.Tensor:
+        # (num_subvectors, n) indices of the nearest centroids
+        rows = max(self.MAX_DISTANCES // centroids.shape[:2].numel(), 1)
+        if parts.shape[1] <= rows:
+            return torch.cdist(parts, centroids).argmin(-1)
+        return torch.cat(
+            [
+                torch.cdist(chunk, centroids).argmin(-1)
+                for chunk in parts.split(rows, dim=1)
+            ],
+            dim=1,
+        )
+
+    def fit(self, sample: torch.Tensor) -> Dict[str, torch.Tensor]:
+        if sample.shape[-1] % self.num_subvectors:
+            raise ValueError(
+                f"Vectors of size {sample.shape[-1]} can't be split in "
+                f"{self.num_subvectors} subvectors"
+            )
+        parts = self._split(sample)
+        generator = torch.Generator().manual_seed(0)
+        initial = torch.randperm(len(sample), generator=generator)
+        # with fewer vectors than centroids, some centroids are repeated
+        initial = initial.repeat(-(-self.num_centroids // len(sample)))
+        centroids = parts[:, initial[: self.num_centroids]].clone()
+
+        for _ in range(self.iterations):
+            assignment = self._nearest(parts, centroids)
+            sums = torch.zeros_like(centroids).scatter_add_(
+                1, assignment[..., None].expand_as(parts), parts
+            )
+            counts = torch.zeros(centroids.shape[:2]).scatter_add_(
+                1, assignment, torch.ones(assignment.shape)
+            )
+            # centroids nobody is assigned to stay where they are
+            updated = counts > 0
+            centroids[updated] = sums[updated] / counts[updated][:, None]
+        return {"centroids": centroids}
+
+    def encode_tensor(self, tensor: torch.Tensor) -> Dict[str, torch.Tensor]:
+        centroids = self.state_on(self.state_id, tensor.device)["centroids"]
+        parts = self._split(tensor.reshape(-1, tensor.shape[-1]).float())
+        codes = self._nearest(parts, centroids).T
+        return {
+            "codes": codes.to(torch.uint8).reshape(*tensor.shape[:-1], -1),
+            # an empty tensor, to restore the original dtype
+            "like": tensor.new_empty(0),
+        }
+
+    def decode_tensor(
+        self, fields: Mapping[str, torch.Tensor], state_id: str = ""
+    ) -> torch.Tensor:
+        codes = fields["codes"]
+        centroids = self.state_on(state_id, codes.device)["centroids"]
+        flat = codes.reshape(-1, codes.shape[-1]).long()
+        # (n, num_subvectors, subdim)
+        parts = centroids[torch.arange(len(centroids)), flat]
+        decoded = parts.reshape(*codes.shape[:-1], -1)
+        return decoded.to(fields["like"].dtype)
+
+
+class ShuffleCodec(BaseCodec):
+    """Lossless compression of tensors, as in Blosc: the bytes of each
+    tensor are split in blocks of about `block_size` bytes, and every
+    block is shuffled and then compressed (by a subclass) on its own.
+
+    Shuffling groups bytes of the same significance together ("byte"),
+    or bits ("bit"), so that the exponents of floats end up next to
+    each other and compress well; `shuffle=None` compresses bytes as
+    they are. Blocks are compressed and decompressed in parallel by
+    `threads` threads (by default, one per cpu), on the cpu.
+    """
+
+    on_host = True
+
+    SHUFFLES = ("byte", "bit", "none")
+
+    def __init__(
+        self,
+        shuffle: Optional[str] = "byte",
+        block_size: int = 1 << 20,
+        threads: Optional[int] = None,
+    ):
+        shuffle = shuffle or "none"
+        if shuffle not in self.SHUFFLES:
+            raise ValueError(
+                f"Unknown shuffle {shuffle!r} (expected one of "
+                f"{', '.join(self.SHUFFLES)})"
+            )
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def applies(self, tensor: torch.Tensor) -> bool:
+        # lossless, so it might as well compress integer tensors
+        return tensor.dim() > 0 and tensor.dtype != torch.bool
+
+    def _compress(self, block: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def _decompress(self, block: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def _map(self, fn: Callable, items: List[Any]) -> List[Any]:
+        if len(items) < 2 or self.threads < 2:
+            return [fn(item) for item in items]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        return list(self._pool.map(fn, items))
+
+    @staticmethod
+    def _as_bytes(tensor: torch.Tensor) -> np.ndarray:
+        tensor = tensor.detach().cpu().contiguous()
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.view(torch.int16)
+        return tensor.reshape(-1).numpy().view(np.uint8)
+
+    def _blocks(self, data: np.ndarray, itemsize: int) -> List[np.ndarray]:
+        # blocks hold whole elements; bit shuffling packs 8 at a time
+        step = itemsize * (8 if self.shuffle == "bit" else 1)
+        size = max(self.block_size // step, 1) * step
+        return [data[i : i + size] for i in range(0, len(data), size)]
+
+    def _shuffle(self, block: np.ndarray, itemsize: int) -> np.ndarray:
+        if self.shuffle == "none":
+            return block
+        # (bytes of each element, elements)
+        shuffled = block.reshape(-1, itemsize).T
+        if self.shuffle == "bit":
+            bits = np.unpackbits(shuffled, axis=1).reshape(itemsize, -1, 8)
+            shuffled = np.packbits(bits.transpose(0, 2, 1), axis=-1)
+        return np.ascontiguousarray(shuffled).reshape(-1)
+
+    @staticmethod
+    def _unshuffle(
+        block: np.ndarray, shuffle: str, itemsize: int, count: int
+    ) -> np.ndarray:
+        """Reverses `_shuffle` for a block of `count` elements."""
+        if shuffle == "none":
+            return block
+        if shuffle == "bit":
+            bits = np.unpackbits(block.reshape(itemsize, 8, -1), axis=-1)
+            block = np.packbits(bits[..., :count].transpose(0, 2, 1), -1)
+        planes = block.reshape(itemsize, -1)
+        # much faster than a contiguous copy of the transpose
+        unshuffled = np.empty((planes.shape[1], itemsize), dtype=np.uint8)
+        for i, plane in enumerate(planes):
+            unshuffled[:, i] = plane
+        return unshuffled.reshape(-1)
+
+    def encode_tensors(
+        self, tensors: Sequence[torch.Tensor]
+    ) -> List[Dict[str, torch.Tensor]]:
+        # blocks of all tensors are compressed at once
+        jobs = []
+        for i, tensor in enumerate(tensors):
+            itemsize = tensor.element_size()
+            for block in self._blocks(self._as_bytes(tensor), itemsize):
+                jobs.append((i, block, itemsize))
+        compressed = self._map(
+            lambda job: self._compress(self._shuffle(job[1], job[2])), jobs
+        )
+
+        blocks: List[List[bytes]] = [[] for _ in tensors]
+        for (i, _, _), block in zip(jobs, compressed):
+            blocks[i].append(block)
+        return [
+            {
+                self.shuffle: torch.from_numpy(
+                    np.frombuffer(b"".join(parts), dtype=np.uint8).copy()
+                ),
+                "sizes": torch.tensor([len(b) for b in parts]),
+                "shape": torch.tensor(tensor.shape),
+                # an empty tensor, to restore the original dtype
+                "like": tensor.new_empty(0, device="cpu"),
+            }
+            for tensor, parts in zip(tensors, blocks)
+        ]
+
+    def encode_tensor(self, tensor: torch.Tensor) -> Dict[str, torch.Tensor]:
+        return self.encode_tensors([tensor])[0]
+
+    def decode_tensor(
+        self, fields: Mapping[str, torch.Tensor], state_id: str = ""
+    ) -> torch.Tensor:
+        # the shuffle used when recording, which might not be ours
+        shuffle = next(s for s in self.SHUFFLES if s in fields)
+        like = fields["like"]
+        itemsize = like.element_size()
+        shape = fields["shape"].tolist()
+        count = int(np.prod(shape, dtype=np.int64))
+        if count == 0:
+            return torch.empty(shape, dtype=like.dtype)
+        data = fields[shuffle].cpu().numpy()
+        offsets = np.cumsum([0] + fields["sizes"].tolist())
+
+        raw = self._map(
+            lambda i: np.frombuffer(
+                self._decompress(data[offsets[i] : offsets[i + 1]]),
+                dtype=np.uint8,
+            ),
+            list(range(len(offsets) - 1)),
+        )
+        if shuffle != "none":
+            # all blocks but the last hold a multiple of 8 elements, so
+            # only the last one can be padded by bit shuffling
+            counts = [len(block) // itemsize for block in raw[:-1]]
+            counts.append(count - sum(counts))
+            raw = self._map(
+                lambda job: self._unshuffle(job[0], shuffle, itemsize, job[1]),
+                list(zip(raw, counts)),
+            )
+
+        flat = np.concatenate(raw)
+        dtype = torch.int16 if like.dtype == torch.bfloat16 else like.dtype
+        decoded = torch.from_numpy(flat).view(dtype).reshape(shape)
+        return decoded.view(like.dtype)
+
+
+class LZ4Codec(ShuffleCodec):
+    """Shuffles blocks and compresses them with LZ4, which decompresses
+    at several GB/s; a `level` above 0 uses LZ4's high compression
+    mode, which compresses slower but decompresses as fast."""
+
+    name = "lz4"
+
+    def __init__(self, *args, level: int = 0, **kwargs):
+        if lz4_block is None:
+            raise ImportError("lz4 is not installed.")
+        super().__init__(*args, **kwargs)
+        self.level = level
+
+    def _compress(self, block: bytes) -> bytes:
+        if self.level > 0:
+            return lz4_block.compress(
+                block, mode="high_compression", compression=self.level
+            )
+        return lz4_block.compress(block)
+
+    def _decompress(self, block: bytes) -> bytes:
+        return lz4_block.decompress(block)
+
+
+class ZstdCodec(ShuffleCodec):
+    """Shuffles blocks and compresses them with Zstandard at `level`;
+    smaller than LZ4, but slower to decompress."""
+
+    name = "zstd"
+
+    def __init__(self, *args, level: int = 3, **kwargs):
+        if zstandard is None:
+            raise ImportError("zstandard is not installed.")
+        super().__init__(*args, **kwargs)
+        self.level = level
+        # zstandard's (de)compressors can't be shared between threads
+        self._local = threading.local()
+
+    def _compress(self, block: bytes) -> bytes:
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(self.level)
+        return self._local.compressor.compress(block)
+
+    def _decompress(self, block: bytes) -> bytes:
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.decompressor.decompress(block)
+
+
+CODECS: Dict[str, Type[BaseCodec]] = {
+    "int8": Int8Codec,
+    "bf16": BFloat16Codec,
+    "pca": PCACodec,
+    "pq": PQCodec,
+    "lz4": LZ4Codec,
+    "zstd": ZstdCodec,
+}
+
+
+def get_codec(codec: Union[str, BaseCodec, None]) -> Optional[BaseCodec]:
+    """Returns a codec with default options given its name; codecs and
+    None are returned as they are."""
+    if codec is None or isinstance(codec, BaseCodec):
+        return codec
+    try:
+        return CODECS[codec]()
+    except KeyError:
+        available = ", ".join(f"`{c}`" for c in CODECS)
+        raise ValueError(
+            f"No codec with name `{codec}`; available codecs: {available}"
+        )
+
+
+# instances of codecs with default options, shared by all the values
+# `decode` decodes with them (so that e.g. the threads of a compressing
+# codec are started once)
+_DEFAULT_CODECS: Dict[str, BaseCodec] = {}
+_DEFAULT_CODECS_LOCK = threading.Lock()
+
+
+def _default_codec(name: str) -> BaseCodec:
+    with _DEFAULT_CODECS_LOCK:
+        if name not in _DEFAULT_CODECS:
+            _DEFAULT_CODECS[name] = get_codec(name)
+        return _DEFAULT_CODECS[name]
+
+
+def is_encoded(value: Any) -> bool:
+    """Whether a value was encoded by a codec."""
+    return isinstance(value, abc.Mapping) and any(
+        isinstance(k, str) and k.startswith(CODEC_PREFIX) for k in value
+    )
+
+
+def _encoded_names(value: Any) -> Set[str]:
+    if not is_encoded(value):
+        return set()
+    return {k[len(CODEC_PREFIX) :].split(":", 1)[0] for k in value}
+
+
+def encoded_states(value: Any) -> Set[Tuple[str, str]]:
+    """Returns the names and state ids of the learned codecs that
+    encoded a value."""
+    return {tuple(n.split("@", 1)) for n in _encoded_names(value) if "@" in n}
+
+
+def decodes_on_host(value: Any) -> bool:
+    """Whether a value was encoded by a codec that decodes on the cpu."""
+    return any(
+        getattr(CODECS.get(n.split("@", 1)[0]), "on_host", False)
+        for n in _encoded_names(value)
+    )
+
+
+def decode(
+    value: HookComboValueType, codec: Optional[BaseCodec] = None
+) -> HookComboValueType:
+    """Decodes an encoded value back into a tensor, list or dict; `codec`
+    decodes the tensors it encoded, others are decoded by a codec of the
+    same name with default options, shared by all calls (learned codecs
+    can only decode values they have the state of)."""
+    if not is_encoded(value):
+        return value
+
+    container = "tensor"
+    # slot -> (codec name, fields)
+    slots: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for key, array in value.items():
+        name, container, field, slot = key[len(CODEC_PREFIX) :].split(":", 3)
+        slots.setdefault(slot, (name, {}))[1][field] = array
+
+    decoded = {}
+    for slot, (name, fields) in slots.items():
+        if not name:
+            decoded[slot] = fields[""]
+            continue
+        name, _, state_id = name.partition("@")
+        slot_codec = (
+            codec
+            if codec is not None and codec.name == name
+            else _default_codec(name)
+        )
+        decoded[slot] = slot_codec.decode_tensor(fields, state_id)
+
+    if container == "tensor":
+        return decoded[""]
+    elif container == "dict":
+        return decoded
+    return [decoded[str(i)] for i in range(len(decoded))]
@@ -1,3 +1,5 @@
+import hashlib
+import json
 from contextlib import contextmanager
 from inspect import getfullargspec, unwrap
 from pathlib import Path
@@ -6,6 +8,7 @@ from typing import (
     Callable,
     Dict,
     Iterator,
+    Mapping,
     Optional,
     Sequence,
     Type,
@@ -15,8 +18,15 @@ from typing import (
 import torch
 
 from ..backend import BackendRegistry
-from ..modules.base import BaseModuleWithCaching
+from ..codecs import BaseCodec
+from ..modules.base import (
+    BaseModuleWithCaching,
+    CachedLayer,
+    CacheKeyLookup,
+    NoOpWhenCached,
+)
 from .session import CachingSession
+from .wrapper import MemoryCache
 
 
 class CachingHook:
@@ -54,6 +64,121 @@ class CachingHook:
             "manually."
         )
 
+    @staticmethod
+    def infer_pad_token_id(module: torch.nn.Module) -> int:
+        """The padding token id in the config of a model, or 0 if it has
+        none."""
+        pad_token_id = getattr(
+            getattr(module, "config", None), "pad_token_id", None
+        )
+        return 0 if pad_token_id is None else pad_token_id
+
+    @staticmethod
+    def infer_checkpoint(module: torch.nn.Module) -> str:
+        """Identifies the weights of a model: the name or path it was
+        loaded from or, if it wasn't loaded from a checkpoint, a
+        fingerprint of the parameters of the layers that compute cached
+        values (a strided sample of each), which training on the cache
+        doesn't change."""
+        config = getattr(module, "config", None)
+        name_or_path = getattr(config, "_name_or_path", None)
+        if name_or_path:
+            return str(name_or_path)
+
+        fingerprint = hashlib.blake2b(digest_size=8)
+        parameters = (
+            (f"{n}.{p}", parameter)
+            for n, m in module.named_modules()
+            if isinstance(m, (CacheKeyLookup, NoOpWhenCached, CachedLayer))
+            for p, parameter in m.named_parameters()
+        )
+        for name, parameter in parameters:
+            flat = parameter.detach().flatten()
+            sample = flat[:: max(flat.numel() // 1024, 1)].float().cpu()
+            fingerprint.update(name.encode("utf-8"))
+            fingerprint.update(sample.numpy().tobytes())
+        return f"weights:{fingerprint.hexdigest()}"
+
+    @classmethod
+    def infer_model_identity(
+        cls, module: torch.nn.Module, checkpoint: bool = True
+    ) -> Dict[str, Any]:
+        """Describes a model: its checkpoint (see `infer_checkpoint`),
+        model type (or class name, if it has no config), hidden size,
+        number of layers, and the names of its caching layers. With
+        `checkpoint=False`, the checkpoint is left out, so that models
+        with the same architecture but different weights (e.g. BERT and
+        SciBERT) are described the same; only use it if the cached
+        layers don't depend on the weights."""
+        config = getattr(module, "config", None)
+        identity: Dict[str, Any] = {}
+        if checkpoint:
+            identity["checkpoint"] = cls.infer_checkpoint(module)
+        identity.update(
+            model_type=(
+                getattr(config, "model_type", None) or type(module).__name__
+            ),
+            hidden_size=getattr(config, "hidden_size", None),
+            num_hidden_layers=getattr(config, "num_hidden_layers", None),
+            cached_layers=[
+                n or "."
+                for n, m in module.named_modules()
+                if isinstance(m, BaseModuleWithCaching)
+            ],
+        )
+        return identity
+
+    @classmethod
+    def infer_key_context(
+        cls, module: torch.nn.Module, checkpoint: bool = True
+    ) -> str:
+        """Describes which model values are cached from, and where in it
+        (see `infer_model_identity`). Hashed keys include it, so caches
+        of different models or layers written to the same store don't
+        mix."""
+        identity = cls.infer_model_identity(module, checkpoint=checkpoint)
+        context = (
+            "{model_type}-{hidden_size}x{num_hidden_layers}:".format(
+                **identity
+            )
+            + ",".join(identity["cached_layers"])
+        )
+        if checkpoint:
+            context = f"{identity['checkpoint']}@{context}"
+        return context
+
+    @classmethod
+    def infer_namespace(
+        cls,
+        module: torch.nn.Module,
+        half_precision: bool = False,
+        tokenizer: Optional[Any] = None,
+        checkpoint: bool = True,
+        **extra: Any,
+    ) -> Dict[str, Any]:
+        """Describes the configuration a cache is recorded with: the
+        model (see `infer_model_identity`; `checkpoint` is passed to it),
+        the layer being cached, the precision and, if provided, a hash of
+        the tokenizer vocabulary. Pass it as `namespace` to keep caches
+        of different configurations apart in one store; `extra` entries
+        are added as-is."""
+        config = getattr(module, "config", None)
+        namespace: Dict[str, Any] = cls.infer_model_identity(
+            module, checkpoint=checkpoint
+        )
+        namespace.update(
+            position_to_cache=getattr(config, "position_to_cache", None),
+            half_precision=half_precision,
+        )
+        if tokenizer is not None:
+            vocab = sorted(tokenizer.get_vocab().items())
+            namespace["tokenizer"] = hashlib.blake2b(
+                json.dumps([type(tokenizer).__name__, vocab]).encode("utf-8"),
+                digest_size=8,
+            ).hexdigest()
+        namespace.update(extra)
+        return namespace
+
     @classmethod
     @contextmanager
     def Record(
@@ -64,6 +189,17 @@ class CachingHook:
         backend_kwargs: Optional[Dict[str, Any]] = None,
         device: Optional[str] = None,
         half_precision: bool = False,
+        ragged: bool = False,
+        pad_token_id: Optional[int] = None,
+        per_example_keys: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: Optional[str] = None,
+        namespace: Union[str, Mapping[str, Any], None] = None,
+        write_behind: int = -1,
+        write_batch_size: int = 0,
+        write_batch_bytes: int = 0,
+        codec: Union[str, BaseCodec, None] = None,
     ) -> Iterator[CachingSession]:
         caching_modules = cls.find_all_caching_modules(module)
 
@@ -75,12 +211,33 @@ class CachingHook:
             path=path,
             backend_kwargs=backend_kwargs,
             half_precision=half_precision,
+            ragged=ragged,
+            pad_token_id=(
+                cls.infer_pad_token_id(module)
+                if pad_token_id is None
+                else pad_token_id
+            ),
+            per_example_keys=per_example_keys,
+            hash_keys=hash_keys,
+            hash_check=hash_check,
+            key_context=(
+                cls.infer_key_context(module)
+                if key_context is None
+                else key_context
+            ),
+            namespace=namespace,
+            write_behind=write_behind,
+            write_batch_size=write_batch_size,
+            write_batch_bytes=write_batch_bytes,
+            codec=codec,
         )
         try:
             [m.set_session(session) for m in caching_modules]
             yield session
         finally:
             [m.del_session() for m in caching_modules]
+            # wait for values still being written in the background
+            session.close()
 
     @classmethod
     @contextmanager
@@ -96,7 +253,20 @@ class CachingHook:
         fetch_key_fn: Optional[Callable] = None,
         fetch_timeout: float = 0.1,
         fetch_retry_count: int = 10,
+        fetch_workers: int = 1,
+        fetch_slot_size: int = 32 << 20,
         half_precision: bool = False,
+        ragged: bool = False,
+        pad_token_id: Optional[int] = None,
+        per_example_keys: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: Optional[str] = None,
+        namespace: Union[str, Mapping[str, Any], None] = None,
+        pin_memory: bool = False,
+        memory_cache: Union[int, MemoryCache, None] = None,
+        codec: Union[str, BaseCodec, None] = None,
+        read_only: bool = True,
     ) -> Iterator[CachingSession]:
 
         caching_modules = cls.find_all_caching_modules(module)
@@ -112,13 +282,35 @@ class CachingHook:
             fetch_key_fn=fetch_key_fn,
             fetch_timeout=fetch_timeout,
             fetch_retry_count=fetch_retry_count,
+            fetch_workers=fetch_workers,
+            fetch_slot_size=fetch_slot_size,
             half_precision=half_precision,
+            ragged=ragged,
+            pad_token_id=(
+                cls.infer_pad_token_id(module)
+                if pad_token_id is None
+                else pad_token_id
+            ),
+            per_example_keys=per_example_keys,
+            hash_keys=hash_keys,
+            hash_check=hash_check,
+            key_context=(
+                cls.infer_key_context(module)
+                if key_context is None
+                else key_context
+            ),
+            namespace=namespace,
+            pin_memory=pin_memory,
+            memory_cache=memory_cache,
+            codec=codec,
+            read_only=read_only,
         )
         try:
             [m.set_session(session) for m in caching_modules]
             yield session
         finally:
             [m.del_session() for m in caching_modules]
+            session.close()
 
     @classmethod
     @contextmanager
@@ -134,7 +326,20 @@ class CachingHook:
         fetch_key_fn: Optional[Callable] = None,
         fetch_timeout: float = 0.1,
         fetch_retry_count: int = 10,
+        fetch_workers: int = 1,
+        fetch_slot_size: int = 32 << 20,
         half_precision: bool = False,
+        ragged: bool = False,
+        pad_token_id: Optional[int] = None,
+        per_example_keys: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: Optional[str] = None,
+        namespace: Union[str, Mapping[str, Any], None] = None,
+        pin_memory: bool = False,
+        memory_cache: Union[int, MemoryCache, None] = None,
+        codec: Union[str, BaseCodec, None] = None,
+        read_only: bool = True,
     ) -> Iterator[CachingSession]:
 
         caching_modules = cls.find_all_caching_modules(module)
@@ -150,13 +355,35 @@ class CachingHook:
             fetch_key_fn=fetch_key_fn,
             fetch_timeout=fetch_timeout,
             fetch_retry_count=fetch_retry_count,
+            fetch_workers=fetch_workers,
+            fetch_slot_size=fetch_slot_size,
             half_precision=half_precision,
+            ragged=ragged,
+            pad_token_id=(
+                cls.infer_pad_token_id(module)
+                if pad_token_id is None
+                else pad_token_id
+            ),
+            per_example_keys=per_example_keys,
+            hash_keys=hash_keys,
+            hash_check=hash_check,
+            key_context=(
+                cls.infer_key_context(module)
+                if key_context is None
+                else key_context
+            ),
+            namespace=namespace,
+            pin_memory=pin_memory,
+            memory_cache=memory_cache,
+            codec=codec,
+            read_only=read_only,
         )
         try:
             [m.set_session(session) for m in caching_modules]
             yield session
         finally:
             [m.del_session() for m in caching_modules]
+            session.close()
 
     def _check_spec(
         self,
@@ -1,13 +1,28 @@
+import json
+from functools import partial
 from pathlib import Path
-from typing import Any, Callable, Dict, Iterable, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import torch
 
+from ..codecs import BaseCodec
 from ..types import HookComboValueType
 from .wrapper import (
     FetchAheadStorageWrapper,
+    MemoryCache,
     MultiprocessingFetchAheadStorageWrapper,
     StorageWrapper,
+    WriteBehindStorageWrapper,
 )
 
 
@@ -20,6 +35,63 @@ class CachingSession:
     session is running: if True, it is set to record partial
     computations; if False, partial computations are retrieved instead
     of re-running layers.
+
+    If `ragged` is True, positions of the key equal to `pad_token_id` are
+    treated as padding: they are not written to the cache, and are filled
+    with zeros when values are fetched.
+
+    If `per_example_keys` is True, every example in a batch is cached under
+    its own key (its token ids without padding), so that a cache can be used
+    with a different batch size, padding, or order than it was recorded
+    with, e.g. by a shuffled DataLoader during training.
+
+    If `hash_keys` is True, keys are replaced by a 16-byte digest of their
+    content, dtype, shape and `key_context`; `hash_check` additionally
+    stores the original keys to detect collisions when fetching.
+
+    A `namespace` (a string, or a mapping such as the one returned by
+    `CachingHook.infer_namespace`) is folded into every key, so caches
+    recorded with different backbones, layers, precision or tokenizers
+    can live in the same store without overwriting each other.
+
+    If `write_behind` is greater than zero while recording, values are
+    written by a background thread, with up to `write_behind` of them
+    waiting to be written; call `close` (CachingHook does) to make sure
+    all of them have reached the backend.
+
+    `write_batch_size` and `write_batch_bytes` make the storage collect
+    values across forward calls, and write them in one backend batch once
+    that many keys or bytes are pending (zero disables either limit).
+
+    If `pin_memory` is True, fetched values are staged in reusable pinned
+    host buffers and copied to the device without blocking; on the cpu,
+    they are left in pinned memory.
+
+    When prefetching, `fetch_workers` sets how many fetchers read from
+    the backend at the same time; `iterate` still yields elements in
+    their original order. With `fetch_spawn="process"`, values are passed
+    from fetcher processes through shared memory slots of
+    `fetch_slot_size` bytes; larger values are pickled instead.
+
+    `memory_cache` keeps recently fetched values in memory, in front of
+    the backend: pass a size in bytes, or a MemoryCache to keep it (and
+    its hit, miss and eviction counts) across sessions.
+
+    A `codec` ("int8", "bf16", or a codec from `s2re.codecs`) makes the
+    cache store floating point values in a smaller, lossy encoding; they
+    are decoded back to their recorded dtype when fetched.
+
+    Besides its value, a key can have named columns: auxiliary tensors
+    passed to `store` as `columns`, and read back one by one with
+    `column`, without reading the value or the other columns. Columns
+    that only depend on the length of the key (e.g. relative positions,
+    or position biases) can be passed as `shared_columns` instead: they
+    are stored once for all keys of that length, and `shared_column`
+    reads them once per session.
+
+    Unless `read_only` is set, backends are opened read-only when not
+    recording, so that several processes (e.g. one training job per
+    GPU) can read the same store at once.
     """
 
     def __init__(
@@ -35,26 +107,42 @@ class CachingSession:
         fetch_spawn: str = "thread",
         fetch_timeout: float = 0.1,
         fetch_retry_count: int = 10,
+        fetch_workers: int = 1,
+        fetch_slot_size: int = 32 << 20,
         half_precision: bool = False,
         cast_type_map: Optional[Dict[torch.dtype, torch.dtype]] = None,
+        ragged: bool = False,
+        pad_token_id: int = 0,
+        per_example_keys: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: str = "",
+        namespace: Union[str, Mapping[str, Any], None] = None,
+        write_behind: int = -1,
+        write_batch_size: int = 0,
+        write_batch_bytes: int = 0,
+        pin_memory: bool = False,
+        memory_cache: Union[int, MemoryCache, None] = None,
+        codec: Union[str, BaseCodec, None] = None,
+        read_only: Optional[bool] = None,
     ):
         self._key = None
+        self._attached: Optional[HookComboValueType] = None
+        self._attached_columns: Dict[str, HookComboValueType] = {}
+        # shared columns stored, and fetched, so far
+        self._stored_shared: Set[Tuple[str, bytes]] = set()
+        self._fetched_shared: Dict[Tuple[str, bytes], HookComboValueType] = {}
+        self.namespace = self.format_namespace(namespace)
 
         self.recording = recording
         self.training = training
 
-        if half_precision:
-            cast_type_map = {
-                torch.float32: torch.float16,
-                torch.float16: torch.float32,
-                torch.int64: torch.int16,
-                torch.int16: torch.int64,
-                # in case user specifies more sophisticated mappings
-                **(cast_type_map or {}),
-            }
-        else:
-            # set to none if not half precision
-            cast_type_map = None
+        cast_type_map = self.get_cast_type_map(half_precision, cast_type_map)
+
+        if read_only is None:
+            read_only = not self.recording
+        # an explicit `read_only` in backend_kwargs wins
+        backend_kwargs = {"read_only": read_only, **(backend_kwargs or {})}
 
         if self.recording and self.training:
             raise ValueError(
@@ -67,7 +155,10 @@ class CachingSession:
             ), "fetch_key_fn must be provided when prefetching"
 
             if fetch_spawn == "process":
-                wrapper_factory = MultiprocessingFetchAheadStorageWrapper
+                wrapper_factory = partial(
+                    MultiprocessingFetchAheadStorageWrapper,
+                    slot_size=fetch_slot_size,
+                )
             elif fetch_spawn == "thread":
                 wrapper_factory = FetchAheadStorageWrapper
             else:
@@ -85,7 +176,37 @@ class CachingSession:
                 fetch_key_fn=fetch_key_fn,
                 timeout=fetch_timeout,
                 retry_count=fetch_retry_count,
+                fetch_workers=fetch_workers,
+                cast_types_map=cast_type_map,
+                ragged=ragged,
+                pad_token_id=pad_token_id,
+                per_example_keys=per_example_keys,
+                hash_keys=hash_keys,
+                hash_check=hash_check,
+                key_context=key_context,
+                namespace=self.namespace,
+                pin_memory=pin_memory,
+                memory_cache=memory_cache,
+                codec=codec,
+            )
+        elif write_behind > 0 and self.recording:
+            self.storage = WriteBehindStorageWrapper(
+                backend=backend,
+                path=path,
+                backend_kwargs=backend_kwargs,
+                device=device,
                 cast_types_map=cast_type_map,
+                ragged=ragged,
+                pad_token_id=pad_token_id,
+                per_example_keys=per_example_keys,
+                hash_keys=hash_keys,
+                hash_check=hash_check,
+                key_context=key_context,
+                namespace=self.namespace,
+                write_behind=write_behind,
+                write_batch_size=write_batch_size,
+                write_batch_bytes=write_batch_bytes,
+                codec=codec,
             )
         else:
             self.storage = StorageWrapper(
@@ -94,24 +215,95 @@ class CachingSession:
                 backend_kwargs=backend_kwargs,
                 device=device,
                 cast_types_map=cast_type_map,
+                ragged=ragged,
+                pad_token_id=pad_token_id,
+                per_example_keys=per_example_keys,
+                hash_keys=hash_keys,
+                hash_check=hash_check,
+                key_context=key_context,
+                namespace=self.namespace,
+                write_batch_size=write_batch_size,
+                write_batch_bytes=write_batch_bytes,
+                pin_memory=pin_memory,
+                memory_cache=memory_cache,
+                codec=codec,
             )
 
+    @staticmethod
+    def get_cast_type_map(
+        half_precision: bool,
+        cast_type_map: Optional[Dict[torch.dtype, torch.dtype]] = None,
+    ) -> Optional[Dict[torch.dtype, torch.dtype]]:
+        """Returns how dtypes are cast when values are stored, and back
+        when they are fetched."""
+        if half_precision:
+            return {
+                torch.float32: torch.float16,
+                torch.float16: torch.float32,
+                torch.int64: torch.int16,
+                torch.int16: torch.int64,
+                # in case user specifies more sophisticated mappings
+                **(cast_type_map or {}),
+            }
+        else:
+            # set to none if not half precision
+            return None
+
+    @staticmethod
+    def format_namespace(
+        namespace: Union[str, Mapping[str, Any], None]
+    ) -> str:
+        """Turns a namespace into a string that doesn't depend on the
+        order of keys in it."""
+        if namespace is None:
+            return ""
+        if isinstance(namespace, str):
+            return namespace
+        return json.dumps(namespace, sort_keys=True, default=str)
+
     def iterate(self, iterable: Iterable[Any]) -> Iterable[Any]:
         if isinstance(self.storage, FetchAheadStorageWrapper):
             yield from self.storage.prefetch(iterable)
         else:
             yield from iterable
 
-    def store(self, value: torch.Tensor):
+    def store(
+        self,
+        value: torch.Tensor,
+        columns: Optional[Mapping[str, HookComboValueType]] = None,
+        shared_columns: Optional[Mapping[str, HookComboValueType]] = None,
+    ):
+        """Stores the value for the current key, together with `columns`,
+        auxiliary values that can be fetched separately with `column`,
+        and `shared_columns`, which are the same for all keys as long as
+        the current one, and are only stored if they have not been yet
+        (see `shared_column`)."""
         if self._key is None:
             raise RuntimeError("Key not provided")
 
         if not self.recording:
             raise RuntimeError("Not in cache recording mode!")
 
+        for name, column in (columns or {}).items():
+            self.storage.store(key=self._key, value=column, column=name)
+        for name, column in (shared_columns or {}).items():
+            shared_key = self._shared_key()
+            if (name, shared_key) not in self._stored_shared:
+                self.storage.store(
+                    key=[shared_key], value=[column], column=name
+                )
+                self._stored_shared.add((name, shared_key))
         self.storage.store(key=self._key, value=value)
         self._key = None
 
+    def flush(self):
+        """Waits until all stored values have been written."""
+        self.storage.flush()
+
+    def close(self):
+        """Flushes pending writes and stops background writers."""
+        self.storage.close()
+
     def fetch(self) -> HookComboValueType:
         if self._key is None:
             raise RuntimeError("Key not provided")
@@ -119,11 +311,71 @@ class CachingSession:
         if self.recording:
             raise RuntimeError("Not in cache fetching mode!")
 
-        out = self.storage.fetch(self._key)
+        if self._attached is not None:
+            # already cast by whoever loaded it; only needs moving
+            out = self.storage._cast_value(
+                self._attached, device=self.storage.device
+            )
+            self._attached = None
+        else:
+            out = self.storage.fetch(self._key)
 
+        self._attached_columns = {}
         self._key = None
         return out
 
+    def column(self, name: str) -> HookComboValueType:
+        """Fetches the column `name` stored with the value for the current
+        key, reading nothing else; unlike `fetch`, the key is kept, so
+        that the value (or other columns) can be fetched next."""
+        if self._key is None:
+            raise RuntimeError("Key not provided")
+
+        if self.recording:
+            raise RuntimeError("Not in cache fetching mode!")
+
+        if name in self._attached_columns:
+            return self.storage._cast_value(
+                self._attached_columns[name], device=self.storage.device
+            )
+        return self.storage.fetch(self._key, column=name)
+
+    def shared_column(self, name: str) -> HookComboValueType:
+        """Fetches the shared column `name` stored for keys as long as
+        the current one; like `column`, it keeps the key. Shared columns
+        are read from the backend once, and then kept by the session."""
+        if self._key is None:
+            raise RuntimeError("Key not provided")
+
+        if self.recording:
+            raise RuntimeError("Not in cache fetching mode!")
+
+        shared_key = self._shared_key()
+        if (name, shared_key) not in self._fetched_shared:
+            (value,) = self.storage.fetch([shared_key], column=name)
+            self._fetched_shared[(name, shared_key)] = value
+        return self._fetched_shared[(name, shared_key)]
+
+    def _shared_key(self) -> bytes:
+        """Key under which shared columns for keys as long as the current
+        one are stored; token ids would have to spell it out to collide
+        with another key."""
+        return f"__shared__/{self._key.size(-1)}".encode("utf-8")
+
+    def attach(
+        self,
+        value: HookComboValueType,
+        columns: Optional[Mapping[str, HookComboValueType]] = None,
+    ):
+        """Sets the value the next `fetch` returns instead of reading it
+        from the backend, e.g. cached values loaded with a DataLoader
+        (see `s2re.data.CachedDataset`); `columns` are returned by
+        `column` in the same way."""
+        if self.recording:
+            raise RuntimeError("Not in cache fetching mode!")
+        self._attached = value
+        self._attached_columns = dict(columns or {})
+
     def key(self, key: torch.Tensor):
         if self._key is not None:
             raise RuntimeError("Key is already set")
@@ -1,17 +1,22 @@
+import hashlib
 import multiprocessing
 import threading
-from collections import abc
+import warnings
+from collections import OrderedDict, abc
+from multiprocessing import shared_memory
 from pathlib import Path
 from queue import Queue
-from time import sleep
 from typing import (
     Any,
     Callable,
     Dict,
     Iterable,
+    List,
     Mapping,
+    NamedTuple,
     Optional,
     Sequence,
+    Set,
     Tuple,
     Type,
     Union,
@@ -23,6 +28,17 @@ import torch
 
 from ..backend import BackendRegistry
 from ..backend.base import BaseKVStorage
+from ..backend.serialization import BinarySerialization
+from ..codecs import (
+    CODEC_PREFIX,
+    BaseCodec,
+    LearnedCodec,
+    decode,
+    decodes_on_host,
+    encoded_states,
+    get_codec,
+    is_encoded,
+)
 from ..types import HookComboKeyType, HookComboValueType
 
 BaseKeyType = Union[torch.Tensor, Sequence[torch.Tensor], Sequence[bytes]]
@@ -52,6 +68,86 @@ class MoveAndGradMixIn:
         return tensor
 
 
+class HostBufferPool:
+    """A pool of host buffers to copy values to a device from.
+
+    Values are copied once into a buffer from the pool (pinned, if CUDA
+    is available, so that the copy to the device can be non-blocking),
+    and then to the device. A buffer is only handed out again once the
+    copy to the device from it has completed.
+    """
+
+    def __init__(self, pin: Optional[bool] = None, max_buffers: int = 32):
+        self.pin = torch.cuda.is_available() if pin is None else pin
+        self.max_buffers = max_buffers
+        self._free: List[torch.Tensor] = []
+        self._in_use: List[Tuple[torch.Tensor, Any]] = []
+
+    def _reclaim(self) -> None:
+        in_use = []
+        for buffer, event in self._in_use:
+            if event is None or event.query():
+                self._free.append(buffer)
+            else:
+                in_use.append((buffer, event))
+        self._in_use = in_use
+
+        # drop the smallest buffers if we are holding too many
+        self._free.sort(key=lambda b: b.numel())
+        del self._free[: max(len(self._free) - self.max_buffers, 0)]
+
+    def acquire(self, nbytes: int) -> torch.Tensor:
+        """Returns a uint8 buffer of at least `nbytes` bytes."""
+        self._reclaim()
+        for i, buffer in enumerate(self._free):
+            # free buffers are sorted, so this is the smallest that fits
+            if buffer.numel() >= nbytes:
+                return self._free.pop(i)
+
+        # rounding up to a power of two makes buffers easier to reuse
+        size = 1 << max(nbytes - 1, 0).bit_length()
+        return torch.empty(size, dtype=torch.uint8, pin_memory=self.pin)
+
+    def release(self, buffer: torch.Tensor, event: Any = None) -> None:
+        """Returns a buffer to the pool; it is reused once `event` (a
+        CUDA event recorded after the copy from it, if any) completes."""
+        self._in_use.append((buffer, event))
+
+    def to_device(
+        self,
+        value: Union[np.ndarray, torch.Tensor],
+        device: Union[str, torch.device],
+    ) -> torch.Tensor:
+        """Copies an array or cpu tensor to `device` through a buffer
+        from the pool, without waiting for the copy to complete."""
+        if isinstance(value, np.ndarray):
+            # copied by numpy, as arrays can be read-only views of the
+            # memory of a backend, which torch warns about
+            buffer = self.acquire(value.nbytes)
+            host_array = buffer[: value.nbytes].numpy().view(value.dtype)
+            host_array = host_array.reshape(value.shape)
+            np.copyto(host_array, value)
+            host = torch.from_numpy(host_array)
+        else:
+            nbytes = value.element_size() * value.nelement()
+            buffer = self.acquire(nbytes)
+            host = buffer[:nbytes].view(value.dtype).view(value.shape)
+            host.copy_(value)
+
+        device = torch.device(device)
+        tensor = host.to(device, non_blocking=self.pin)
+
+        event = None
+        if device.type == "cuda":
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(device))
+        elif tensor.data_ptr() == host.data_ptr():
+            # no copy took place; the buffer belongs to the tensor now
+            return tensor
+        self.release(buffer, event)
+        return tensor
+
+
 class KeyCastingMixIn(MoveAndGradMixIn):
     @overload
     @classmethod
@@ -109,6 +205,42 @@ class KeyCastingMixIn(MoveAndGradMixIn):
         ]
         return casted_key
 
+    @classmethod
+    def _hash_key(
+        cls,
+        key_to_cast: BaseKeyType,
+        cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        context: bytes = b"",
+        digest_size: int = 16,
+    ) -> Sequence[bytes]:
+        """Like `_cast_key`, but turns each key into a fixed-size digest.
+        Besides the key content, the digest covers dtype and shape of
+        tensor keys and an arbitrary `context` (e.g. model and layer)."""
+        if isinstance(key_to_cast, torch.Tensor):
+            key_to_cast = [key_to_cast]
+
+        hashed_key = []
+        for key, raw in zip(
+            key_to_cast, cls._cast_key(key_to_cast, cast_type_map)
+        ):
+            if isinstance(key, bytes):
+                header = b""
+            else:
+                dtype = (
+                    cast_type_map.get(key.dtype, key.dtype)
+                    if cast_type_map
+                    else key.dtype
+                )
+                header = f"{dtype}{tuple(key.shape)}".encode("utf-8")
+
+            digest = hashlib.blake2b(digest_size=digest_size)
+            for part in (context, header, raw):
+                # length prefix keeps parts from bleeding into each other
+                digest.update(len(part).to_bytes(8, "little"))
+                digest.update(part)
+            hashed_key.append(digest.digest())
+        return hashed_key
+
 
 BaseValueType = Union[torch.Tensor, np.ndarray]
 AllValueContainersToCast = Union[
@@ -138,6 +270,7 @@ class ValueCastingMixIn(MoveAndGradMixIn):
         device: Union[str, torch.device],
         requires_grad: bool = False,
         cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        buffer_pool: Optional[HostBufferPool] = None,
     ) -> torch.Tensor:
         ...
 
@@ -149,6 +282,7 @@ class ValueCastingMixIn(MoveAndGradMixIn):
         device: Union[str, torch.device],
         requires_grad: bool = False,
         cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        buffer_pool: Optional[HostBufferPool] = None,
     ) -> Mapping[str, torch.Tensor]:
         ...
 
@@ -160,6 +294,7 @@ class ValueCastingMixIn(MoveAndGradMixIn):
         device: Union[str, torch.device],
         requires_grad: bool = False,
         cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        buffer_pool: Optional[HostBufferPool] = None,
     ) -> Sequence[torch.Tensor]:
         ...
 
@@ -171,6 +306,7 @@ class ValueCastingMixIn(MoveAndGradMixIn):
         device: Union[str, torch.device],
         requires_grad: bool = False,
         cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        buffer_pool: Optional[HostBufferPool] = None,
     ) -> Sequence[Sequence[torch.Tensor]]:
         ...
 
@@ -182,6 +318,7 @@ class ValueCastingMixIn(MoveAndGradMixIn):
         device: Union[str, torch.device],
         requires_grad: bool = False,
         cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        buffer_pool: Optional[HostBufferPool] = None,
     ) -> Sequence[Mapping[str, torch.Tensor]]:
         ...
 
@@ -192,8 +329,11 @@ class ValueCastingMixIn(MoveAndGradMixIn):
         device: Union[str, torch.device],
         requires_grad: bool = False,
         cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        buffer_pool: Optional[HostBufferPool] = None,
     ) -> AllValueContainersCasted:
-        """Move tensor(s) to cpu, and remove gradients"""
+        """Move tensor(s) to cpu, and remove gradients. If a
+        `buffer_pool` is provided, values are copied to a non-cpu device
+        through it without blocking."""
 
         casted_value: AllValueContainersCasted
 
@@ -204,6 +344,7 @@ class ValueCastingMixIn(MoveAndGradMixIn):
                     requires_grad=requires_grad,
                     device=device,
                     cast_type_map=cast_type_map,
+                    buffer_pool=buffer_pool,
                 )
                 for key, element in value.items()
             }
@@ -214,10 +355,26 @@ class ValueCastingMixIn(MoveAndGradMixIn):
                     requires_grad=requires_grad,
                     device=device,
                     cast_type_map=cast_type_map,
+                    buffer_pool=buffer_pool,
                 )
                 for element in value
             ]
             casted_value = casted_valued
+        elif buffer_pool is not None and cls._uses_pool(value):
+            # transfer first, then cast on the device: if values are
+            # stored in half precision, this moves half the bytes.
+            casted_value = buffer_pool.to_device(value, device)
+            casted_type = (
+                cast_type_map.get(casted_value.dtype, None)
+                if cast_type_map is not None
+                else None
+            )
+            casted_value = cls._move_and_grad(
+                casted_value,
+                grad=requires_grad,
+                device=device,
+                dtype=casted_type,
+            )
         elif isinstance(value, torch.Tensor):
             casted_type = (
                 cast_type_map.get(value.dtype, None)
@@ -228,30 +385,335 @@ class ValueCastingMixIn(MoveAndGradMixIn):
                 value, grad=requires_grad, device=device, dtype=casted_type
             )
         elif isinstance(value, np.ndarray):
-            casted_value = torch.from_numpy(value)
-            if (
-                cast_type_map is not None
-                and (dtype := cast_type_map.get(casted_value.dtype, None))
-                is not None
-            ):
-                casted_value = casted_value.type(dtype)
+            # no copy here: backends such as `flat` return views of
+            # memory-mapped files, which we want to move only once.
+            with warnings.catch_warnings():
+                # read-only arrays are views of the memory of a backend
+                # (see `BaseKVStorage.batch_read_views`), which are only
+                # read, as they are copied to the device or decoded.
+                warnings.simplefilter("ignore")
+                casted_value = torch.from_numpy(value)
+            casted_type = (
+                cast_type_map.get(casted_value.dtype, None)
+                if cast_type_map is not None
+                else None
+            )
+            casted_value = cls._move_and_grad(
+                casted_value,
+                grad=requires_grad,
+                device=device,
+                dtype=casted_type,
+            )
 
         else:
             raise ValueError(f"Cannot cast value of type {type(value)}")
 
         return casted_value
 
+    @staticmethod
+    def _uses_pool(value: Any) -> bool:
+        """Whether a value can be copied through a buffer pool: host
+        arrays or tensors. On the cpu, the copy in the (pinned) buffer
+        is the fetched value."""
+        if isinstance(value, torch.Tensor):
+            return value.device.type == "cpu"
+        return isinstance(value, np.ndarray)
+
 
 ValueStorageWrapperType = Union[
     torch.Tensor, Sequence[torch.Tensor], Mapping[str, torch.Tensor]
 ]
 
 
-class StorageWrapper(KeyCastingMixIn, ValueCastingMixIn):
+class RaggedMixIn:
+    """Drops padding from values before they are stored, and restores it
+    after they are fetched.
+
+    Padding is described by a boolean mask (e.g. an attention mask) of
+    shape [batch, seq_len]; every tensor of a value (the value itself, or
+    one of the tensors of a list or dict value) whose leading dimensions
+    match the mask is stored as a packed [num_tokens, ...] tensor
+    containing only the unpadded positions. If some tensors of a value do
+    not match the mask and are stored as they are, the value is stored as
+    a dict with a `PACKED_PREFIX` entry telling which tensors were packed.
+    On fetch, only packed tensors are scattered back into a zero-filled
+    [batch, seq_len, ...] tensor."""
+
+    PACKED_PREFIX = "__packed__:"
+
+    @staticmethod
+    def _padding_mask(key: torch.Tensor, pad_token_id: int) -> torch.Tensor:
+        """Derives the padding mask from a tensor of token ids."""
+        return key != pad_token_id
+
+    @staticmethod
+    def _slots(value: AllValueContainersCasted) -> Tuple[str, Dict[str, Any]]:
+        """Splits a value into the type of its container and its
+        elements, by name."""
+        if isinstance(value, abc.Mapping):
+            return "dict", dict(value)
+        elif isinstance(value, abc.Sequence):
+            return "list", {str(i): v for i, v in enumerate(value)}
+        return "tensor", {"": value}
+
+    @staticmethod
+    def _from_slots(
+        container: str, slots: Mapping[str, Any]
+    ) -> AllValueContainersCasted:
+        """Inverse of `_slots`."""
+        if container == "dict":
+            return dict(slots)
+        elif container == "list":
+            return [slots[str(i)] for i in range(len(slots))]
+        return slots[""]
+
+    @classmethod
+    def _mark_packed(
+        cls, container: str, slots: Mapping[str, Any], packed: Sequence[str]
+    ) -> AllValueContainersCasted:
+        """The value to store for elements `slots` of a value, of which
+        those in `packed` lost their padding."""
+        if len(packed) == len(slots):
+            return cls._from_slots(container, slots)
+        flags = np.array([s in packed for s in sorted(slots)], dtype=np.uint8)
+        return {f"{cls.PACKED_PREFIX}{container}": flags, **slots}
+
+    @classmethod
+    def _packed_slots(
+        cls, value: AllValueContainersCasted
+    ) -> Tuple[str, Dict[str, Any], List[str]]:
+        """Inverse of `_mark_packed`: the type of container of a stored
+        value, its elements, and the names of those that lost their
+        padding."""
+        if isinstance(value, abc.Mapping):
+            marker = next(
+                (k for k in value if k.startswith(cls.PACKED_PREFIX)), None
+            )
+            if marker is not None:
+                slots = {k: v for k, v in value.items() if k != marker}
+                flags = value[marker].tolist()
+                packed = [s for s, f in zip(sorted(slots), flags) if f]
+                return marker[len(cls.PACKED_PREFIX) :], slots, packed
+        container, slots = cls._slots(value)
+        return container, slots, list(slots)
+
+    @staticmethod
+    def _is_padded(value: Any, mask: torch.Tensor) -> bool:
+        return (
+            isinstance(value, torch.Tensor)
+            and value.shape[: mask.dim()] == mask.shape
+        )
+
+    @staticmethod
+    def _pad_tensor(value: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        mask = mask.to(value.device)
+        padded = value.new_zeros(mask.shape + value.shape[1:])
+        padded[mask] = value
+        return padded
+
+    @classmethod
+    def _unpad_value(
+        cls, value: AllValueContainersCasted, mask: torch.Tensor
+    ) -> AllValueContainersCasted:
+        container, slots = cls._slots(value)
+        packed = [s for s, v in slots.items() if cls._is_padded(v, mask)]
+        for s in packed:
+            slots[s] = slots[s][mask.to(slots[s].device)]
+        return cls._mark_packed(container, slots, packed)
+
+    @classmethod
+    def _pad_value(
+        cls, value: AllValueContainersCasted, mask: torch.Tensor
+    ) -> AllValueContainersCasted:
+        container, slots, packed = cls._packed_slots(value)
+        for s in packed:
+            if isinstance(slots[s], torch.Tensor):
+                slots[s] = cls._pad_tensor(slots[s], mask)
+        return cls._from_slots(container, slots)
+
+    @staticmethod
+    def _example_keys(
+        key: torch.Tensor, mask: torch.Tensor
+    ) -> Sequence[torch.Tensor]:
+        """Splits a batch of token ids into one unpadded key per row."""
+        if key.dim() < 2:
+            raise ValueError(
+                "Per-example keys require a batch of keys; "
+                f"got a key with shape {tuple(key.shape)}"
+            )
+        return [k[m] for k, m in zip(key, mask.to(key.device))]
+
+    @classmethod
+    def _split_value(
+        cls, value: AllValueContainersCasted, mask: torch.Tensor
+    ) -> Sequence[AllValueContainersCasted]:
+        """Splits a batched value into one value per row of `mask`.
+        Tensors whose leading dimensions match the mask lose their
+        padding; all other tensors must have a leading batch dimension."""
+        batch_size = mask.shape[0]
+        container, slots = cls._slots(value)
+
+        packed: List[str] = []
+        split: Dict[str, Sequence[torch.Tensor]] = {}
+        for s, v in slots.items():
+            if cls._is_padded(v, mask):
+                m = mask.to(v.device)
+                split[s] = v[m].split(m.sum(-1).tolist())
+                packed.append(s)
+            elif (
+                isinstance(v, torch.Tensor)
+                and v.dim() > 0
+                and v.shape[0] == batch_size
+            ):
+                split[s] = v.unbind(0)
+            else:
+                raise ValueError(
+                    f"Cannot split value of type {type(v)} into "
+                    f"{batch_size} examples"
+                )
+
+        return [
+            cls._mark_packed(
+                container, {s: v[i] for s, v in split.items()}, packed
+            )
+            for i in range(batch_size)
+        ]
+
+    @classmethod
+    def _merge_value(
+        cls,
+        rows: Sequence[AllValueContainersCasted],
+        mask: torch.Tensor,
+    ) -> AllValueContainersCasted:
+        """Inverse of `_split_value`: collates one value per row of `mask`
+        into a batch, re-padding tensors that were stored without
+        padding."""
+        container, slots, packed = cls._packed_slots(rows[0])
+        split = [slots] + [cls._packed_slots(r)[1] for r in rows[1:]]
+
+        for s in slots:
+            tensors = [r[s] for r in split]
+            if s in packed:
+                slots[s] = cls._pad_tensor(torch.cat(tensors), mask)
+            else:
+                slots[s] = torch.stack(tensors)
+        return cls._from_slots(container, slots)
+
+
+class MemoryCache:
+    """An LRU cache of values read from backends, holding at most
+    `max_bytes` bytes of arrays; counts hits, misses and evictions.
+
+    Values are kept on the cpu as they are fetched: decoded, cast back to
+    the dtype they were recorded with, and in memory of their own rather
+    than of the backend; their size is counted as such. A cache can be
+    shared by several wrappers, even if they read from different stores,
+    and by threads.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Any, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Returns the value for a key, or None if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Any, value: Any, nbytes: int) -> None:
+        """Caches a value, evicting the least recently used ones if
+        needed; values larger than the cache are not cached."""
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+                self.evictions += 1
+
+    def _discard(self, key: Any) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def discard(self, key: Any) -> None:
+        """Removes a key from the cache, if it is there."""
+        with self._lock:
+            self._discard(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+        }
+
+
+class StorageWrapper(KeyCastingMixIn, ValueCastingMixIn, RaggedMixIn):
     """A wrapper for a storage backend.
 
     Takes care of moving tensors to cpu and removing gradients, including
-    in the case of dictionaries and sequences of tensors.
+    in the case of dictionaries and sequences of tensors. If `ragged` is
+    True, padding (positions of a key equal to `pad_token_id`, unless a
+    mask is provided) is dropped before storing values.
+
+    If `per_example_keys` is True, batched keys are split into one key per
+    example (its unpadded token ids), and each example's value is stored
+    under its own key; batches are reassembled on fetch. This makes the
+    cache independent of batch size, padding and order.
+
+    If `hash_keys` is True, keys are stored as 16-byte digests of their
+    content and `key_context` rather than raw token ids. With `hash_check`,
+    the token ids are also stored next to each value, and fetching raises
+    a KeyError if they do not match the ones requested.
+
+    If a `namespace` is given, all keys are prefixed with (or, when
+    hashing, hashed together with) a short digest of it, so that caches
+    for different models or settings can share one store.
+
+    If `write_batch_size` or `write_batch_bytes` is greater than zero,
+    stored values are held back until that many keys or bytes are pending,
+    and then written to the backend in a single batch; `flush` writes
+    whatever is pending.
+
+    If `pin_memory` is True, fetched values are copied to the device
+    through a pool of reusable pinned host buffers, and the copy does not
+    block until the values are used. On the cpu, fetched values are
+    copies in pinned memory, ready to be moved to a GPU later.
+
+    `memory_cache` puts an in-memory LRU tier in front of the backend:
+    either a size in bytes, or a MemoryCache to share with other wrappers.
+
+    If a `codec` is given (a name from `s2re.codecs.CODECS`, or a codec),
+    floating point values are encoded with it before they are stored,
+    e.g. quantized to int8; fetched values are decoded on the device.
+    Learned codecs are fitted to the first values stored, which are held
+    back until the codec has seen enough of them (or until `flush`).
+
+    Values can have named `column`s: auxiliary tensors (e.g. relative
+    positions, or attention masks) stored and fetched separately, under
+    the key of the value they belong to, so that reading one column does
+    not read the value or any other column. Columns are padded, split
+    and cast like values, but never encoded with the codec.
 
     It should not be instantiated directly; instead, it is used by a
     CachingSession object.
@@ -267,6 +729,18 @@ class StorageWrapper(KeyCastingMixIn, ValueCastingMixIn):
         device: Union[str, torch.device],
         backend_kwargs: Optional[Dict[str, Any]] = None,
         cast_types_map: Optional[Dict[torch.dtype, torch.dtype]] = None,
+        ragged: bool = False,
+        pad_token_id: int = 0,
+        per_example_keys: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: str = "",
+        namespace: str = "",
+        write_batch_size: int = 0,
+        write_batch_bytes: int = 0,
+        pin_memory: bool = False,
+        memory_cache: Union[int, MemoryCache, None] = None,
+        codec: Union[str, BaseCodec, None] = None,
     ):
         self.device = device
         self.backend = backend
@@ -274,17 +748,300 @@ class StorageWrapper(KeyCastingMixIn, ValueCastingMixIn):
         self.path = path
         self.storage = self._get_storage()
         self.cast_types_map = cast_types_map
+        self.ragged = ragged
+        self.pad_token_id = pad_token_id
+        self.per_example_keys = per_example_keys
+        self.hash_keys = hash_keys or hash_check
+        self.hash_check = hash_check
+        self.key_context = key_context
+        self.namespace = namespace
+        self._key_prefix = (
+            self._hash_key([namespace.encode("utf-8")], digest_size=8)[0]
+            if namespace
+            else b""
+        )
+
+        self.write_batch_size = write_batch_size
+        self.write_batch_bytes = write_batch_bytes
+        # values stored but not yet written to the backend; a dict, so
+        # that a key stored twice is only written once.
+        self._pending: Dict[bytes, Any] = {}
+        self._pending_bytes = 0
+
+        self.pin_memory = pin_memory
+        self._buffer_pool = HostBufferPool() if pin_memory else None
+
+        if isinstance(memory_cache, int):
+            memory_cache = MemoryCache(max_bytes=memory_cache)
+        self.memory_cache = memory_cache
+
+        self.codec = get_codec(codec)
+        # values held back until a learned codec is fitted
+        self._held: List[Tuple[Sequence[bytes], Any, Any]] = []
 
     def _get_storage(self) -> BaseKVStorage:
         return BackendRegistry.get(self.backend)(
             path=self.path, **self.backend_kwargs
         )
 
+    def _get_masks(
+        self,
+        key: Union[torch.Tensor, Sequence[torch.Tensor], Sequence[bytes]],
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+    ) -> Sequence[Optional[torch.Tensor]]:
+        """Returns one padding mask per key; masks are None if values
+        for that key should be stored as they are."""
+        seq_key = [key] if isinstance(key, torch.Tensor) else key
+        if mask is None:
+            seq_mask = [None for _ in seq_key]
+        elif isinstance(mask, torch.Tensor):
+            seq_mask = [mask]
+        else:
+            seq_mask = mask
+
+        if not (self.ragged or self.per_example_keys):
+            return seq_mask
+
+        return [
+            self._padding_mask(k, self.pad_token_id)
+            if m is None and isinstance(k, torch.Tensor)
+            else m
+            for k, m in zip(seq_key, seq_mask)
+        ]
+
+    def _splits_examples(self, key: Any) -> bool:
+        return self.per_example_keys and isinstance(key, torch.Tensor)
+
+    def _get_keys(
+        self,
+        key: Union[torch.Tensor, Sequence[torch.Tensor], Sequence[bytes]],
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+        hashed: Optional[bool] = None,
+    ) -> Sequence[bytes]:
+        """Returns the keys values are stored under in the backend; if
+        `hashed` is False, raw keys are returned even if hashing is on."""
+        if self._splits_examples(key):
+            (mask,) = self._get_masks(key, mask)
+            key = self._example_keys(key, mask)
+
+        if self.hash_keys if hashed is None else hashed:
+            return self._hash_key(
+                key,
+                cast_type_map=self.cast_types_map,
+                context=self._key_prefix + self.key_context.encode("utf-8"),
+            )
+        return [
+            self._key_prefix + k
+            for k in self._cast_key(key, cast_type_map=self.cast_types_map)
+        ]
+
+    @staticmethod
+    def _check_key(key: bytes) -> bytes:
+        """Key under which the raw key is stored when checking for hash
+        collisions; digests have fixed size, so this can't collide."""
+        return key + b"/key"
+
+    @staticmethod
+    def _column_key(key: bytes, column: str) -> bytes:
+        """Key under which a column of the value stored under `key` is
+        stored; token ids would have to spell out the suffix (and digests
+        be longer than they are) for this to collide with another key."""
+        return key + b"/column/" + column.encode("utf-8")
+
+    def _write(
+        self,
+        seq_key: Sequence[bytes],
+        seq_val: Sequence[Any],
+        raw_key: Optional[Sequence[bytes]] = None,
+    ) -> None:
+        """Writes values to the backend, together with the raw keys if
+        checking for hash collisions."""
+        if self.memory_cache is not None:
+            for k in seq_key:
+                self.memory_cache.discard(self._memory_cache_key(k))
+
+        if self.hash_check and raw_key is not None:
+            seq_key = [*seq_key, *(self._check_key(k) for k in seq_key)]
+            seq_val = [
+                *seq_val,
+                *(np.frombuffer(k, dtype=np.uint8) for k in raw_key),
+            ]
+
+        if self.write_batch_size <= 0 and self.write_batch_bytes <= 0:
+            self.storage.batch_write(keys=seq_key, values=seq_val)
+            return
+
+        for k, v in zip(seq_key, seq_val):
+            self._pending[k] = v
+            self._pending_bytes += self._nbytes(v)
+
+        if (
+            0 < self.write_batch_size <= len(self._pending)
+            or 0 < self.write_batch_bytes <= self._pending_bytes
+        ):
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        """Writes all pending values to the backend in one batch."""
+        if self._held:
+            # not enough values to fill the sample; fit to what we have
+            self._fit_codec()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._pending_bytes = 0
+        self.storage.batch_write(
+            keys=list(pending.keys()), values=list(pending.values())
+        )
+
+    @classmethod
+    def _nbytes(cls, value: Any) -> int:
+        """Size of the arrays in a value, ignoring containers."""
+        if isinstance(value, torch.Tensor):
+            return value.element_size() * value.nelement()
+        elif isinstance(value, np.ndarray):
+            return value.nbytes
+        elif isinstance(value, abc.Mapping):
+            return sum(cls._nbytes(v) for v in value.values())
+        elif isinstance(value, (list, tuple)):
+            return sum(cls._nbytes(v) for v in value)
+        return 0
+
+    def _read(
+        self,
+        key: Union[torch.Tensor, Sequence[torch.Tensor], Sequence[bytes]],
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+        column: Optional[str] = None,
+        views: bool = False,
+    ) -> Tuple[Sequence[bytes], Sequence[Any]]:
+        """Reads values (or one of their columns) for `key` from the
+        backend; returns the keys they are stored under, and the values
+        as returned by the backend. With `views`, they may be read-only
+        views of the memory of the backend (see `batch_read_views`).
+        With a memory cache, values are returned as prepared for it by
+        `_to_host` instead."""
+        self._write_pending()
+        seq_key = self._get_keys(key, mask)
+        if column is not None:
+            seq_key = [self._column_key(k, column) for k in seq_key]
+        raw_keys = (
+            self._get_keys(key, mask, hashed=False)
+            if self.hash_check
+            else None
+        )
+        if self.memory_cache is None:
+            return seq_key, self._read_backend(seq_key, raw_keys, views)
+
+        cache_keys = [self._memory_cache_key(k) for k in seq_key]
+        values = [self.memory_cache.get(k) for k in cache_keys]
+        missing = [i for i, v in enumerate(values) if v is None]
+        if missing:
+            fetched = self._read_backend(
+                [seq_key[i] for i in missing],
+                [raw_keys[i] for i in missing] if raw_keys else None,
+            )
+            for i, value in zip(missing, fetched):
+                values[i] = value = self._to_host(value)
+                self.memory_cache.put(
+                    cache_keys[i], value, nbytes=self._nbytes(value)
+                )
+        return seq_key, values
+
+    def _memory_cache_key(self, key: bytes) -> Tuple[str, str, str, bytes]:
+        # memory caches can be shared, so keys include the store, and
+        # how values from it are cast
+        cast_types = sorted(
+            f"{k}->{v}" for k, v in (self.cast_types_map or {}).items()
+        )
+        return (self.backend, str(self.path), ",".join(cast_types), key)
+
+    def _to_host(self, value: Any) -> AllValueContainersCasted:
+        """Prepares a value returned by the backend for the memory cache:
+        decoded and cast on the cpu, with tensors that still point to the
+        memory of the backend (e.g. of a memory-mapped file) copied."""
+        value = self._cast_value(value=value, device="cpu")
+        backend_memory = self._data_ptrs(value)
+        if is_encoded(value):
+            if self.codec is None or isinstance(self.codec, LearnedCodec):
+                self._load_codec_states(value)
+            value = decode(value, self.codec)
+        value = self._cast_value(
+            value=value, device="cpu", cast_type_map=self.cast_types_map
+        )
+        return self._copy_shared(value, backend_memory)
+
+    @classmethod
+    def _data_ptrs(cls, value: Any) -> Set[int]:
+        """Addresses of the tensors in a value."""
+        if isinstance(value, torch.Tensor):
+            return {value.data_ptr()}
+        elif isinstance(value, abc.Mapping):
+            value = list(value.values())
+        return set().union(*(cls._data_ptrs(v) for v in value))
+
+    @classmethod
+    def _copy_shared(cls, value: Any, shared: Set[int]) -> Any:
+        """Copies the tensors in a value whose address is in `shared`."""
+        if isinstance(value, torch.Tensor):
+            return value.clone() if value.data_ptr() in shared else value
+        elif isinstance(value, abc.Mapping):
+            return {k: cls._copy_shared(v, shared) for k, v in value.items()}
+        return [cls._copy_shared(v, shared) for v in value]
+
+    def _read_backend(
+        self,
+        seq_key: Sequence[bytes],
+        raw_keys: Optional[Sequence[bytes]] = None,
+        views: bool = False,
+    ) -> Sequence[Any]:
+        """Reads values from the backend, checking that the raw keys
+        stored next to them match `raw_keys`, if provided."""
+        batch_read = (
+            self.storage.batch_read_views if views else self.storage.batch_read
+        )
+        if raw_keys is None:
+            return batch_read(keys=seq_key)
+
+        fetched = batch_read(
+            keys=[*seq_key, *(self._check_key(k) for k in seq_key)]
+        )
+        values, stored_keys = fetched[: len(seq_key)], fetched[len(seq_key) :]
+        for raw_key, stored_key in zip(raw_keys, stored_keys):
+            if isinstance(stored_key, torch.Tensor):
+                stored_key = stored_key.numpy()
+            if np.asarray(stored_key).tobytes() != raw_key:
+                raise KeyError(f"Hash collision for key {raw_key!r}")
+        return values
+
+    def _assemble(
+        self,
+        key: Union[torch.Tensor, Sequence[torch.Tensor], Sequence[bytes]],
+        seq_val: Sequence[AllValueContainersCasted],
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+    ) -> AllValueContainersCasted:
+        """Turns values fetched from the backend into the value
+        for `key`, restoring batches and padding."""
+        seq_mask = self._get_masks(key, mask)
+
+        if self._splits_examples(key):
+            return self._merge_value(seq_val, seq_mask[0])
+
+        seq_val = [
+            self._pad_value(v, m) if m is not None else v
+            for v, m in zip(seq_val, seq_mask)
+        ]
+        if isinstance(key, torch.Tensor):
+            return seq_val[0]
+        else:
+            return seq_val
+
     @overload
     def store(
         self,
         key: torch.Tensor,
         value: ValueStorageWrapperType,
+        mask: Optional[torch.Tensor] = None,
+        column: Optional[str] = None,
     ) -> None:
         ...
 
@@ -293,6 +1050,8 @@ class StorageWrapper(KeyCastingMixIn, ValueCastingMixIn):
         self,
         key: Sequence[torch.Tensor],
         value: Sequence[ValueStorageWrapperType],
+        mask: Optional[Sequence[torch.Tensor]] = None,
+        column: Optional[str] = None,
     ) -> None:
         ...
 
@@ -302,70 +1061,405 @@ class StorageWrapper(KeyCastingMixIn, ValueCastingMixIn):
         value: Union[
             ValueStorageWrapperType, Sequence[ValueStorageWrapperType]
         ],
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+        column: Optional[str] = None,
     ) -> None:
-        """Stores a value or list of values in the storage backend."""
+        """Stores a value or list of values in the storage backend, or,
+        if `column` is given, that column of them.
+        If a padding `mask` is provided (or derived from the key in ragged
+        mode), padded positions are not stored."""
 
-        seq_key = self._cast_key(key, cast_type_map=self.cast_types_map)
+        seq_key = self._get_keys(key, mask)
+        if column is not None:
+            seq_key = [self._column_key(k, column) for k in seq_key]
+        seq_mask = self._get_masks(key, mask)
 
         # always wrapping single tensors otherwise they don't match with
         # casted_key
-        if isinstance(key, torch.Tensor):
+        if self._splits_examples(key):
+            seq_val = self._split_value(value, seq_mask[0])  # type: ignore
+        elif isinstance(key, torch.Tensor):
             seq_val: Sequence[ValueStorageWrapperType] = [value]  # type: ignore
         else:
             seq_val: Sequence[ValueStorageWrapperType] = value  # type: ignore
 
-        casted_seq_val = self._cast_value(
-            value=seq_val, device="cpu", cast_type_map=self.cast_types_map
+        if not self._splits_examples(key):
+            seq_val = [
+                self._unpad_value(v, m) if m is not None else v
+                for v, m in zip(seq_val, seq_mask)
+            ]
+
+        raw_key = None
+        if self.hash_check:
+            raw_key = self._get_keys(key, mask, hashed=False)
+
+        if self.codec is None or column is not None:
+            casted_seq_val = self._cast_value(
+                value=seq_val, device="cpu", cast_type_map=self.cast_types_map
+            )
+        elif self._codec_needs_sample():
+            casted_seq_val = self._cast_value(
+                value=seq_val, device="cpu", cast_type_map=self.cast_types_map
+            )
+            self._held.append((seq_key, casted_seq_val, raw_key))
+            if all([self.codec.observe(v) for v in casted_seq_val]):
+                self._fit_codec()
+            return
+        else:
+            # values are encoded on the device (unless the codec works on
+            # the cpu), so that less has to be copied to cpu; the cast
+            # map is applied before encoding, since it could change the
+            # dtype of encoded arrays.
+            seq_val = self._cast_value(
+                value=seq_val,
+                device="cpu" if self.codec.on_host else self.device,
+                cast_type_map=self.cast_types_map,
+            )
+            casted_seq_val = self._cast_value(
+                value=self.codec.encode_batch(seq_val), device="cpu"
+            )
+        self._write(seq_key, casted_seq_val, raw_key=raw_key)
+
+    def _codec_needs_sample(self) -> bool:
+        return isinstance(self.codec, LearnedCodec) and not self.codec.fitted
+
+    @staticmethod
+    def _codec_state_key(name: str, state_id: str) -> bytes:
+        """Key the state of a learned codec is stored under; value keys
+        are either hashes or token ids, so this can't collide."""
+        return f"{CODEC_PREFIX}{name}@{state_id}".encode("utf-8")
+
+    def _fit_codec(self) -> None:
+        """Fits a learned codec to the values observed so far, stores its
+        state, and writes the values that were held back."""
+        state_id, state = self.codec.fit_sample()
+        self.storage.batch_write(
+            keys=[self._codec_state_key(self.codec.name, state_id)],
+            values=[state],
         )
+        held, self._held = self._held, []
+        for seq_key, seq_val, raw_key in held:
+            self._write(seq_key, self.codec.encode_batch(seq_val), raw_key)
+
+    def _load_codec_states(self, value: Any) -> None:
+        """Reads the states of a learned codec needed to decode a value
+        from the backend, if they are not loaded yet."""
+        states = encoded_states(value)
+        if not states:
+            return
+        if self.codec is None:
+            # recorded with a learned codec, which we weren't given
+            self.codec = get_codec(next(iter(states))[0])
+        missing = [
+            state_id
+            for name, state_id in states
+            if name == self.codec.name and state_id not in self.codec.states
+        ]
+        if not missing:
+            return
+        keys = [self._codec_state_key(self.codec.name, i) for i in missing]
+        for state_id, state in zip(missing, self._read_codec_states(keys)):
+            self.codec.load_state(state_id, state)
 
-        self.storage.batch_write(keys=seq_key, values=casted_seq_val)
+    def _read_codec_states(self, keys: Sequence[bytes]) -> Sequence[Any]:
+        return self.storage.batch_read(keys=keys)
 
     def fetch(
         self: "StorageWrapper",
         key: Union[torch.Tensor, Sequence[torch.Tensor], Sequence[bytes]],
         training: bool = False,
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+        column: Optional[str] = None,
     ) -> AllValueContainersCasted:
-        """Fetches values for one or more keys from the storage backend."""
-
-        fetched_val = self.storage.batch_read(
-            keys=self._cast_key(key, cast_type_map=self.cast_types_map)
+        """Fetches values (or the `column` of them) for one or more keys
+        from the storage backend. Values stored without padding are
+        re-padded according to `mask` (or the mask derived from the key
+        in ragged mode)."""
+
+        # values copied to the device through pinned buffers don't need
+        # to outlive this call, so they can be views of the backend
+        views = (
+            self._buffer_pool is not None
+            and torch.device(self.device).type != "cpu"
+            and self.memory_cache is None
         )
+        _, fetched_val = self._read(key, mask, column=column, views=views)
 
         seq_val = [
-            self._cast_value(
+            self._cast_fetched(value, requires_grad=training)
+            for value in fetched_val
+        ]
+        return self._assemble(key, seq_val, mask)
+
+    def _cast_fetched(
+        self, value: Any, requires_grad: bool = False
+    ) -> AllValueContainersCasted:
+        """Moves a value returned by the backend to the device, decoding
+        it if it was stored with a codec."""
+        if self.memory_cache is not None:
+            # decoded and cast by `_to_host` already; the value is shared
+            # with the cache, so it is copied if moving it would not.
+            if (
+                self._buffer_pool is None
+                and torch.device(self.device).type == "cpu"
+            ):
+                value = self._copy_shared(value, self._data_ptrs(value))
+            return self._cast_value(
+                value=value,
+                device=self.device,
+                requires_grad=requires_grad,
+                buffer_pool=self._buffer_pool,
+            )
+
+        if not is_encoded(value):
+            return self._cast_value(
                 value=value,
                 device=self.device,
-                requires_grad=training,
+                requires_grad=requires_grad,
                 cast_type_map=self.cast_types_map,
+                buffer_pool=self._buffer_pool,
             )
-            for value in fetched_val
-        ]
 
-        if isinstance(key, torch.Tensor):
-            return seq_val[0]
-        else:
-            return seq_val
+        if self.codec is None or isinstance(self.codec, LearnedCodec):
+            self._load_codec_states(value)
+
+        # encoded values are moved as they are, decoded on the device
+        # (or on the cpu, before moving them, for codecs that work on the
+        # cpu), and only then cast back to the dtype they were recorded
+        # with.
+        on_host = decodes_on_host(value)
+        value = self._cast_value(
+            value=value,
+            device="cpu" if on_host else self.device,
+            buffer_pool=None if on_host else self._buffer_pool,
+        )
+        return self._cast_value(
+            value=decode(value, self.codec),
+            device=self.device,
+            requires_grad=requires_grad,
+            cast_type_map=self.cast_types_map,
+            buffer_pool=self._buffer_pool if on_host else None,
+        )
 
     def delete(
         self: "StorageWrapper",
         key: Union[torch.Tensor, Sequence[torch.Tensor], Sequence[bytes]],
     ) -> None:
         """Deletes one or a list of keys from the storage backend."""
-        self.storage.batch_delete(
-            keys=self._cast_key(key, cast_type_map=self.cast_types_map)
-        )
+        self.flush()
+        seq_key = self._get_keys(key)
+        if self.memory_cache is not None:
+            for k in seq_key:
+                self.memory_cache.discard(self._memory_cache_key(k))
+        if self.hash_check:
+            seq_key = [*seq_key, *(self._check_key(k) for k in seq_key)]
+        self.storage.batch_delete(keys=seq_key)
+
+    def flush(self) -> None:
+        """Makes sure all stored values have been written to the
+        backend."""
+        self._write_pending()
+
+    def close(self) -> None:
+        """Flushes pending writes and closes the backend, releasing its
+        locks; the wrapper should not be used after it is closed."""
+        self.flush()
+        self._close_storage()
+
+    def _close_storage(self) -> None:
+        if self.storage is not None:
+            self.storage.close()
 
 
 class StopFlag:
     ...
 
 
+class SharedSlot(NamedTuple):
+    """Location of a value written to a SharedMemoryRing."""
+
+    index: int
+    size: int
+
+
+class SharedMemoryRing:
+    """Fixed-size slots in a block of shared memory, used to pass
+    values between processes without pickling them.
+
+    Values are written to a slot with BinarySerialization, and only their
+    SharedSlot goes through queues or manager dicts. Free slots are kept
+    in a queue, so writers wait when all slots are taken until a reader
+    releases one.
+    """
+
+    def __init__(
+        self,
+        num_slots: int,
+        slot_size: int,
+        new_queue_factory: Callable = Queue,
+    ):
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(num_slots * slot_size, 1)
+        )
+        self._free: Queue = new_queue_factory()
+        for i in range(num_slots):
+            self._free.put(i)
+
+    def _slot(self, index: int) -> memoryview:
+        start = index * self.slot_size
+        return self._shm.buf[start : start + self.slot_size]
+
+    def write(self, value: Any, timeout: Optional[float] = None) -> Any:
+        """Writes a value to a free slot and returns its SharedSlot;
+        values too large for a slot are returned unchanged."""
+        index = self._free.get(block=True, timeout=timeout)
+        try:
+            size = BinarySerialization.serialize_into(value, self._slot(index))
+        except ValueError:
+            self._free.put(index)
+            return value
+        return SharedSlot(index=index, size=size)
+
+    def read(self, slot: SharedSlot, copy: bool = False) -> Any:
+        """Reads a value from a slot. Unless `copy` is True, arrays in it
+        are views of the slot, and must not be used after `release`."""
+        value = BinarySerialization.deserialize(
+            self._slot(slot.index)[: slot.size]
+        )
+        return self._copy(value) if copy else value
+
+    @classmethod
+    def _copy(cls, value: Any) -> Any:
+        if isinstance(value, torch.Tensor):
+            return value.clone()
+        elif isinstance(value, np.ndarray):
+            return value.copy()
+        elif isinstance(value, abc.Mapping):
+            return {k: cls._copy(v) for k, v in value.items()}
+        return [cls._copy(v) for v in value]
+
+    def release(self, slot: SharedSlot) -> None:
+        """Marks a slot as free, so that it can be written again."""
+        self._free.put(slot.index)
+
+    def close(self) -> None:
+        """Frees the shared memory; only the creator should call this."""
+        self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            # arrays read from the ring are still around; the memory is
+            # released once they are garbage collected.
+            ...
+
+
+class WriteBehindStorageWrapper(StorageWrapper):
+    """A wrapper for a storage backend that writes in the background.
+
+    Values passed to `store` are put in a queue holding at most
+    `write_behind` elements, and `store` returns right away unless the
+    queue is full. A thread takes values from the queue, moves them to
+    cpu, and writes them to the backend. Errors raised while writing are
+    re-raised by the next call to `store` or `flush`.
+
+    It should not be instantiated directly; instead, it is used by a
+    CachingSession object.
+    """
+
+    def __init__(self, *args: Any, write_behind: int = 1, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+
+        # values waiting to be written; bounded so that a slow backend
+        # applies backpressure instead of filling up (gpu) memory.
+        self._to_write_queue: Queue = Queue(maxsize=max(write_behind, 1))
+        self._write_error: Optional[BaseException] = None
+
+        self._writer_thread = threading.Thread(
+            target=self._run_writer_thread,
+            # like the fetcher thread, this prevents hanging on exit if
+            # the wrapper is never closed.
+            daemon=True,
+        )
+        self._writer_thread.start()
+
+    def _run_writer_thread(self) -> None:
+        while True:
+            elem = self._to_write_queue.get(block=True)
+            try:
+                if isinstance(elem, StopFlag):
+                    break
+                if self._write_error is None:
+                    key, value, mask, column = elem
+                    super().store(
+                        key=key, value=value, mask=mask, column=column
+                    )
+            except BaseException as e:
+                # once writing fails, we drop the remaining values; the
+                # error is raised in the thread that called `store`.
+                self._write_error = e
+            finally:
+                self._to_write_queue.task_done()
+
+    def _raise_write_error(self) -> None:
+        if self._write_error is not None:
+            error, self._write_error = self._write_error, None
+            raise RuntimeError("Failed to write to cache") from error
+
+    @classmethod
+    def _detach(cls, value: Any) -> Any:
+        if isinstance(value, torch.Tensor):
+            return value.detach()
+        elif isinstance(value, abc.Mapping):
+            return {k: cls._detach(v) for k, v in value.items()}
+        elif isinstance(value, (list, tuple)):
+            return type(value)(cls._detach(v) for v in value)
+        return value
+
+    def store(
+        self,
+        key: Union[torch.Tensor, Sequence[torch.Tensor]],
+        value: Union[
+            ValueStorageWrapperType, Sequence[ValueStorageWrapperType]
+        ],
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+        column: Optional[str] = None,
+    ) -> None:
+        """Queues a value or list of values (or a column of them) to be
+        stored; blocks if the queue is full."""
+        self._raise_write_error()
+        if not self._writer_thread.is_alive():
+            raise RuntimeError("Cannot store values after closing.")
+
+        # values should not keep the autograd graph alive while queued
+        self._to_write_queue.put((key, self._detach(value), mask, column))
+
+    def flush(self) -> None:
+        self._to_write_queue.join()
+        self._raise_write_error()
+        self._write_pending()
+
+    def close(self) -> None:
+        if self._writer_thread.is_alive():
+            self._to_write_queue.put(StopFlag())
+            self._writer_thread.join()
+        self._raise_write_error()
+        self._write_pending()
+        self._close_storage()
+
+
 class FetchAheadStorageWrapper(StorageWrapper):
     """A wrapper for a storage backend that prefetches data.
 
     This is a wrapper for StorageWrapper that prefetches data from
     the backend. It is used by CachingSession.
 
+    With `fetch_workers` greater than one, several fetchers read from
+    the backend concurrently; elements are still yielded by `prefetch`
+    in the order of the original iterable. Fetcher threads share one
+    backend handle, while fetcher processes each open their own.
+
     It should not be instantiated directly; instead, it is used by a
     CachingSession object.
     """
@@ -381,8 +1475,20 @@ class FetchAheadStorageWrapper(StorageWrapper):
         timeout: float = 0.1,
         retry_count: int = 10,
         cast_types_map: Optional[Dict[torch.dtype, torch.dtype]] = None,
+        ragged: bool = False,
+        pad_token_id: int = 0,
+        per_example_keys: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: str = "",
+        namespace: str = "",
+        pin_memory: bool = False,
+        memory_cache: Union[int, MemoryCache, None] = None,
+        codec: Union[str, BaseCodec, None] = None,
+        fetch_workers: int = 1,
         new_queue_factory: Optional[Callable] = None,
         new_store_factory: Optional[Callable] = None,
+        new_condition_factory: Optional[Callable] = None,
     ):
 
         super().__init__(
@@ -391,12 +1497,24 @@ class FetchAheadStorageWrapper(StorageWrapper):
             device=device,
             backend_kwargs=backend_kwargs,
             cast_types_map=cast_types_map,
+            ragged=ragged,
+            pad_token_id=pad_token_id,
+            per_example_keys=per_example_keys,
+            hash_keys=hash_keys,
+            hash_check=hash_check,
+            key_context=key_context,
+            namespace=namespace,
+            pin_memory=pin_memory,
+            memory_cache=memory_cache,
+            codec=codec,
         )
 
         if new_queue_factory is None:
             new_queue_factory = Queue
         if new_store_factory is None:
             new_store_factory = dict
+        if new_condition_factory is None:
+            new_condition_factory = threading.Condition
 
         self._fetch_ahead = fetch_ahead
 
@@ -410,11 +1528,31 @@ class FetchAheadStorageWrapper(StorageWrapper):
         # this is the dictionary that will hold the prefetched data
         self._fetched_store: dict = new_store_factory()
 
-        # time to sleep between queue checks
+        # notified whenever a value is added to or removed from the store,
+        # so that neither the consumer nor the fetcher has to poll it.
+        self._fetched_condition: threading.Condition = (
+            new_condition_factory()
+        )
+
+        # index of the next element to hand to the consumer; fetchers
+        # wait for their turn, so elements are yielded in order.
+        self._fetch_workers = max(fetch_workers, 1)
+        self._delivery: dict = new_store_factory()
+        self._delivery["next"] = 0
+
+        # subclasses that fetch in other processes set up a ring of shared
+        # memory slots to pass values through.
+        self._ring: Optional[SharedMemoryRing] = None
+
+        # waits time out after `timeout * retry_count` seconds
         self._fetch_timeout = timeout
         self._fetch_retry_count = retry_count
         self._fetch_key_fn = fetch_key_fn
 
+        # columns are not prefetched; they are read through this reader
+        # when they are fetched, which is opened on first use.
+        self._column_reader: Optional[StorageWrapper] = None
+
         self._start_fetcher_thread()
 
     def _get_storage(self):
@@ -422,11 +1560,59 @@ class FetchAheadStorageWrapper(StorageWrapper):
         # in the fetching thread.
         ...
 
+    def _close_storage(self) -> None:
+        if self._column_reader is not None:
+            self._column_reader.close()
+            self._column_reader = None
+        super()._close_storage()
+
+    def _read_codec_states(self, keys: Sequence[bytes]) -> Sequence[Any]:
+        # states are read once, so a short-lived reader will do
+        reader = self._new_reader()
+        try:
+            return reader.storage.batch_read(keys=keys)
+        finally:
+            reader.close()
+
     def _start_fetcher_thread(
-        self, new_thread_factory: Optional[Callable] = None
+        self,
+        new_thread_factory: Optional[Callable] = None,
+        share_storage: bool = True,
     ):
         new_thread_factory = new_thread_factory or threading.Thread
 
+        # a single fetcher opens the backend in its own thread; several
+        # ones share a handle, as some backends lock their files.
+        storage_wrapper = None
+        if share_storage and self._fetch_workers > 1:
+            storage_wrapper = self._new_reader()
+
+        for _ in range(self._fetch_workers):
+            self._start_one_fetcher(new_thread_factory, storage_wrapper)
+
+    def _new_reader(self) -> StorageWrapper:
+        # values are read as they are returned by the backend; they are
+        # cast, and batches reassembled, when the consumer fetches them.
+        return StorageWrapper(
+            backend=self.backend,
+            path=self.path,
+            backend_kwargs=self.backend_kwargs,
+            device="cpu",
+            cast_types_map=self.cast_types_map,
+            pad_token_id=self.pad_token_id,
+            per_example_keys=self.per_example_keys,
+            hash_keys=self.hash_keys,
+            hash_check=self.hash_check,
+            key_context=self.key_context,
+            namespace=self.namespace,
+            memory_cache=self.memory_cache,
+        )
+
+    def _start_one_fetcher(
+        self,
+        new_thread_factory: Callable,
+        storage_wrapper: Optional[StorageWrapper] = None,
+    ):
         # set up the thread that will prefetch data
         new_thread_factory(
             target=self._run_fetcher_thread,
@@ -435,6 +1621,10 @@ class FetchAheadStorageWrapper(StorageWrapper):
                 to_yield_queue=self._to_yield_queue,
                 fetch_key_fn=self._fetch_key_fn,
                 fetched_store=self._fetched_store,
+                fetched_condition=self._fetched_condition,
+                delivery=self._delivery,
+                storage_wrapper=storage_wrapper,
+                ring=self._ring,
                 timeout=self._fetch_timeout,
                 max_store_size=self._fetch_ahead,
                 max_tries=self._fetch_retry_count,
@@ -442,6 +1632,13 @@ class FetchAheadStorageWrapper(StorageWrapper):
                 opts=self.backend_kwargs,
                 path=self.path,
                 cast_type_map=self.cast_types_map,
+                pad_token_id=self.pad_token_id,
+                per_example_keys=self.per_example_keys,
+                hash_keys=self.hash_keys,
+                hash_check=self.hash_check,
+                key_context=self.key_context,
+                namespace=self.namespace,
+                memory_cache=self.memory_cache,
             ),
             # in case something goes wrong with data loader,
             # `daemon=True` will prevent process hanging
@@ -455,6 +1652,8 @@ class FetchAheadStorageWrapper(StorageWrapper):
         to_yield_queue: Queue[Any],
         fetch_key_fn: Callable[[Any], BaseKeyType],
         fetched_store: Dict[Tuple[bytes], Any],
+        fetched_condition: threading.Condition,
+        delivery: Dict[str, int],
         timeout: float,
         max_tries: int,
         backend: str,
@@ -462,33 +1661,86 @@ class FetchAheadStorageWrapper(StorageWrapper):
         path: Union[str, Path],
         max_store_size: int = 0,
         cast_type_map: Optional[Mapping[torch.dtype, torch.dtype]] = None,
+        pad_token_id: int = 0,
+        per_example_keys: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: str = "",
+        namespace: str = "",
+        storage_wrapper: Optional[StorageWrapper] = None,
+        ring: Optional[SharedMemoryRing] = None,
+        memory_cache: Optional[MemoryCache] = None,
     ) -> None:
 
-        storage_wrapper = StorageWrapper(
-            backend=backend, path=path, backend_kwargs=opts, device="cpu"
-        )
+        if storage_wrapper is None:
+            # values are read as they are returned by the backend; they
+            # are cast, and batches reassembled, when the consumer
+            # fetches them.
+            storage_wrapper = StorageWrapper(
+                backend=backend,
+                path=path,
+                backend_kwargs=opts,
+                device="cpu",
+                cast_types_map=cast_type_map,  # type: ignore
+                pad_token_id=pad_token_id,
+                per_example_keys=per_example_keys,
+                hash_keys=hash_keys,
+                hash_check=hash_check,
+                key_context=key_context,
+                namespace=namespace,
+                memory_cache=memory_cache,
+            )
 
         while True:
-            elem = to_fetch_queue.get(block=True, timeout=timeout * max_tries)
+            index, elem = to_fetch_queue.get(
+                block=True, timeout=timeout * max_tries
+            )
 
             if isinstance(elem, StopFlag):
-                to_yield_queue.put(StopFlag(), block=True)
+                # put the flag back, so that other fetchers stop too
+                to_fetch_queue.put((index, elem), block=True)
+
+                with fetched_condition:
+                    # only one fetcher yields the flag, once all elements
+                    # before it have been yielded.
+                    fetched_condition.wait_for(
+                        lambda: delivery["next"] >= index,
+                        timeout=timeout * max_tries,
+                    )
+                    if delivery["next"] == index:
+                        to_yield_queue.put(StopFlag(), block=True)
+                        delivery["next"] = index + 1
+                        fetched_condition.notify_all()
                 break
 
             key = fetch_key_fn(elem)
-            cast_key = cls._cast_key(key, cast_type_map=cast_type_map)
-            value = storage_wrapper.fetch(cast_key)
-
-            max_tries_cnt = max_tries
-            while max_store_size > 0 and len(fetched_store) >= max_store_size:
-                sleep(timeout)
-                max_tries_cnt -= 1
-
-                if max_tries_cnt <= 0:
+            cast_key, value = storage_wrapper._read(key)
+
+            if ring is not None:
+                # only the location of the value in shared memory goes
+                # through the (pickling) store.
+                value = ring.write(value, timeout=timeout * max_tries)
+
+            with fetched_condition:
+                # wait until all elements before this one have been
+                # yielded, and for the consumer to free a slot in the store
+                is_ready = fetched_condition.wait_for(
+                    lambda: delivery["next"] == index
+                    and (
+                        max_store_size <= 0
+                        or len(fetched_store) < max_store_size
+                    ),
+                    timeout=timeout * max_tries,
+                )
+                if not is_ready:
                     raise ValueError(f"Failed to prefetch {key}")
 
-            fetched_store[tuple(cast_key)] = value
-            to_yield_queue.put(elem, block=True, timeout=timeout * max_tries)
+                fetched_store[tuple(cast_key)] = value
+                to_yield_queue.put(
+                    elem, block=True, timeout=timeout * max_tries
+                )
+                delivery["next"] = index + 1
+                fetched_condition.notify_all()
 
         del storage_wrapper
 
@@ -518,16 +1770,20 @@ class FetchAheadStorageWrapper(StorageWrapper):
         cls: Type["FetchAheadStorageWrapper"],
         iterable: Iterable[HookComboKeyType],
         max_tries: int,
-        to_fetch_queue: Queue[Union[HookComboKeyType, StopFlag]],
+        to_fetch_queue: Queue[Tuple[int, Union[HookComboKeyType, StopFlag]]],
         timeout: float,
     ) -> None:
 
-        for elem in iterable:
+        index = -1
+        for index, elem in enumerate(iterable):
             # wait till the queue has a spot to set the element
-            # for prefetching.
-            to_fetch_queue.put(elem, block=True, timeout=timeout * max_tries)
+            # for prefetching; the index is used to yield elements
+            # in order when there are multiple fetchers.
+            to_fetch_queue.put(
+                (index, elem), block=True, timeout=timeout * max_tries
+            )
 
-        to_fetch_queue.put(StopFlag())
+        to_fetch_queue.put((index + 1, StopFlag()))
 
     def prefetch(self, iterable: Iterable[Any]) -> Iterable[Any]:
         self._start_key_reader_thread(iterable=iterable)
@@ -545,39 +1801,49 @@ class FetchAheadStorageWrapper(StorageWrapper):
     def fetch(
         self: "FetchAheadStorageWrapper",
         key: Union[torch.Tensor, Sequence[torch.Tensor]],
+        mask: Union[None, torch.Tensor, Sequence[torch.Tensor]] = None,
+        column: Optional[str] = None,
     ) -> HookComboValueType:
-        """Fetches values for one or more keys from the storage backend."""
+        """Fetches values for one or more keys from the storage backend;
+        columns are read right away, without prefetching."""
 
-        # casting Tensors to bytes, getting the values.
-        seq_key = tuple(
-            self._cast_key(key, cast_type_map=self.cast_types_map)
-        )
+        if column is not None:
+            if self._column_reader is None:
+                self._column_reader = self._new_reader()
+            _, seq_val = self._column_reader._read(key, mask, column=column)
+            seq_val = [self._cast_fetched(v) for v in seq_val]
+            return self._assemble(key, seq_val, mask)
 
-        retry_count = self._fetch_retry_count
-
-        while seq_key not in self._fetched_store:
-            if retry_count > 0:
-                sleep(self._fetch_timeout)
+        # casting Tensors to bytes, getting the values.
+        seq_key = tuple(self._get_keys(key, mask))
 
-                # decrease the retry count
-                retry_count -= 1
-            else:
-                # we have tried enough times, so we give up
+        with self._fetched_condition:
+            # woken up by the fetcher as soon as the key is in the store
+            is_fetched = self._fetched_condition.wait_for(
+                lambda: seq_key in self._fetched_store,
+                timeout=self._fetch_timeout * self._fetch_retry_count,
+            )
+            if not is_fetched:
+                # we have waited long enough, so we give up
                 raise KeyError(f"Timeout: key {seq_key} not found in storage")
 
-        seq_val = self._fetched_store.pop(seq_key)
+            seq_val = self._fetched_store.pop(seq_key)
+            # a slot in the store is free again
+            self._fetched_condition.notify_all()
 
-        seq_val = [
-            self._cast_value(
-                v, device=self.device, cast_type_map=self.cast_types_map
+        slot = seq_val if isinstance(seq_val, SharedSlot) else None
+        if slot is not None and self._ring is not None:
+            # values on the cpu would keep pointing to the slot after
+            # casting, so they are copied out of it first.
+            seq_val = self._ring.read(
+                slot, copy=torch.device(self.device).type == "cpu"
             )
-            for v in seq_val
-        ]
 
-        if isinstance(key, torch.Tensor):
-            return seq_val[0]
-        else:
-            return seq_val
+        seq_val = [self._cast_fetched(v) for v in seq_val]
+
+        if slot is not None and self._ring is not None:
+            self._ring.release(slot)
+        return self._assemble(key, seq_val, mask)
 
     def store(self, *_, **__) -> None:
         raise NotImplementedError("Cannot write to storage in prefetch mode.")
@@ -589,20 +1855,46 @@ class FetchAheadStorageWrapper(StorageWrapper):
 
 
 class MultiprocessingFetchAheadStorageWrapper(FetchAheadStorageWrapper):
-    def __init__(self, *args, **kwargs):
+    """A FetchAheadStorageWrapper that fetches in separate processes.
+
+    Fetched values are passed back through a ring of shared memory slots
+    of `slot_size` bytes each; values that don't fit in a slot go through
+    a manager dict instead, which pickles them.
+    """
+
+    def __init__(self, *args, slot_size: int = 32 << 20, **kwargs):
         self.manager = multiprocessing.Manager()
+        self._slot_size = slot_size
         super().__init__(
             *args,
             **kwargs,
             new_queue_factory=self.manager.Queue,
             new_store_factory=self.manager.dict,
+            new_condition_factory=self.manager.Condition,
         )
 
     def _start_fetcher_thread(self):
+        # each process would fill its own copy of the memory cache, and
+        # fetcher processes exit at the end of every pass.
+        self.memory_cache = None
+
+        # values in the store take a slot each, and every fetcher might
+        # hold one more while it waits for its turn.
+        self._ring = SharedMemoryRing(
+            num_slots=self._fetch_ahead + self._fetch_workers,
+            slot_size=self._slot_size,
+            new_queue_factory=self.manager.Queue,
+        )
         return super()._start_fetcher_thread(
-            new_thread_factory=multiprocessing.Process
+            new_thread_factory=multiprocessing.Process, share_storage=False
         )
 
+    def close(self) -> None:
+        super().close()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
     def _start_key_reader_thread(self, iterable: Iterable[Any]):
         return super()._start_key_reader_thread(
             iterable=iterable, new_thread_factory=multiprocessing.Process
@@ -0,0 +1,260 @@
+from collections import abc
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Union
+
+import torch
+from torch.utils.data import Dataset
+from torch.utils.data._utils.collate import default_collate
+
+try:
+    import datasets
+except ImportError:
+    datasets = None
+
+from .codecs import BaseCodec
+from .context.session import CachingSession
+from .context.wrapper import StorageWrapper
+from .types import HookComboValueType
+
+
+class CachedDataset(Dataset):
+    """A map-style dataset that attaches cached values to the examples of
+    another dataset, so that they can be loaded by DataLoader workers.
+
+    The cache must have been recorded with `per_example_keys=True`; the
+    value for each example is read using its `key_field` (token ids), and
+    added to the example as `cached_field`. Key options (`pad_token_id`,
+    `half_precision`, `hash_keys`, `key_context`, `namespace`) must match
+    the ones used when recording; use `CachingHook.infer_key_context` to
+    get the context a hook would use for a model.
+
+    Each worker opens the backend read-only on first use, so that
+    several of them can read it at once. Batch examples with
+    CachedCollator, and hand cached values to the model with
+    `CachingSession.attach`. With `persistent_workers`, a `memory_cache`
+    of that many bytes per worker keeps values in memory across epochs.
+
+    The values of `columns` stored with each cached value are read too,
+    and added to the example as a dict under `f"{cached_field}_columns"`.
+    """
+
+    def __init__(
+        self,
+        dataset: Any,
+        backend: str,
+        path: Union[str, Path],
+        backend_kwargs: Optional[Dict[str, Any]] = None,
+        key_field: str = "input_ids",
+        cached_field: str = "cached",
+        pad_token_id: int = 0,
+        half_precision: bool = False,
+        hash_keys: bool = False,
+        hash_check: bool = False,
+        key_context: str = "",
+        namespace: Union[str, Mapping[str, Any], None] = None,
+        memory_cache: Optional[int] = None,
+        codec: Union[str, BaseCodec, None] = None,
+        columns: Sequence[str] = (),
+    ):
+        self.dataset = dataset
+        self.backend = backend
+        self.path = path
+        self.backend_kwargs = backend_kwargs
+        self.key_field = key_field
+        self.cached_field = cached_field
+        self.pad_token_id = pad_token_id
+        self.cast_type_map = CachingSession.get_cast_type_map(half_precision)
+        self.hash_keys = hash_keys
+        self.hash_check = hash_check
+        self.key_context = key_context
+        self.namespace = CachingSession.format_namespace(namespace)
+        self.memory_cache = memory_cache
+        self.codec = codec
+        self.columns = list(columns)
+        self._storage: Optional[StorageWrapper] = None
+
+    @property
+    def storage(self) -> StorageWrapper:
+        # opened lazily, so that each DataLoader worker gets its own
+        if self._storage is None:
+            self._storage = StorageWrapper(
+                backend=self.backend,
+                path=self.path,
+                device="cpu",
+                backend_kwargs={
+                    "read_only": True,
+                    **(self.backend_kwargs or {}),
+                },
+                cast_types_map=self.cast_type_map,
+                pad_token_id=self.pad_token_id,
+                per_example_keys=True,
+                hash_keys=self.hash_keys,
+                hash_check=self.hash_check,
+                key_context=self.key_context,
+                namespace=self.namespace,
+                memory_cache=self.memory_cache,
+                codec=self.codec,
+            )
+        return self._storage
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # backend handles can't be sent to worker processes
+        return {**self.__dict__, "_storage": None}
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    @classmethod
+    def _unbatch(cls, value: HookComboValueType) -> HookComboValueType:
+        if isinstance(value, torch.Tensor):
+            return value[0]
+        elif isinstance(value, abc.Mapping):
+            return {k: cls._unbatch(v) for k, v in value.items()}
+        return [cls._unbatch(v) for v in value]
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        example = dict(self.dataset[index])
+        key = torch.as_tensor(example[self.key_field])
+        example[self.key_field] = key
+
+        # the storage reads batches of keys; this is a batch of one
+        cached = self.storage.fetch(key.unsqueeze(0))
+        example[self.cached_field] = self._unbatch(cached)
+        if self.columns:
+            example[f"{self.cached_field}_columns"] = {
+                name: self._unbatch(
+                    self.storage.fetch(key.unsqueeze(0), column=name)
+                )
+                for name in self.columns
+            }
+        return example
+
+
+def add_cached_column(
+    dataset: "datasets.Dataset",
+    path: Union[str, Path],
+    key_field: str = "input_ids",
+    cached_field: str = "cached",
+    pad_token_id: int = 0,
+    half_precision: bool = False,
+    hash_keys: bool = False,
+    key_context: str = "",
+    namespace: Union[str, Mapping[str, Any], None] = None,
+) -> "datasets.Dataset":
+    """Returns a HuggingFace dataset with the values cached for its
+    examples in an `arrow` store at `path` added as `cached_field`.
+
+    Like for CachedDataset, the cache must have been recorded with
+    `per_example_keys=True` and the same key options; keys are looked
+    up once, here, rather than for every batch. Values must have been
+    stored as arrays (or lists of one array), without a codec; each
+    becomes a [num_rows, last_dim] array, e.g. [tokens, hidden] for the
+    output of a layer. The new column is read from the memory-mapped
+    files of the store, and if examples were recorded in the order of
+    `dataset`, it is a zero-copy slice of them.
+    """
+    if datasets is None:
+        raise ImportError("datasets is not installed.")
+
+    storage = StorageWrapper(
+        backend="arrow",
+        path=path,
+        device="cpu",
+        backend_kwargs={"read_only": True},
+        cast_types_map=CachingSession.get_cast_type_map(half_precision),
+        pad_token_id=pad_token_id,
+        per_example_keys=True,
+        hash_keys=hash_keys,
+        key_context=key_context,
+        namespace=CachingSession.format_namespace(namespace),
+    )
+    try:
+        keys = [
+            storage._get_keys(torch.as_tensor(ids).unsqueeze(0))[0]
+            for ids in dataset[key_field]
+        ]
+        rows = storage.storage.rows(keys)
+        part_paths = storage.storage.part_paths
+    finally:
+        storage.close()
+
+    cached = datasets.concatenate_datasets(
+        [datasets.Dataset.from_file(str(p)) for p in part_paths]
+    )
+    cached = cached.remove_columns(
+        [c for c in cached.column_names if c != "value"]
+    ).rename_column("value", cached_field)
+
+    if rows and rows == list(range(rows[0], rows[0] + len(rows))):
+        # a contiguous range of rows is selected without an index
+        cached = cached.select(range(rows[0], rows[0] + len(rows)))
+    else:
+        cached = cached.select(rows)
+    return datasets.concatenate_datasets([dataset, cached], axis=1)
+
+
+class CachedCollator:
+    """Collates examples from CachedDataset into a batch, padding token
+    ids, masks, and cached values to the longest example.
+
+    Tensors (or lists of numbers) whose first dimension differs across
+    examples are padded with `pad_values[field]` if given, with
+    `pad_token_id` for `key_field`, and with zeros otherwise; other fields
+    are collated by torch's `default_collate`.
+    """
+
+    def __init__(
+        self,
+        pad_token_id: int = 0,
+        key_field: str = "input_ids",
+        pad_values: Optional[Dict[str, Any]] = None,
+    ):
+        self.pad_token_id = pad_token_id
+        self.key_field = key_field
+        self.pad_values = pad_values or {}
+
+    def _pad_value(self, field: str) -> Any:
+        if field in self.pad_values:
+            return self.pad_values[field]
+        return self.pad_token_id if field == self.key_field else 0
+
+    @classmethod
+    def _pad(cls, values: Sequence[Any], pad_value: Any) -> Any:
+        first = values[0]
+        if isinstance(first, abc.Mapping):
+            return {
+                k: cls._pad([v[k] for v in values], pad_value) for k in first
+            }
+        if isinstance(first, (list, tuple)) and not all(
+            isinstance(v, (int, float, bool)) for v in first
+        ):
+            return [
+                cls._pad([v[i] for v in values], pad_value)
+                for i in range(len(first))
+            ]
+
+        tensors: List[torch.Tensor] = [torch.as_tensor(v) for v in values]
+        if all(t.shape == tensors[0].shape for t in tensors):
+            return torch.stack(tensors)
+        if any(t.dim() == 0 for t in tensors):
+            raise ValueError("Cannot pad values with no dimensions")
+
+        length = max(t.shape[0] for t in tensors)
+        batch = tensors[0].new_full(
+            (len(tensors), length, *tensors[0].shape[1:]), pad_value
+        )
+        for i, tensor in enumerate(tensors):
+            batch[i, : tensor.shape[0]] = tensor
+        return batch
+
+    def __call__(
+        self, examples: Sequence[Mapping[str, Any]]
+    ) -> Dict[str, Any]:
+        batch = {}
+        for field in examples[0]:
+            values = [e[field] for e in examples]
+            if isinstance(values[0], (str, bytes)):
+                batch[field] = default_collate(values)
+            else:
+                batch[field] = self._pad(values, self._pad_value(field))
+        return batch
@@ -39,17 +39,31 @@ class NoOpWhenCachedDebertaV2Layer(NoOpWhenCached, DebertaV2Layer):
 
 
 class CachedDebertaV2Layer(CachedLayer, DebertaV2Layer):
-    ...
+    def __init__(self, config):
+        super().__init__(config)
+        self.cache_relative_pos = getattr(config, "cache_relative_pos", False)
+
+    def get_shared_cache_columns(self, *args, **kwargs):
+        # relative positions are the same for all batches of a length;
+        # with gradient checkpointing, they are passed positionally.
+        relative_pos = kwargs.get(
+            "relative_pos", args[3] if len(args) > 3 else None
+        )
+        if not self.cache_relative_pos or relative_pos is None:
+            return None
+        return {"relative_pos": relative_pos}
 
 
 class CachedDebertaV2Config(DebertaV2Config):
     def __init__(
         self: "CachedDebertaV2Config",
         position_to_cache: Union[int, float] = 0.5,
+        cache_relative_pos: bool = False,
         **kwargs,
     ):
         super().__init__(**kwargs)
         self.position_to_cache = position_to_cache
+        self.cache_relative_pos = cache_relative_pos
 
 
 class CachedDebertaV2Encoder(BaseModuleWithCaching, DebertaV2Encoder):
@@ -75,12 +89,20 @@ class CachedDebertaV2Encoder(BaseModuleWithCaching, DebertaV2Encoder):
         self.layer = ModuleList(
             [layer_factory(i) for i in range(config.num_hidden_layers)]
         )
+        self.cache_relative_pos = getattr(config, "cache_relative_pos", False)
 
     def get_rel_pos(self, hidden_states, query_states=None, relative_pos=None):
-        if self.cache is None or self.cache.recording or self.cache.training:
+        # when fetching (also while training), the layers below the
+        # cached one don't run, so there are no hidden states to size
+        # relative positions from; cached hidden states are as long as
+        # the key (once padding is restored), so they are sized from it,
+        # unless the cached layer stored them (see `cache_relative_pos`).
+        if self.cache is None or self.cache.recording:
             return super().get_rel_pos(
                 hidden_states, query_states, relative_pos
             )
+        elif self.relative_attention and self.cache_relative_pos:
+            return self.cache.shared_column("relative_pos")
         else:
             return super().get_rel_pos(self.cache._key.unsqueeze(-1))
 
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Tuple, Union
+from typing import Dict, Optional, Tuple, Union
 
 import torch
 
@@ -91,12 +91,36 @@ class NoOpWhenCached(BaseModuleWithCaching):
 
 
 class CachedLayer(BaseModuleWithCaching):
+    def get_cache_columns(
+        self, *args, **kwargs
+    ) -> Optional[Dict[str, torch.Tensor]]:
+        """Auxiliary tensors to store next to the output of the layer,
+        given its arguments; other modules can read them with
+        `self.cache.column` instead of computing them again.
+        Subclasses might customize it; by default, there are none."""
+        return None
+
+    def get_shared_cache_columns(
+        self, *args, **kwargs
+    ) -> Optional[Dict[str, torch.Tensor]]:
+        """Like `get_cache_columns`, for tensors that only depend on the
+        length of the key (e.g. relative positions), which are stored
+        once for all keys of that length; other modules can read them
+        with `self.cache.shared_column`. By default, there are none."""
+        return None
+
     def forward(self, *args, **kwargs):
         if self.cache is None:
             return super().forward(*args, **kwargs)
         elif self.cache.recording:
             out = super().forward(*args, **kwargs)
-            self.cache.store(out)
+            self.cache.store(
+                out,
+                columns=self.get_cache_columns(*args, **kwargs),
+                shared_columns=self.get_shared_cache_columns(
+                    *args, **kwargs
+                ),
+            )
         else:
             out = self.cache.fetch()
         return out
@@ -0,0 +1,66 @@
+import torch
+
+from s2re import CachingHook
+from s2re.models.bert import (
+    CachedBertConfig,
+    CachedBertForSequenceClassification,
+)
+
+
+def make_model(**config_kwargs):
+    """A small BERT caching the output of its second layer."""
+    torch.manual_seed(0)
+    config = CachedBertConfig(
+        vocab_size=100,
+        hidden_size=32,
+        num_hidden_layers=4,
+        num_attention_heads=2,
+        intermediate_size=64,
+        position_to_cache=1,
+        **config_kwargs,
+    )
+    return CachedBertForSequenceClassification(config).eval()
+
+
+def make_batches(num_batches=4, batch_size=3, length=10, pad_token_id=0):
+    """Batches of random token ids, right-padded to `length`."""
+    generator = torch.Generator().manual_seed(1)
+    batches = []
+    for _ in range(num_batches):
+        ids = torch.randint(2, 100, (batch_size, length), generator=generator)
+        lengths = torch.randint(
+            3, length + 1, (batch_size,), generator=generator
+        )
+        mask = torch.arange(length)[None] < lengths[:, None]
+        batches.append(
+            {
+                "input_ids": ids.masked_fill(~mask, pad_token_id),
+                "attention_mask": mask.long(),
+            }
+        )
+    return batches
+
+
+def record_and_use(
+    model, path, batches, use_batches=None, record_kwargs=None, **kwargs
+):
+    """Records `batches` with `model`, then runs it on `use_batches` (or
+    the same batches) using the cache; returns the logits computed
+    without and with the cache. Keyword arguments are passed to both
+    CachingHook contexts, `record_kwargs` only when recording."""
+    use_batches = batches if use_batches is None else use_batches
+    hook = CachingHook(path=path, **kwargs)
+    with torch.no_grad():
+        expected = [model(**b).logits for b in use_batches]
+        with hook.record(model, **(record_kwargs or {})):
+            for b in batches:
+                model(**b)
+        with hook.use(model) as session:
+            actual = [model(**b).logits for b in session.iterate(use_batches)]
+    return expected, actual
+
+
+def assert_all_close(expected, actual, atol=1e-5):
+    assert len(expected) == len(actual)
+    for e, a in zip(expected, actual):
+        torch.testing.assert_close(a, e, atol=atol, rtol=0)
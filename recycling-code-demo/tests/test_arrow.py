@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+import torch
+
+from s2re.backend import BackendRegistry
+
+pytest.importorskip("pyarrow")
+ArrowStorage = BackendRegistry.get("arrow")
+
+
+def test_round_trip(tmp_path):
+    storage = ArrowStorage(path=tmp_path / "store")
+    values = {
+        b"array": np.arange(12, dtype=np.float32).reshape(3, 4),
+        b"list": [torch.ones(2, 4)],
+        # not of the type of the value column: serialized in a blob
+        b"other": np.arange(5),
+        b"dict": {"hidden": np.zeros((1, 4), dtype=np.float32)},
+    }
+    storage.batch_write(list(values), list(values.values()))
+    # reading ends the part, so that its rows can be read
+    (array,) = storage.batch_read([b"array"])
+    np.testing.assert_array_equal(array, values[b"array"])
+    storage.batch_write([b"more"], [np.ones((1, 4), dtype=np.float32)])
+    storage.close()
+    assert [p.name for p in ArrowStorage.files(tmp_path / "store")] == [
+        "part-00000.arrow",
+        "part-00001.arrow",
+    ]
+
+    storage = ArrowStorage(path=tmp_path / "store", read_only=True)
+    array, (listed,), other, value = storage.batch_read(list(values))
+    np.testing.assert_array_equal(array, values[b"array"])
+    np.testing.assert_array_equal(listed, np.ones((2, 4)))
+    np.testing.assert_array_equal(other, np.arange(5))
+    np.testing.assert_array_equal(value["hidden"], np.zeros((1, 4)))
+    assert storage.rows([b"list", b"more"]) == [1, 4]
+    with pytest.raises(ValueError):
+        storage.rows([b"other"])
+    storage.close()
+
+
+def test_last_write_wins(tmp_path):
+    keys = [b"a", b"b", b"c"]
+    storage = ArrowStorage(path=tmp_path / "store")
+    storage.batch_write(keys, [np.zeros((1, 2))] * 3)
+    storage.batch_write(keys[:1], [np.ones((1, 2))])
+    storage.batch_delete(keys[1:2])
+    storage.close()
+
+    storage = ArrowStorage(path=tmp_path / "store")
+    (value,) = storage.batch_read(keys[:1])
+    np.testing.assert_array_equal(value, np.ones((1, 2)))
+    with pytest.raises(KeyError):
+        storage.batch_read(keys[1:2])
+    # deleted, then written again in a later session
+    storage.batch_write(keys[1:2], [np.full((1, 2), 2.0)])
+    storage.close()
+
+    storage = ArrowStorage(path=tmp_path / "store")
+    for key, expected in zip(keys, [1.0, 2.0, 0.0]):
+        (value,) = storage.batch_read([key])
+        np.testing.assert_array_equal(value, np.full((1, 2), expected))
+    storage.close()
+
+
+def write_batches(path):
+    storage = ArrowStorage(path=path)
+    for i in range(2):
+        storage.batch_write([f"key-{i}".encode()], [np.full((2, 8), i)])
+    storage.close()
+    (part,) = ArrowStorage.files(path)
+    return part
+
+
+def test_interrupted_writer(tmp_path):
+    part = write_batches(tmp_path / "store")
+    # the second batch, and the end of stream marker, were not written
+    part.write_bytes(part.read_bytes()[:-24])
+    size = part.stat().st_size
+
+    with pytest.warns(UserWarning, match="interrupted"):
+        storage = ArrowStorage(path=tmp_path / "store", read_only=True)
+    (value,) = storage.batch_read([b"key-0"])
+    np.testing.assert_array_equal(value, np.zeros((2, 8)))
+    with pytest.raises(KeyError):
+        storage.batch_read([b"key-1"])
+    storage.close()
+    assert part.stat().st_size == size
+
+    # the incomplete batch is cut off by a writer
+    with pytest.warns(UserWarning, match="interrupted"):
+        storage = ArrowStorage(path=tmp_path / "store")
+    storage.close()
+    assert part.stat().st_size < size
+    storage = ArrowStorage(path=tmp_path / "store")
+    storage.batch_write([b"key-1"], [np.ones((2, 8))])
+    (value,) = storage.batch_read([b"key-1"])
+    np.testing.assert_array_equal(value, np.ones((2, 8)))
+    storage.close()
+
+
+def test_corrupt_part(tmp_path):
+    part = write_batches(tmp_path / "store")
+    write_batches(tmp_path / "other")
+    # only the last part can be incomplete
+    (tmp_path / "other" / "part-00000.arrow").rename(
+        tmp_path / "store" / "part-00001.arrow"
+    )
+    part.write_bytes(part.read_bytes()[:-24])
+    with pytest.raises(ValueError):
+        ArrowStorage(path=tmp_path / "store")
@@ -0,0 +1,89 @@
+import numpy as np
+import torch
+
+from s2re.context.wrapper import HostBufferPool, StorageWrapper
+
+
+class Event:
+    """Stands in for a CUDA event, completing when told to."""
+
+    def __init__(self):
+        self.done = False
+
+    def query(self):
+        return self.done
+
+
+def test_sizes_are_powers_of_two():
+    pool = HostBufferPool(pin=False)
+    assert pool.acquire(1).numel() == 1
+    assert pool.acquire(1000).numel() == 1024
+    assert pool.acquire(1024).numel() == 1024
+
+
+def test_released_buffers_are_reused():
+    pool = HostBufferPool(pin=False)
+    buffer = pool.acquire(1000)
+    pool.release(buffer)
+    # the smallest free buffer that fits is handed out again
+    assert pool.acquire(600).data_ptr() == buffer.data_ptr()
+    pool.release(buffer)
+    assert pool.acquire(2000).data_ptr() != buffer.data_ptr()
+
+
+def test_release_waits_for_the_event():
+    pool = HostBufferPool(pin=False)
+    buffer, event = pool.acquire(64), Event()
+    pool.release(buffer, event)
+    # the copy from the buffer is still in flight
+    other = pool.acquire(64)
+    assert other.data_ptr() != buffer.data_ptr()
+
+    event.done = True
+    assert pool.acquire(64).data_ptr() == buffer.data_ptr()
+
+
+def test_max_buffers():
+    pool = HostBufferPool(pin=False, max_buffers=2)
+    buffers = [pool.acquire(n) for n in (16, 32, 64)]
+    for buffer in buffers:
+        pool.release(buffer)
+    pool.acquire(1)
+    # the smallest buffer was dropped, the largest one is still free
+    assert [b.numel() for b in pool._free] == [64]
+
+
+def test_to_device_on_the_cpu():
+    pool = HostBufferPool(pin=False)
+    array = np.frombuffer(np.arange(6, dtype=np.float32).tobytes(), "f4")
+    tensor = pool.to_device(array.reshape(2, 3), "cpu")
+    torch.testing.assert_close(tensor, torch.arange(6.0).view(2, 3))
+    # a writable copy, which is not handed out again
+    tensor.add_(1)
+    np.testing.assert_array_equal(array, np.arange(6))
+    assert pool.acquire(24).data_ptr() != tensor.data_ptr()
+
+    value = torch.randn(4, 2)
+    torch.testing.assert_close(pool.to_device(value, "cpu"), value)
+
+
+def test_fetch_through_the_pool_on_the_cpu(tmp_path, monkeypatch):
+    calls = []
+    to_device = HostBufferPool.to_device
+
+    def spy(self, value, device):
+        calls.append(device)
+        return to_device(self, value, device)
+
+    monkeypatch.setattr(HostBufferPool, "to_device", spy)
+    storage = StorageWrapper(
+        backend="flat", path=tmp_path / "store", device="cpu", pin_memory=True
+    )
+    key = torch.tensor([[1, 2, 3]])
+    value = {"hidden": torch.randn(1, 3, 4), "pooled": torch.randn(1, 4)}
+    storage.store(key, value)
+
+    fetched = storage.fetch(key)
+    assert len(calls) == 2
+    torch.testing.assert_close(fetched, value)
+    storage.close()
@@ -0,0 +1,238 @@
+import pytest
+import torch
+
+from helpers import assert_all_close, make_batches, make_model, record_and_use
+from s2re.codecs import decode, decodes_on_host, get_codec, is_encoded
+from s2re.context.wrapper import StorageWrapper
+
+
+def hidden_states(*shape, dtype=torch.float32):
+    generator = torch.Generator().manual_seed(0)
+    return torch.randn(*shape, generator=generator).to(dtype)
+
+
+def max_error(actual, expected):
+    return (actual.float() - expected.float()).abs().max().item()
+
+
+@pytest.mark.parametrize("axis", ["token", "channel"])
+@pytest.mark.parametrize("zero_point", [False, True])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float16])
+def test_int8(axis, zero_point, dtype):
+    codec = get_codec("int8")
+    codec.axis, codec.zero_point = axis, zero_point
+    value = hidden_states(2, 5, 16, dtype=dtype)
+    encoded = codec.encode(value)
+    assert is_encoded(encoded)
+
+    decoded = decode(encoded, codec)
+    assert decoded.dtype == dtype and decoded.shape == value.shape
+    # at most half a step of 1/127 (or 1/255) of the range
+    assert max_error(decoded, value) <= value.abs().max().item() / 100
+
+
+def test_bf16():
+    value = hidden_states(3, 8)
+    encoded = get_codec("bf16").encode(value)
+    decoded = decode(encoded, get_codec("bf16"))
+    assert decoded.dtype == torch.float32
+    torch.testing.assert_close(decoded, value.bfloat16().float())
+
+
+def test_containers_and_other_dtypes():
+    codec = get_codec("int8")
+    ids = torch.arange(6)
+    value = {"hidden": hidden_states(2, 3, 8), "ids": ids}
+    decoded = decode(codec.encode(value), codec)
+    assert list(decoded) == ["hidden", "ids"]
+    # only floating point tensors are encoded
+    assert torch.equal(decoded["ids"], ids)
+
+    hidden, pooled = decode(
+        codec.encode([hidden_states(2, 3, 8), hidden_states(2, 8)]), codec
+    )
+    assert hidden.shape == (2, 3, 8) and pooled.shape == (2, 8)
+
+    # nothing to encode
+    assert not is_encoded(codec.encode(ids))
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec("int4")
+
+
+def test_stored_values_are_encoded(tmp_path):
+    storage = StorageWrapper(
+        backend="flat", path=tmp_path / "store", device="cpu", codec="int8"
+    )
+    key, value = torch.tensor([[1, 2, 3]]), hidden_states(1, 3, 32)
+    storage.store(key, value)
+
+    (stored,) = storage.storage.batch_read(storage._get_keys(key))
+    assert storage._nbytes(stored) < storage._nbytes(value) / 3
+    fetched = storage.fetch(key)
+    assert fetched.dtype == torch.float32
+    assert max_error(fetched, value) < 0.05
+    storage.close()
+
+
+@pytest.mark.parametrize("codec", ["int8", "bf16"])
+def test_model(tmp_path, codec):
+    model = make_model()
+    expected, actual = record_and_use(
+        model, tmp_path / "store", make_batches(), backend="flat", codec=codec
+    )
+    assert_all_close(expected, actual, atol=1e-2)
+
+
+def low_rank(num_vectors, rank=4, dim=16):
+    """Vectors in a `rank` dimensional subspace, off the origin."""
+    generator = torch.Generator().manual_seed(2)
+    basis = torch.randn(rank, dim, generator=generator)
+    mean = torch.randn(dim, generator=generator)
+    return torch.randn(num_vectors, rank, generator=generator) @ basis + mean
+
+
+def fit(codec, sample):
+    assert codec.observe(sample)
+    state_id, state = codec.fit_sample()
+    assert codec.fitted and codec.state_id == state_id
+    return state
+
+
+def test_pca():
+    codec = get_codec("pca")
+    codec.rank, codec.sample_size = 4, 64
+    sample = low_rank(64)
+    state = fit(codec, sample)
+    assert state["basis"].shape == (16, 4)
+
+    value = low_rank(10).reshape(2, 5, 16)
+    encoded = codec.encode(value)
+    decoded = decode(encoded, codec)
+    assert decoded.shape == value.shape
+    assert max_error(decoded, value) < 1e-3
+    # tensors of another size are not encoded
+    assert not is_encoded(codec.encode(torch.randn(2, 8)))
+
+
+def test_pq():
+    codec = get_codec("pq")
+    codec.num_subvectors, codec.num_centroids = 4, 8
+    codec.sample_size = 8
+    # centroids start at vectors of the sample, here all of them
+    vectors = hidden_states(8, 16)
+    fit(codec, vectors)
+
+    encoded = codec.encode(vectors)
+    # one byte per part
+    (codes,) = [v for k, v in encoded.items() if ":codes:" in k]
+    assert codes.dtype == torch.uint8 and codes.shape == (8, 4)
+    decoded = decode(encoded, codec)
+    assert decoded.shape == vectors.shape
+    assert max_error(decoded, vectors) < 1e-4
+
+
+def pca_storage(path, sample_size):
+    codec = get_codec("pca")
+    codec.rank, codec.sample_size = 4, sample_size
+    return StorageWrapper(backend="flat", path=path, device="cpu", codec=codec)
+
+
+@pytest.mark.parametrize("sample_size", [12, 1000])
+def test_learned_states_are_stored(tmp_path, sample_size):
+    storage = pca_storage(tmp_path / "store", sample_size)
+    keys = [torch.tensor([[i, i + 1, i + 2]]) for i in range(8)]
+    values = low_rank(24).reshape(8, 1, 3, 16)
+    for key, value in zip(keys, values[:3]):
+        storage.store(key, value)
+    # values are held back until the sample is complete
+    assert not storage.codec.fitted
+    storage.store(keys[3], values[3])
+    assert storage.codec.fitted == (sample_size == 12)
+    for key, value in zip(keys[4:], values[4:]):
+        storage.store(key, value)
+    # with a sample that is never complete, the codec is fitted on close
+    storage.close()
+
+    # states are read back from the backend
+    storage = StorageWrapper(
+        backend="flat", path=tmp_path / "store", device="cpu"
+    )
+    for key, value in zip(keys, values):
+        assert max_error(storage.fetch(key), value) < 1e-3
+    assert storage.codec.name == "pca" and len(storage.codec.states) == 1
+    storage.close()
+
+
+def lossless(name, **kwargs):
+    if name == "zstd":
+        pytest.importorskip("zstandard")
+    else:
+        pytest.importorskip("lz4")
+    return type(get_codec(name))(**kwargs)
+
+
+@pytest.mark.parametrize("name", ["lz4", "zstd"])
+@pytest.mark.parametrize("shuffle", ["byte", "bit", "none"])
+@pytest.mark.parametrize(
+    "dtype", [torch.float32, torch.float16, torch.bfloat16, torch.int64]
+)
+@pytest.mark.parametrize("threads", [1, 4])
+def test_lossless(name, shuffle, dtype, threads):
+    # blocks of 64 bytes, the last one partly filled
+    codec = lossless(name, shuffle=shuffle, block_size=64, threads=threads)
+    value = {
+        "hidden": (hidden_states(3, 37) * 100).to(dtype),
+        "empty": torch.zeros(0, 4, dtype=dtype),
+    }
+    encoded = codec.encode(value)
+    assert is_encoded(encoded)
+
+    decoded = decode(encoded, codec)
+    for key in value:
+        assert decoded[key].dtype == dtype
+        assert torch.equal(decoded[key], value[key])
+
+
+def test_shuffling_compresses_floats():
+    value = torch.linspace(0, 1, 1 << 14)
+    sizes = {}
+    for shuffle in ["byte", "none"]:
+        encoded = lossless("lz4", shuffle=shuffle).encode(value)
+        sizes[shuffle] = StorageWrapper._nbytes(encoded)
+    # bytes of floats hardly compress as they are
+    assert sizes["byte"] < value.nbytes / 2 < sizes["none"]
+
+
+def test_values_are_decoded_with_their_shuffle():
+    value = hidden_states(4, 16)
+    encoded = lossless("lz4", shuffle="bit").encode(value)
+    assert torch.equal(decode(encoded, lossless("lz4")), value)
+    # or by a codec of the same name, with default options
+    assert torch.equal(decode(encoded), value)
+
+    with pytest.raises(ValueError):
+        lossless("lz4", shuffle="word")
+
+
+def test_lossless_storage(tmp_path):
+    pytest.importorskip("lz4")
+    storage = StorageWrapper(
+        backend="flat", path=tmp_path / "store", device="cpu", codec="lz4"
+    )
+    key = torch.tensor([[1, 2, 3]])
+    value = {"hidden": hidden_states(1, 3, 32), "ids": torch.arange(3)[None]}
+    storage.store(key, value)
+    storage.close()
+
+    storage = StorageWrapper(
+        backend="flat", path=tmp_path / "store", device="cpu"
+    )
+    (stored,) = storage.storage.batch_read(storage._get_keys(key))
+    assert decodes_on_host(stored)
+    fetched = storage.fetch(key)
+    for name in value:
+        assert torch.equal(fetched[name], value[name])
+    storage.close()
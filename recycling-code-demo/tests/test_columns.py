@@ -0,0 +1,130 @@
+import torch
+
+from helpers import assert_all_close, make_batches, record_and_use
+from s2re.context.session import CachingSession
+from s2re.context.wrapper import StorageWrapper
+from s2re.models.deberta_v2 import (
+    CachedDebertaV2Config,
+    CachedDebertaV2ForSequenceClassification,
+)
+
+
+def test_columns_of_examples(tmp_path):
+    storage = StorageWrapper(
+        backend="flat",
+        path=tmp_path / "store",
+        device="cpu",
+        per_example_keys=True,
+    )
+    key = torch.tensor([[5, 6, 7], [8, 9, 0]])
+    value, bias = torch.randn(2, 3, 4), torch.randn(2, 3)
+    storage.store(key, value)
+    storage.store(key, bias, column="bias")
+
+    # columns are split and padded like values, and read on their own
+    mask = (key != 0).float()
+    torch.testing.assert_close(storage.fetch(key, column="bias"), bias * mask)
+    torch.testing.assert_close(
+        storage.fetch(key[1:]), value[1:] * mask[1:, :, None]
+    )
+    storage.close()
+
+
+def new_session(path, recording):
+    return CachingSession(
+        recording=recording, backend="flat", device="cpu", path=path
+    )
+
+
+def test_shared_columns_are_stored_once(tmp_path, monkeypatch):
+    keys = [
+        torch.tensor([[1, 2, 3]]),
+        torch.tensor([[4, 5, 6]]),
+        torch.tensor([[7, 8]]),
+    ]
+    shared = torch.arange(9).view(1, 3, 3)
+
+    session = new_session(tmp_path / "store", recording=True)
+    written = []
+    batch_write = session.storage.storage.batch_write
+
+    def spy_write(keys, values):
+        written.extend(keys)
+        batch_write(keys, values)
+
+    monkeypatch.setattr(session.storage.storage, "batch_write", spy_write)
+    for key in keys:
+        length = key.size(-1)
+        session.key(key)
+        session.store(
+            torch.randn(1, length, 2),
+            shared_columns={"pos": shared[:, :length, :length]},
+        )
+    session.close()
+    # one value per key, and one shared column per length
+    assert len(written) == 5
+
+    session = new_session(tmp_path / "store", recording=False)
+    columns = []
+    fetch = session.storage.fetch
+
+    def spy_fetch(key, column=None):
+        columns.append(column)
+        return fetch(key, column=column)
+
+    monkeypatch.setattr(session.storage, "fetch", spy_fetch)
+    for key in keys:
+        length = key.size(-1)
+        session.key(key)
+        torch.testing.assert_close(
+            session.shared_column("pos"), shared[:, :length, :length]
+        )
+        session.fetch()
+    # shared columns are read once per length
+    assert columns.count("pos") == 2
+    session.close()
+
+
+def make_deberta(**config_kwargs):
+    torch.manual_seed(0)
+    config = CachedDebertaV2Config(
+        vocab_size=100,
+        hidden_size=32,
+        num_hidden_layers=4,
+        num_attention_heads=2,
+        intermediate_size=64,
+        position_to_cache=1,
+        relative_attention=True,
+        position_buckets=4,
+        max_relative_positions=8,
+        pos_att_type=["p2c", "c2p"],
+        **config_kwargs,
+    )
+    return CachedDebertaV2ForSequenceClassification(config).eval()
+
+
+def test_deberta_relative_positions(tmp_path, monkeypatch):
+    shared_columns = []
+    shared_column = CachingSession.shared_column
+
+    def spy(self, name):
+        shared_columns.append(name)
+        return shared_column(self, name)
+
+    monkeypatch.setattr(CachingSession, "shared_column", spy)
+    batches = make_batches()
+
+    model = make_deberta(cache_relative_pos=True)
+    expected, actual = record_and_use(
+        model, tmp_path / "store", batches, backend="flat"
+    )
+    assert_all_close(expected, actual)
+    assert shared_columns == ["relative_pos"] * len(batches)
+
+    # without recording them, relative positions are built from the key
+    model = make_deberta()
+    expected, actual = record_and_use(
+        model, tmp_path / "other", batches, backend="flat"
+    )
+    assert_all_close(expected, actual)
+    assert len(shared_columns) == len(batches)
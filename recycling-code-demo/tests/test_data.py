@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import torch
+
+from s2re.context.wrapper import StorageWrapper
+from s2re.data import add_cached_column
+
+datasets = pytest.importorskip("datasets")
+
+
+def record(path, examples, hidden_size=4):
+    """Stores a [tokens, hidden_size] value per example in an arrow store,
+    in the order of `examples`, in batches of two."""
+    storage = StorageWrapper(
+        backend="arrow", path=path, device="cpu", per_example_keys=True
+    )
+    values = []
+    for start in range(0, len(examples), 2):
+        batch = examples[start : start + 2]
+        length = max(len(ids) for ids in batch)
+        key = torch.zeros(len(batch), length, dtype=torch.long)
+        for i, ids in enumerate(batch):
+            key[i, : len(ids)] = torch.tensor(ids)
+        value = torch.randn(len(batch), length, hidden_size)
+        storage.store(key, value)
+        values.extend(v[: len(ids)] for v, ids in zip(value, batch))
+    storage.close()
+    return values
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_add_cached_column(tmp_path, shuffle):
+    examples = [[5, 6, 7], [8, 9], [10, 11, 12, 13], [14], [15, 16]]
+    values = record(tmp_path / "store", examples)
+
+    dataset = datasets.Dataset.from_dict(
+        {"input_ids": examples, "label": list(range(len(examples)))}
+    )
+    if shuffle:
+        dataset = dataset.select([3, 0, 4, 2, 1])
+    dataset = add_cached_column(dataset, tmp_path / "store")
+
+    assert dataset.column_names == ["input_ids", "label", "cached"]
+    for example in dataset.with_format("numpy"):
+        np.testing.assert_allclose(
+            np.stack(example["cached"]), values[example["label"]]
+        )
@@ -0,0 +1,65 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from helpers import assert_all_close, make_batches, make_model
+from s2re import CachingHook
+from s2re.data import CachedCollator, CachedDataset
+
+
+def test_collator_pads_to_the_longest_example():
+    collator = CachedCollator(pad_token_id=1)
+    batch = collator(
+        [
+            {"input_ids": [5, 6, 7], "cached": torch.ones(3, 2), "label": 0},
+            {"input_ids": [8], "cached": torch.ones(1, 2), "label": 1},
+        ]
+    )
+    assert batch["input_ids"].tolist() == [[5, 6, 7], [8, 1, 1]]
+    # cached values are padded with zeros
+    expected = torch.ones(2, 3, 2)
+    expected[1, 1:] = 0
+    torch.testing.assert_close(batch["cached"], expected)
+    assert batch["label"].tolist() == [0, 1]
+
+
+# workers open the store read-only, each on its own
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_data_loader(tmp_path, num_workers):
+    model = make_model()
+    batches = make_batches()
+    hook = CachingHook(
+        backend="flat", path=tmp_path / "store", per_example_keys=True
+    )
+    with torch.no_grad(), hook.record(model):
+        for batch in batches:
+            model(**batch)
+
+    # the examples, without their padding
+    examples = [
+        {"input_ids": ids[mask.bool()].tolist(), "attention_mask": [1] * n}
+        for batch in batches
+        for ids, mask, n in zip(
+            batch["input_ids"],
+            batch["attention_mask"],
+            batch["attention_mask"].sum(-1).tolist(),
+        )
+    ]
+    loader = DataLoader(
+        CachedDataset(examples, backend="flat", path=tmp_path / "store"),
+        batch_size=5,
+        collate_fn=CachedCollator(),
+        num_workers=num_workers,
+    )
+
+    expected, actual = [], []
+    with torch.no_grad(), hook.use(model) as session:
+        for batch in loader:
+            session.attach(batch.pop("cached"))
+            actual.append(model(**batch).logits)
+    with torch.no_grad():
+        for batch in loader:
+            del batch["cached"]
+            expected.append(model(**batch).logits)
+    assert len(actual) == -(-len(examples) // 5)
+    assert_all_close(expected, actual)
@@ -0,0 +1,103 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from s2re.backend import BackendRegistry
+
+FlatStorage = BackendRegistry.get("flat")
+
+VALUES = {
+    b"tensor": torch.randn(3, 4),
+    b"scalar": np.array(1.5, dtype=np.float32),
+    b"empty": np.zeros((0, 4), dtype=np.int64),
+    b"list": [np.arange(5), torch.ones(2, dtype=torch.float16)],
+    b"dict": {"hidden": np.ones((2, 3)), "mask": np.array([True, False])},
+}
+
+
+def assert_equal(actual, expected):
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected)
+        [assert_equal(actual[k], expected[k]) for k in expected]
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected)
+        [assert_equal(a, e) for a, e in zip(actual, expected)]
+    else:
+        expected = np.asarray(expected)
+        # values come back as arrays, even if tensors were written
+        assert isinstance(actual, np.ndarray)
+        assert actual.dtype == expected.dtype
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_round_trip_across_shards(tmp_path):
+    # small shards, so that values spread over several of them
+    storage = FlatStorage(path=tmp_path / "store", shard_size=64)
+    storage.batch_write(list(VALUES), list(VALUES.values()))
+    for key, value in VALUES.items():
+        assert_equal(storage.read(key), value)
+    storage.close()
+    assert len(list((tmp_path / "store").glob("shard-*.bin"))) > 1
+
+    storage = FlatStorage(path=tmp_path / "store", shard_size=64)
+    for key, value in VALUES.items():
+        assert_equal(storage.read(key), value)
+    storage.close()
+
+
+def test_arrays_are_aligned(tmp_path):
+    storage = FlatStorage(path=tmp_path / "store", alignment=128)
+    storage.batch_write([b"a", b"b"], [np.ones(3), np.ones(5)])
+    for key in (b"a", b"b"):
+        (entry,) = storage.db.index[key].arrays
+        assert entry.offset % 128 == 0
+    storage.close()
+
+
+def test_overwrite_and_delete(tmp_path):
+    storage = FlatStorage(path=tmp_path / "store")
+    storage.batch_write([b"a", b"b"], [np.zeros(2), np.zeros(2)])
+    storage.batch_write([b"a"], [np.ones(3)])
+    storage.batch_delete([b"b"])
+    storage.close()
+
+    storage = FlatStorage(path=tmp_path / "store")
+    assert_equal(storage.read(b"a"), np.ones(3))
+    with pytest.raises(KeyError):
+        storage.read(b"b")
+    storage.close()
+
+
+def test_preallocated_space_is_given_back(tmp_path):
+    storage = FlatStorage(path=tmp_path / "store", shard_size=1 << 20)
+    storage.batch_write([b"a"], [np.ones(10, dtype=np.uint8)])
+    shard = storage.db.shard_path(0)
+    assert shard.stat().st_size == 1 << 20
+    storage.close()
+    assert shard.stat().st_size == 10
+
+
+def test_torn_index(tmp_path):
+    storage = FlatStorage(path=tmp_path / "store")
+    storage.batch_write([b"a"], [np.arange(3)])
+    storage.close()
+
+    # the process died while appending the next batch to the index
+    index = tmp_path / "store" / "index.log"
+    intact = index.stat().st_size
+    batch = pickle.dumps([(b"b", None), (b"c", None)])
+    with open(index, "ab") as f:
+        f.write(batch[: len(batch) // 2])
+
+    with pytest.warns(UserWarning, match="partly written"):
+        storage = FlatStorage(path=tmp_path / "store")
+    assert index.stat().st_size == intact
+    assert_equal(storage.read(b"a"), np.arange(3))
+
+    storage.batch_write([b"b"], [np.ones(2)])
+    storage.close()
+    storage = FlatStorage(path=tmp_path / "store")
+    assert_equal(storage.read(b"b"), np.ones(2))
+    storage.close()
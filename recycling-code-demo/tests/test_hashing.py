@@ -0,0 +1,93 @@
+import pytest
+import torch
+
+from helpers import assert_all_close, make_batches, make_model, record_and_use
+from s2re import CachingHook
+from s2re.context.wrapper import StorageWrapper
+
+
+def make_storage(path, **kwargs):
+    return StorageWrapper(
+        backend="flat", path=path, device="cpu", hash_keys=True, **kwargs
+    )
+
+
+def test_keys_are_digests(tmp_path):
+    storage = make_storage(tmp_path / "store")
+    key = torch.arange(512).unsqueeze(0)
+    (stored_key,) = storage._get_keys(key)
+    assert len(stored_key) == 16
+
+    value = torch.randn(1, 512, 4)
+    storage.store(key, value)
+    torch.testing.assert_close(storage.fetch(key), value)
+    storage.close()
+
+
+def test_digests_depend_on_content_shape_dtype_and_context(tmp_path):
+    storage = make_storage(tmp_path / "store", key_context="a")
+    other = make_storage(tmp_path / "other", key_context="b")
+    key = torch.tensor([[1, 2], [3, 4]])
+    keys = {
+        storage._get_keys(key)[0],
+        storage._get_keys(key.view(1, 4))[0],
+        storage._get_keys(key.int())[0],
+        storage._get_keys(key + 1)[0],
+        other._get_keys(key)[0],
+    }
+    assert len(keys) == 5
+    storage.close()
+    other.close()
+
+
+def test_hash_check_detects_collisions(tmp_path):
+    storage = make_storage(tmp_path / "store", hash_check=True)
+    key, other_key = torch.tensor([[1, 2, 3]]), torch.tensor([[4, 5, 6]])
+    storage.store(key, torch.randn(1, 3, 2))
+    storage.fetch(key)
+
+    # pretend that another key hashed to the same digest
+    (digest,) = storage._get_keys(key)
+    (raw_key,) = storage._get_keys(other_key, hashed=False)
+    storage.storage.batch_write(
+        [storage._check_key(digest)],
+        [torch.frombuffer(bytearray(raw_key), dtype=torch.uint8)],
+    )
+    with pytest.raises(KeyError):
+        storage.fetch(key)
+    storage.close()
+
+
+def test_hashed_model(tmp_path):
+    model = make_model()
+    expected, actual = record_and_use(
+        model,
+        tmp_path / "store",
+        make_batches(),
+        backend="flat",
+        hash_check=True,
+    )
+    assert_all_close(expected, actual)
+
+
+def test_key_context_identifies_the_checkpoint():
+    bert, scibert = make_model(), make_model()
+    bert.config._name_or_path = "bert-base-uncased"
+    scibert.config._name_or_path = "allenai/scibert_scivocab_uncased"
+    assert CachingHook.infer_key_context(
+        bert
+    ) != CachingHook.infer_key_context(scibert)
+    assert CachingHook.infer_key_context(
+        bert, checkpoint=False
+    ) == CachingHook.infer_key_context(scibert, checkpoint=False)
+
+
+def test_key_context_of_models_without_checkpoint():
+    model, same, other = make_model(), make_model(), make_model()
+    with torch.no_grad():
+        other.bert.embeddings.word_embeddings.weight.add_(1.0)
+        # layers above the cached one don't change cached values
+        same.classifier.weight.add_(1.0)
+    context = CachingHook.infer_key_context(model)
+    assert CachingHook.infer_key_context(same) == context
+    assert CachingHook.infer_key_context(other) != context
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from s2re.backend import BackendRegistry
+from s2re.backend.ingest import SortedRuns
+
+
+@pytest.mark.parametrize("max_open_runs", [2, 128])
+def test_last_write_or_delete_wins(tmp_path, max_open_runs):
+    # every other pair goes to a new run
+    runs = SortedRuns(
+        tmp_path / "runs", run_size=3, max_open_runs=max_open_runs
+    )
+    runs.add(b"c", b"1")
+    runs.add(b"a", b"1")
+    runs.add(b"b", b"1")
+    runs.delete(b"a")
+    runs.add(b"c", b"2")
+    runs.delete(b"d")
+    runs.add(b"b", b"2")
+    runs.delete(b"b")
+    runs.delete(b"e")
+    runs.add(b"e", b"")
+    assert len(runs) > 2
+
+    assert list(runs.merged()) == [
+        (b"a", None),
+        (b"b", None),
+        (b"c", b"2"),
+        (b"d", None),
+        (b"e", b""),
+    ]
+    runs.cleanup()
+    assert not (tmp_path / "runs").exists()
+
+
+def test_pending_pairs_are_replaced(tmp_path):
+    runs = SortedRuns(tmp_path / "runs", run_size=1 << 20)
+    runs.add(b"a", b"123")
+    runs.delete(b"a")
+    assert runs._pending_bytes == 1
+    runs.add(b"a", b"45")
+    assert runs._pending_bytes == 3
+    assert list(runs.merged()) == [(b"a", b"45")]
+
+
+def test_ingest_deletes(tmp_path):
+    if "rocksdict" not in BackendRegistry.all():
+        pytest.skip("rocksdict is not installed")
+    RocksDictStorage = BackendRegistry.get("rocksdict")
+    path = tmp_path / "store"
+
+    storage = RocksDictStorage(path=path)
+    storage.batch_write([b"a", b"b"], [np.zeros(2), np.zeros(2)])
+    storage.close()
+
+    storage = RocksDictStorage(path=path, ingest=True, ingest_run_size=64)
+    storage.batch_write([b"a", b"c"], [np.ones(2), np.ones(2)])
+    # deletes keys already in the database, and keys written before
+    storage.batch_delete([b"b", b"c"])
+    storage.batch_write([b"d"], [np.ones(2)])
+    storage.batch_delete([b"d"])
+    storage.batch_write([b"d"], [np.full(2, 2.0)])
+    storage.close()
+
+    storage = RocksDictStorage(path=path, read_only=True)
+    a, d = storage.batch_read([b"a", b"d"])
+    np.testing.assert_array_equal(a, np.ones(2))
+    np.testing.assert_array_equal(d, np.full(2, 2.0))
+    for key in (b"b", b"c"):
+        assert storage.db.get(storage.sr.key(key)) is None
+    storage.close()
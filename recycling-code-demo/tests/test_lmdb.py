@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+import torch
+
+from s2re.backend import BackendRegistry
+from s2re.context.wrapper import StorageWrapper
+
+pytest.importorskip("lmdb")
+LMDBStorage = BackendRegistry.get("lmdb")
+
+KEYS = [f"key-{i}".encode() for i in range(8)]
+
+
+def write(path, serialization="binary"):
+    storage = LMDBStorage(path=path, serialization=serialization)
+    storage.batch_write(
+        KEYS,
+        [
+            {"hidden": torch.full((2, 3), float(i)), "ids": np.arange(i)}
+            for i in range(len(KEYS))
+        ],
+    )
+    storage.close()
+
+
+@pytest.mark.parametrize("serialization", ["pickle", "binary"])
+@pytest.mark.parametrize("read_only", [False, True])
+def test_round_trip(tmp_path, serialization, read_only):
+    write(tmp_path / "store", serialization)
+    storage = LMDBStorage(
+        path=tmp_path / "store",
+        serialization=serialization,
+        read_only=read_only,
+    )
+    for i, value in enumerate(storage.batch_read(KEYS)):
+        torch.testing.assert_close(
+            value["hidden"], torch.full((2, 3), float(i))
+        )
+        np.testing.assert_array_equal(value["ids"], np.arange(i))
+    with pytest.raises(KeyError):
+        storage.batch_read([b"missing"])
+    storage.close()
+
+
+def test_read_values_are_writable_copies(tmp_path):
+    write(tmp_path / "store")
+    storage = LMDBStorage(
+        path=tmp_path / "store",
+        serialization="binary",
+        read_only=True,
+        max_readers=4,
+    )
+    # more batches than reader slots: no transaction is left open
+    batches = [storage.batch_read(KEYS) for _ in range(16)]
+    batches[0][1]["hidden"].add_(1)
+    batches[0][1]["ids"] += 1
+    (value,) = storage.batch_read(KEYS[1:2])
+    torch.testing.assert_close(value["hidden"], torch.ones(2, 3))
+    storage.close()
+    # values outlive the storage
+    torch.testing.assert_close(
+        batches[-1][2]["hidden"], torch.full((2, 3), 2.0)
+    )
+
+
+def test_views(tmp_path):
+    write(tmp_path / "store")
+    storage = LMDBStorage(
+        path=tmp_path / "store", serialization="binary", read_only=True
+    )
+    (value,) = storage.batch_read_views(KEYS[3:4])
+    assert not value["ids"].flags.writeable
+    np.testing.assert_array_equal(value["ids"], np.arange(3))
+    # the map stays open until the views are gone
+    storage.close()
+    torch.testing.assert_close(value["hidden"], torch.full((2, 3), 3.0))
+    del value
+
+
+@pytest.mark.parametrize("pin_memory", [False, True])
+def test_fetched_values_are_writable(tmp_path, pin_memory):
+    path = tmp_path / "store"
+    kwargs = dict(
+        backend="lmdb",
+        path=path,
+        device="cpu",
+        backend_kwargs={"serialization": "binary"},
+    )
+    key = torch.tensor([[1, 2, 3]])
+    storage = StorageWrapper(**kwargs)
+    storage.store(key, torch.zeros(1, 3, 2))
+    storage.close()
+
+    kwargs["backend_kwargs"]["read_only"] = True
+    storage = StorageWrapper(**kwargs, pin_memory=pin_memory)
+    storage.fetch(key).add_(1)
+    torch.testing.assert_close(storage.fetch(key), torch.zeros(1, 3, 2))
+    storage.close()
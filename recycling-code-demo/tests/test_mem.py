@@ -0,0 +1,76 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from s2re.backend import BackendRegistry
+from s2re.backend.mem import MemoryArena
+
+MemoryStorage = BackendRegistry.get("mem")
+
+
+@pytest.mark.parametrize("serialization", ["pickle", "binary"])
+def test_round_trip(serialization):
+    storage = MemoryStorage(serialization=serialization, chunk_size=256)
+    values = [torch.randn(4, 8) for _ in range(8)]
+    keys = [f"key-{i}".encode() for i in range(8)]
+    storage.batch_write(keys, values)
+    # values larger than a chunk get a chunk of their own
+    storage.batch_write([b"large"], [torch.randn(64, 8)])
+    assert len(storage.db.chunks) > 1
+
+    for value, fetched in zip(values, storage.batch_read(keys)):
+        torch.testing.assert_close(fetched, value)
+    storage.batch_delete(keys[:1])
+    with pytest.raises(KeyError):
+        storage.batch_read(keys[:1])
+    storage.close()
+
+
+def test_snapshots(tmp_path):
+    path = tmp_path / "store.bin"
+    storage = MemoryStorage(path=path, snapshot_every=4)
+    keys = [f"key-{i}".encode() for i in range(4)]
+    storage.batch_write(keys[:3], [np.zeros(256)] * 3)
+    assert not path.exists()
+    storage.batch_write(keys[3:], [np.zeros(256)])
+    assert MemoryArena.is_snapshot(path)
+
+    # overwritten and deleted values are not in the next snapshot
+    storage.batch_write(keys[:1], [np.ones(256)])
+    storage.batch_delete(keys[1:2])
+    storage.close()
+    assert path.stat().st_size < 4 * 256 * 8
+
+    storage = MemoryStorage(path=path)
+    np.testing.assert_array_equal(storage.read(keys[0]), np.ones(256))
+    with pytest.raises(KeyError):
+        storage.read(keys[1])
+    # new values are not written to the mapped snapshot until close
+    snapshot = path.read_bytes()
+    storage.batch_write([b"new"], [np.arange(4)])
+    assert path.read_bytes() == snapshot
+    storage.close()
+
+    storage = MemoryStorage(path=path)
+    np.testing.assert_array_equal(storage.read(b"new"), np.arange(4))
+    storage.close()
+
+
+def test_files_of_older_versions(tmp_path):
+    path = tmp_path / "store.pkl"
+    with open(path, "wb") as f:
+        for i in range(3):
+            pickle.dump((f"key-{i}".encode(), [np.full(2, i)]), f)
+
+    with pytest.warns(UserWarning, match="older version"):
+        storage = MemoryStorage(path=path, serialization="pickle")
+    (value,) = storage.read(b"key-1")
+    np.testing.assert_array_equal(value, np.full(2, 1))
+    storage.close()
+    assert MemoryArena.is_snapshot(path)
+
+    path.write_bytes(b"not a store")
+    with pytest.raises(ValueError):
+        MemoryStorage(path=path)
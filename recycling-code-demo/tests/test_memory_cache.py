@@ -0,0 +1,98 @@
+import torch
+
+from helpers import assert_all_close, make_batches, make_model, record_and_use
+from s2re.context.wrapper import MemoryCache, StorageWrapper
+
+
+def test_hits_misses_and_evictions():
+    cache = MemoryCache(max_bytes=100)
+    cache.put("a", "value a", nbytes=60)
+    assert cache.get("a") == "value a" and cache.get("b") is None
+    cache.put("b", "value b", nbytes=60)
+    # too large for the cache
+    cache.put("c", "value c", nbytes=200)
+    assert cache.get("a") is None and cache.get("c") is None
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 3,
+        "evictions": 1,
+        "entries": 1,
+        "nbytes": 60,
+    }
+
+
+def make_storage(path, **kwargs):
+    return StorageWrapper(
+        backend="flat",
+        path=path,
+        device="cpu",
+        memory_cache=1 << 20,
+        **kwargs,
+    )
+
+
+def test_cached_values_are_decoded_and_cast(tmp_path, monkeypatch):
+    storage = make_storage(
+        tmp_path / "store",
+        codec="int8",
+        cast_types_map={torch.float32: torch.float16},
+    )
+    key = torch.tensor([[1, 2, 3]])
+    value = torch.randn(1, 3, 8)
+    storage.store(key, value)
+    storage.close()
+
+    storage = make_storage(
+        tmp_path / "store",
+        cast_types_map={torch.float32: torch.float16},
+    )
+    fetched = storage.fetch(key)
+    ((cached, nbytes),) = storage.memory_cache._entries.values()
+    assert cached.dtype == torch.float16 and nbytes == 3 * 8 * 2
+    torch.testing.assert_close(fetched, cached)
+    torch.testing.assert_close(fetched, value.half(), atol=0.05, rtol=0)
+
+    # hits don't decode again
+    def decode(*_):
+        raise AssertionError("decoded a cached value")
+
+    monkeypatch.setattr("s2re.context.wrapper.decode", decode)
+    torch.testing.assert_close(storage.fetch(key), fetched)
+    assert storage.memory_cache.hits == 1
+    storage.close()
+
+
+def test_cached_values_own_their_memory(tmp_path):
+    storage = make_storage(tmp_path / "store")
+    key = torch.tensor([[1, 2, 3]])
+    value = {"hidden": torch.randn(1, 3, 4), "ids": key}
+    storage.store(key, value)
+    storage.close()
+
+    storage = make_storage(tmp_path / "store")
+    (raw,) = storage.storage.batch_read(storage._get_keys(key))
+    raw = storage._cast_value(raw, device="cpu")
+    fetched = storage.fetch(key)
+    ((cached, _),) = storage.memory_cache._entries.values()
+    # not views of the memory-mapped file
+    assert storage._data_ptrs(cached).isdisjoint(storage._data_ptrs(raw))
+    # nor handed out as they are
+    fetched["hidden"].add_(1)
+    torch.testing.assert_close(storage.fetch(key), value)
+    storage.close()
+
+
+def test_memory_cache_model(tmp_path):
+    model = make_model()
+    batches = make_batches()
+    cache = MemoryCache(max_bytes=1 << 20)
+    expected, actual = record_and_use(
+        model,
+        tmp_path / "store",
+        batches,
+        use_batches=batches + batches,
+        backend="flat",
+        memory_cache=cache,
+    )
+    assert_all_close(expected, actual)
+    assert cache.stats()["hits"] == len(batches)
@@ -0,0 +1,55 @@
+import torch
+
+from helpers import make_model
+from s2re import CachingHook
+from s2re.context.session import CachingSession
+from s2re.context.wrapper import StorageWrapper
+
+
+def test_namespaces_share_a_store(tmp_path):
+    key = torch.tensor([[1, 2, 3]])
+    values = {}
+    for namespace in ("a", "b"):
+        storage = StorageWrapper(
+            backend="flat",
+            path=tmp_path / "store",
+            device="cpu",
+            namespace=namespace,
+        )
+        values[namespace] = torch.randn(1, 3, 4)
+        storage.store(key, values[namespace])
+        storage.close()
+
+    for namespace in ("a", "b"):
+        storage = StorageWrapper(
+            backend="flat",
+            path=tmp_path / "store",
+            device="cpu",
+            namespace=namespace,
+        )
+        torch.testing.assert_close(storage.fetch(key), values[namespace])
+        storage.close()
+
+
+def test_namespace_identifies_the_checkpoint():
+    bert, scibert = make_model(), make_model()
+    bert.config._name_or_path = "bert-base-uncased"
+    scibert.config._name_or_path = "allenai/scibert_scivocab_uncased"
+
+    namespace = CachingHook.infer_namespace(bert, half_precision=True)
+    assert namespace["checkpoint"] == "bert-base-uncased"
+    assert namespace["half_precision"] is True
+    assert namespace != CachingHook.infer_namespace(
+        scibert, half_precision=True
+    )
+    assert CachingHook.infer_namespace(
+        bert, checkpoint=False
+    ) == CachingHook.infer_namespace(scibert, checkpoint=False)
+
+
+def test_format_namespace_ignores_order():
+    assert CachingSession.format_namespace(
+        {"a": 1, "b": 2}
+    ) == CachingSession.format_namespace({"b": 2, "a": 1})
+    assert CachingSession.format_namespace(None) == ""
+    assert CachingSession.format_namespace("name") == "name"
@@ -0,0 +1,57 @@
+import pytest
+import torch
+
+from helpers import assert_all_close, make_batches, make_model, record_and_use
+from s2re.context.wrapper import StorageWrapper
+
+
+def make_storage(path):
+    return StorageWrapper(
+        backend="flat", path=path, device="cpu", per_example_keys=True
+    )
+
+
+def test_batches_are_reassembled(tmp_path):
+    storage = make_storage(tmp_path / "store")
+    key = torch.tensor([[5, 6, 7], [8, 9, 0], [3, 0, 0]])
+    hidden, pooled = torch.randn(3, 3, 4), torch.randn(3, 4)
+    storage.store(key, {"hidden": hidden, "pooled": pooled})
+    # one key per example
+    assert len(storage.storage.db.index) == 3
+
+    # other batch sizes, orders and padding find the same examples
+    other_key = torch.tensor([[3, 0, 0, 0], [5, 6, 7, 0]])
+    fetched = storage.fetch(other_key)
+    torch.testing.assert_close(fetched["pooled"], pooled[[2, 0]])
+    expected = torch.zeros(2, 4, 4)
+    expected[0, :1] = hidden[2, :1]
+    expected[1, :3] = hidden[0]
+    torch.testing.assert_close(fetched["hidden"], expected)
+    storage.close()
+
+
+def test_keys_must_be_batched(tmp_path):
+    storage = make_storage(tmp_path / "store")
+    with pytest.raises(ValueError):
+        storage.store(torch.tensor([1, 2, 3]), torch.randn(3, 4))
+    storage.close()
+
+
+def test_shuffled_batches(tmp_path):
+    model = make_model()
+    batches = make_batches(num_batches=2, batch_size=4)
+    # the same examples, batched differently
+    examples = [
+        {k: v[i : i + 1] for k, v in b.items()}
+        for b in batches
+        for i in range(4)
+    ][::-1]
+    expected, actual = record_and_use(
+        model,
+        tmp_path / "store",
+        batches,
+        use_batches=examples,
+        backend="flat",
+        per_example_keys=True,
+    )
+    assert_all_close(expected, actual)
@@ -0,0 +1,127 @@
+import random
+import time
+
+import numpy as np
+import pytest
+import torch
+
+from s2re.backend import BackendRegistry
+from s2re.context.wrapper import (
+    FetchAheadStorageWrapper,
+    MultiprocessingFetchAheadStorageWrapper,
+    SharedMemoryRing,
+    SharedSlot,
+    StorageWrapper,
+)
+
+NUM_ELEMENTS = 12
+
+
+def write(path):
+    storage = StorageWrapper(backend="flat", path=path, device="cpu")
+    for i in range(NUM_ELEMENTS):
+        storage.store(torch.tensor([[i, i + 1]]), torch.full((1, 2, 3), i))
+    storage.close()
+
+
+def prefetch(path, **kwargs):
+    """Prefetches all elements; returns them and their fetched values,
+    in the order they were yielded."""
+    storage = FetchAheadStorageWrapper(
+        backend="flat",
+        path=path,
+        device="cpu",
+        fetch_key_fn=lambda elem: elem["key"],
+        **kwargs,
+    )
+    elements = [
+        {"index": i, "key": torch.tensor([[i, i + 1]])}
+        for i in range(NUM_ELEMENTS)
+    ]
+    yielded, values = [], []
+    for elem in storage.prefetch(elements):
+        # the store holds at most `fetch_ahead` values
+        assert len(storage._fetched_store) <= kwargs["fetch_ahead"]
+        yielded.append(elem["index"])
+        values.append(storage.fetch(elem["key"]))
+    storage.close()
+    return yielded, values
+
+
+def test_prefetch(tmp_path):
+    write(tmp_path / "store")
+    yielded, values = prefetch(tmp_path / "store", fetch_ahead=3)
+    assert yielded == list(range(NUM_ELEMENTS))
+    for i, value in enumerate(values):
+        torch.testing.assert_close(value, torch.full((1, 2, 3), i))
+
+
+def test_consumer_is_woken_up_right_away(tmp_path):
+    write(tmp_path / "store")
+    start = time.monotonic()
+    # with a long timeout, sleeping between checks of the store would
+    # take at least that long
+    prefetch(tmp_path / "store", fetch_ahead=1, timeout=1.0)
+    assert time.monotonic() - start < 1.0
+
+
+@pytest.mark.parametrize("fetch_workers", [2, 4])
+def test_workers_deliver_in_order(tmp_path, monkeypatch, fetch_workers):
+    write(tmp_path / "store")
+    FlatStorage = BackendRegistry.get("flat")
+    batch_read = FlatStorage.batch_read
+    generator = random.Random(0)
+
+    def slow_batch_read(self, keys):
+        # reads finish out of order
+        time.sleep(generator.uniform(0, 0.02))
+        return batch_read(self, keys)
+
+    monkeypatch.setattr(FlatStorage, "batch_read", slow_batch_read)
+    yielded, values = prefetch(
+        tmp_path / "store", fetch_ahead=4, fetch_workers=fetch_workers
+    )
+    assert yielded == list(range(NUM_ELEMENTS))
+    for i, value in enumerate(values):
+        torch.testing.assert_close(value, torch.full((1, 2, 3), i))
+
+
+def test_shared_memory_ring():
+    ring = SharedMemoryRing(num_slots=2, slot_size=1 << 10)
+    value = {"hidden": torch.randn(2, 3), "ids": np.arange(4)}
+    slot = ring.write(value)
+    assert isinstance(slot, SharedSlot)
+
+    copy = ring.read(slot, copy=True)
+    view = ring.read(slot)
+    ring.release(slot)
+    # values too large for a slot are passed as they are
+    large = torch.randn(1 << 10)
+    assert ring.write(large) is large
+
+    # the slot is written again once released
+    slot = ring.write({"hidden": torch.zeros(2, 3), "ids": np.zeros(4)})
+    torch.testing.assert_close(copy["hidden"], value["hidden"])
+    np.testing.assert_array_equal(view["ids"], np.zeros(4))
+    del view
+    ring.release(slot)
+    ring.close()
+
+
+def test_processes(tmp_path):
+    write(tmp_path / "store")
+    storage = MultiprocessingFetchAheadStorageWrapper(
+        backend="flat",
+        path=tmp_path / "store",
+        device="cpu",
+        fetch_ahead=3,
+        fetch_key_fn=lambda elem: elem,
+        fetch_workers=2,
+        timeout=1.0,
+    )
+    keys = [torch.tensor([[i, i + 1]]) for i in range(NUM_ELEMENTS)]
+    for i, key in enumerate(storage.prefetch(keys)):
+        torch.testing.assert_close(
+            storage.fetch(key), torch.full((1, 2, 3), i)
+        )
+    storage.close()
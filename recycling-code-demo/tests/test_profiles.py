@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from s2re.backend import BackendRegistry, RocksDBProfile
+from s2re.backend.profiles import block_size_for, get_rocksdb_profile
+
+
+def test_block_size_for():
+    profile = get_rocksdb_profile("random_read")
+    assert block_size_for(profile) == 4 << 10
+    assert block_size_for(profile, value_size=5000) == 8 << 10
+    assert block_size_for(profile, value_size=1 << 30) == 4 << 20
+    # profiles setting a block size keep it
+    assert block_size_for(RocksDBProfile(block_size=1 << 16), 5000) == 1 << 16
+
+
+def test_get_rocksdb_profile():
+    profile = RocksDBProfile(sync=True)
+    assert get_rocksdb_profile(profile) is profile
+    assert get_rocksdb_profile(None) is None
+    with pytest.raises(ValueError, match="random_read"):
+        get_rocksdb_profile("fast")
+
+
+@pytest.mark.parametrize("profile", ["random_read", "sequential_scan"])
+def test_bulk_load_then_read(tmp_path, profile):
+    if "rocksdict" not in BackendRegistry.all():
+        pytest.skip("rocksdict is not installed")
+    Storage = BackendRegistry.get("rocksdict")
+    keys = [f"key-{i}".encode() for i in range(16)]
+
+    storage = Storage(path=tmp_path / "store", profile="bulk_load")
+    storage.batch_write(keys, [np.full(256, i) for i in range(len(keys))])
+    storage.batch_delete(keys[:1])
+    storage.close()
+
+    storage = Storage(
+        path=tmp_path / "store", profile=profile, value_size=256 * 8
+    )
+    for i, value in enumerate(storage.batch_read(keys[1:]), 1):
+        np.testing.assert_array_equal(value, np.full(256, i))
+    assert storage.db.get(storage.sr.key(keys[0])) is None
+    storage.close()
@@ -0,0 +1,80 @@
+import torch
+
+from helpers import (
+    assert_all_close,
+    make_batches,
+    make_model,
+    record_and_use,
+)
+from s2re import CachingHook
+from s2re.context.wrapper import StorageWrapper
+
+
+def test_padding_is_not_stored(tmp_path):
+    storage = StorageWrapper(
+        backend="flat", path=tmp_path / "store", device="cpu", ragged=True
+    )
+    key = torch.tensor([[5, 6, 7, 0], [8, 0, 0, 0]])
+    value = torch.randn(2, 4, 3)
+    storage.store(key, value)
+
+    (stored,) = storage.storage.batch_read(storage._get_keys(key))
+    assert stored.shape == (4, 3)
+
+    fetched = storage.fetch(key)
+    mask = (key != 0).unsqueeze(-1)
+    torch.testing.assert_close(fetched, value * mask)
+    storage.close()
+
+
+def test_only_padded_tensors_are_repadded(tmp_path):
+    storage = StorageWrapper(
+        backend="flat", path=tmp_path / "store", device="cpu", ragged=True
+    )
+    hidden, pooled = torch.randn(2, 3, 4), torch.randn(2, 4)
+    key = torch.tensor([[5, 6, 0], [8, 9, 10]])
+    other_key = torch.tensor([[5, 6, 7], [8, 0, 0]])
+    # pooled outputs have no sequence dimension, and are stored as is
+    storage.store(key, {"hidden": hidden, "pooled": pooled})
+    storage.store(other_key, [hidden, pooled])
+
+    fetched = storage.fetch(key)
+    torch.testing.assert_close(
+        fetched["hidden"], hidden * (key != 0)[..., None]
+    )
+    torch.testing.assert_close(fetched["pooled"], pooled)
+
+    fetched_hidden, fetched_pooled = storage.fetch(other_key)
+    torch.testing.assert_close(
+        fetched_hidden, hidden * (other_key != 0)[..., None]
+    )
+    torch.testing.assert_close(fetched_pooled, pooled)
+    storage.close()
+
+
+def test_ragged_model(tmp_path):
+    model = make_model()
+    batches = make_batches()
+    expected, actual = record_and_use(
+        model, tmp_path / "store", batches, backend="flat", ragged=True
+    )
+    # padded positions come back as zeros, which only changes the
+    # hidden states of padding
+    assert_all_close(expected, actual)
+
+
+def test_pad_token_id_defaults_to_the_config(tmp_path):
+    model = make_model(pad_token_id=1)
+    assert CachingHook.infer_pad_token_id(model) == 1
+
+    # token 0 is a real token (e.g. RoBERTa's <s>), and must be kept
+    batches = [
+        {
+            "input_ids": torch.tensor([[0, 5, 6, 1], [0, 7, 1, 1]]),
+            "attention_mask": torch.tensor([[1, 1, 1, 0], [1, 1, 0, 0]]),
+        }
+    ]
+    expected, actual = record_and_use(
+        model, tmp_path / "store", batches, backend="flat", ragged=True
+    )
+    assert_all_close(expected, actual)
@@ -0,0 +1,130 @@
+import os
+import socket
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from s2re.backend import BackendRegistry
+from s2re.backend.leveldb import LevelDBReader
+
+BACKENDS = ["dbm", "flat", "leveldb", "mem", "rocksdict"]
+
+
+def write(backend, path):
+    storage = BackendRegistry.get(backend)(path=path)
+    storage.batch_write([b"a", b"b"], [np.arange(3), np.ones(2)])
+    storage.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_readers_open_at_once(tmp_path, backend):
+    if backend not in BackendRegistry.all():
+        pytest.skip(f"{backend} is not installed")
+    write(backend, tmp_path / "store")
+
+    readers = [
+        BackendRegistry.get(backend)(path=tmp_path / "store", read_only=True)
+        for _ in range(2)
+    ]
+    for reader in readers:
+        a, b = reader.batch_read([b"a", b"b"])
+        np.testing.assert_array_equal(a, np.arange(3))
+        np.testing.assert_array_equal(b, np.ones(2))
+    with pytest.raises(Exception):
+        readers[0].batch_write([b"c"], [np.ones(1)])
+    for reader in readers:
+        reader.close()
+
+
+LevelDBStorage = BackendRegistry.get("leveldb")
+
+
+def copies(path):
+    return list(path.parent.glob(f".{path.name}-reader-*"))
+
+
+def test_leveldb_readers_share_a_copy(tmp_path):
+    path = tmp_path / "store"
+    write("leveldb", path)
+
+    first = LevelDBStorage(path=path, read_only=True)
+    second = LevelDBStorage(path=path, read_only=True)
+    assert first.db is second.db and len(copies(path)) == 1
+
+    first.close()
+    # closing twice must not close the database the other reader uses
+    first.close()
+    np.testing.assert_array_equal(second.read(b"a"), np.arange(3))
+    second.close()
+    assert copies(path) == []
+
+
+def open_reader(path, *statements):
+    """Runs a process that opens a reader of `path`, prints its copy,
+    and runs `statements`."""
+    code = "; ".join(
+        [
+            "from s2re.backend.leveldb import LevelDBReader",
+            f"reader = LevelDBReader.acquire(__import__('pathlib').Path("
+            f"{str(path)!r}))",
+            "print(reader.copy_path, flush=True)",
+            *statements,
+        ]
+    )
+    return subprocess.Popen(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+
+
+def test_leveldb_stale_copies(tmp_path):
+    path = tmp_path / "store"
+    write("leveldb", path)
+
+    # a process that was killed leaves its copy behind
+    killed = open_reader(path, "import time", "time.sleep(60)")
+    killed_copy = killed.stdout.readline().strip()
+    killed.kill()
+    killed.wait()
+
+    # a process that is still running keeps its copy
+    running = open_reader(path, "import time", "time.sleep(60)")
+    running_copy = running.stdout.readline().strip()
+
+    # as does a process on another host, even with the same pid
+    other_host = path.parent / f".{path.name}-reader-elsewhere"
+    other_host.mkdir()
+    (other_host / LevelDBReader.OWNER_FILE).write_text(
+        socket.gethostname() + "-elsewhere"
+    )
+
+    reader = LevelDBStorage(path=path, read_only=True)
+    remaining = {str(c) for c in copies(path)}
+    assert killed_copy not in remaining
+    assert running_copy in remaining
+    assert str(other_host) in remaining
+    reader.close()
+    running.kill()
+    running.wait()
+
+
+def test_leveldb_copy_failures_raise(tmp_path, monkeypatch):
+    path = tmp_path / "store"
+    storage = LevelDBStorage(path=path)
+    storage.batch_write([b"a"], [np.arange(3)])
+    # moves the values from the log to a table file
+    storage.db.compact_range()
+    storage.close()
+    assert list(path.glob("*.ldb"))
+
+    def link(src, dst):
+        raise OSError("hard links are not supported")
+
+    monkeypatch.setattr("os.link", link)
+    with pytest.raises(OSError):
+        LevelDBStorage(path=path, read_only=True)
+    assert copies(path) == []
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import torch
+
+from s2re.backend.serialization import (
+    BinarySerialization,
+    PickleSerialization,
+)
+
+
+def assert_equal(a, b):
+    if isinstance(a, dict):
+        assert list(a) == list(b)
+        for k in a:
+            assert_equal(a[k], b[k])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_equal(x, y)
+    else:
+        assert type(a) is type(b)
+        assert a.dtype == b.dtype and tuple(a.shape) == tuple(b.shape)
+        if isinstance(a, torch.Tensor):
+            assert torch.equal(a, b)
+        else:
+            np.testing.assert_array_equal(a, b)
+
+
+VALUES = [
+    torch.randn(3, 5),
+    np.arange(12, dtype=np.int16).reshape(3, 4),
+    torch.randn(2, 3).to(torch.bfloat16),
+    torch.zeros(0, 4),
+    np.array(3.5),
+    {"hidden": torch.randn(2, 4), "mask": np.ones((2, 3), dtype=bool)},
+    [torch.randn(4), [np.arange(3), {"a": torch.ones(1)}]],
+]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_round_trip(value):
+    buffer = BinarySerialization.serialize(value)
+    assert_equal(value, BinarySerialization.deserialize(buffer))
+
+
+def test_arrays_from_bytes_are_writable():
+    buffer = BinarySerialization.serialize(
+        {"a": np.zeros(4), "b": [np.ones(2)]}
+    )
+    value = BinarySerialization.deserialize(buffer)
+    value["a"] += 1
+    value["b"][0] += 1
+    np.testing.assert_array_equal(value["a"], np.ones(4))
+    # the buffer itself is left alone
+    assert_equal(
+        BinarySerialization.deserialize(buffer),
+        {"a": np.zeros(4), "b": [np.ones(2)]},
+    )
+
+
+def test_writable_buffers_are_shared():
+    buffer = bytearray(BinarySerialization.serialize(np.zeros(4)))
+    BinarySerialization.deserialize(buffer)[:] = 1
+    np.testing.assert_array_equal(
+        BinarySerialization.deserialize(buffer), np.ones(4)
+    )
+
+
+def test_read_only_views():
+    buffer = BinarySerialization.serialize(np.zeros(4))
+    value = BinarySerialization.deserialize(buffer, writable=False)
+    assert not value.flags.writeable
+    assert np.shares_memory(value, np.frombuffer(buffer, dtype=np.uint8))
+
+
+def test_reads_pickled_values():
+    value = {"a": torch.randn(2, 2), "b": np.arange(3)}
+    buffer = PickleSerialization.serialize(value)
+    assert_equal(value, BinarySerialization.deserialize(buffer))
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_serialize_into(value):
+    size = BinarySerialization.serialized_size(value)
+    buffer = bytearray(size + 16)
+    assert BinarySerialization.serialize_into(value, buffer) == size
+    assert bytes(buffer[:size]) == BinarySerialization.serialize(value)
+    assert_equal(
+        BinarySerialization.deserialize(memoryview(buffer)[:size]), value
+    )
+
+
+def test_serialize_into_a_small_buffer():
+    value = torch.randn(4, 4)
+    buffer = bytearray(BinarySerialization.serialized_size(value) - 1)
+    with pytest.raises(ValueError):
+        BinarySerialization.serialize_into(value, buffer)
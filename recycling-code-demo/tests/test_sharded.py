@@ -0,0 +1,70 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from s2re.backend import BackendRegistry
+
+ShardedStorage = BackendRegistry.get("sharded")
+
+
+def write(path, **kwargs):
+    storage = ShardedStorage(path=path, backend="flat", **kwargs)
+    storage.batch_write(
+        [bytes([i]) for i in range(8)],
+        [np.full(4, i, dtype=np.float32) for i in range(8)],
+    )
+    storage.close()
+
+
+def check(path, **kwargs):
+    storage = ShardedStorage(
+        path=path, backend="flat", read_only=True, **kwargs
+    )
+    values = storage.batch_read([bytes([i]) for i in range(8)])
+    storage.close()
+    for i, value in enumerate(values):
+        np.testing.assert_array_equal(value, np.full(4, i))
+
+
+def test_reopen_from_another_directory(tmp_path, monkeypatch):
+    (tmp_path / "elsewhere").mkdir()
+    monkeypatch.chdir(tmp_path)
+    write("store")
+
+    monkeypatch.chdir(tmp_path / "elsewhere")
+    check(tmp_path / "store")
+    files = list(ShardedStorage.files(tmp_path / "store"))
+    assert len(files) > 1 and all(f.exists() for f in files)
+
+
+def test_move(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("store")
+    shutil.move("store", "moved")
+    check(tmp_path / "moved")
+
+
+def test_explicit_shard_paths(tmp_path, monkeypatch):
+    (tmp_path / "elsewhere").mkdir()
+    monkeypatch.chdir(tmp_path)
+    write("store", shard_paths=["disk-a", "disk-b"])
+
+    monkeypatch.chdir(tmp_path / "elsewhere")
+    check(tmp_path / "store")
+    assert os.path.exists(tmp_path / "disk-a")
+
+
+def test_reopen_without_layout_arguments(tmp_path):
+    write(tmp_path / "store", num_shards=3)
+    storage = ShardedStorage(path=tmp_path / "store", read_only=True)
+    assert storage.backend == "flat" and storage.num_shards == 3
+    storage.close()
+
+
+@pytest.mark.parametrize("kwargs", [{"num_shards": 8}, {"backend": "leveldb"}])
+def test_reopen_with_another_layout(tmp_path, kwargs):
+    write(tmp_path / "store")
+    with pytest.raises(ValueError):
+        ShardedStorage(path=tmp_path / "store", read_only=True, **kwargs)
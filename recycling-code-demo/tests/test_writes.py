@@ -0,0 +1,109 @@
+import pytest
+import torch
+
+from helpers import assert_all_close, make_batches, make_model, record_and_use
+from s2re.context.wrapper import StorageWrapper, WriteBehindStorageWrapper
+
+
+def make_storage(path, **kwargs):
+    return WriteBehindStorageWrapper(
+        backend="flat", path=path, device="cpu", **kwargs
+    )
+
+
+def test_flush_writes_queued_values(tmp_path):
+    storage = make_storage(tmp_path / "store", write_behind=4)
+    keys = [torch.tensor([[i, i + 1]]) for i in range(8)]
+    values = [torch.randn(1, 2, 3, requires_grad=True) for _ in keys]
+    for key, value in zip(keys, values):
+        storage.store(key, value * 2)
+
+    storage.flush()
+    for key, value in zip(keys, values):
+        fetched = storage.fetch(key)
+        assert not fetched.requires_grad
+        torch.testing.assert_close(fetched, value.detach() * 2)
+    storage.close()
+
+    with pytest.raises(RuntimeError):
+        storage.store(keys[0], values[0])
+
+
+def test_write_errors_are_raised_by_the_caller(tmp_path, monkeypatch):
+    storage = make_storage(tmp_path / "store", write_behind=2)
+
+    def batch_write(keys, values):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(storage.storage, "batch_write", batch_write)
+    storage.store(torch.tensor([[1, 2]]), torch.randn(1, 2, 3))
+    with pytest.raises(RuntimeError) as info:
+        storage.flush()
+    assert isinstance(info.value.__cause__, OSError)
+    storage.close()
+
+
+def test_write_behind_model(tmp_path):
+    model = make_model()
+    expected, actual = record_and_use(
+        model,
+        tmp_path / "store",
+        make_batches(),
+        backend="flat",
+        record_kwargs={"write_behind": 2},
+    )
+    assert_all_close(expected, actual)
+
+
+def spy_writes(storage, monkeypatch):
+    """Records the keys of every batch written to the backend."""
+    batches = []
+    batch_write = storage.storage.batch_write
+
+    def spy(keys, values):
+        batches.append(list(keys))
+        batch_write(keys, values)
+
+    monkeypatch.setattr(storage.storage, "batch_write", spy)
+    return batches
+
+
+def test_writes_are_coalesced(tmp_path, monkeypatch):
+    storage = StorageWrapper(
+        backend="flat",
+        path=tmp_path / "store",
+        device="cpu",
+        write_batch_size=3,
+    )
+    batches = spy_writes(storage, monkeypatch)
+    keys = [torch.tensor([[i]]) for i in range(4)]
+    storage.store(keys[0], torch.zeros(1, 1, 2))
+    # stored again before it was written: only the last value is
+    storage.store(keys[0], torch.ones(1, 1, 2))
+    storage.store(keys[1], torch.ones(1, 1, 2))
+    assert batches == []
+    storage.store(keys[2], torch.ones(1, 1, 2))
+    assert [len(b) for b in batches] == [3]
+
+    # fetching writes what is pending first
+    storage.store(keys[3], torch.ones(1, 1, 2))
+    torch.testing.assert_close(storage.fetch(keys[0]), torch.ones(1, 1, 2))
+    torch.testing.assert_close(storage.fetch(keys[3]), torch.ones(1, 1, 2))
+    assert [len(b) for b in batches] == [3, 1]
+    storage.close()
+
+
+def test_writes_are_coalesced_by_size(tmp_path, monkeypatch):
+    storage = StorageWrapper(
+        backend="flat",
+        path=tmp_path / "store",
+        device="cpu",
+        write_batch_bytes=100,
+    )
+    batches = spy_writes(storage, monkeypatch)
+    for i in range(5):
+        # 40 bytes each
+        storage.store(torch.tensor([[i]]), torch.zeros(1, 1, 10))
+    assert [len(b) for b in batches] == [3]
+    storage.close()
+    assert [len(b) for b in batches] == [3, 2]